@@ -0,0 +1,293 @@
+"""
+命令列批次工具：資料夾增強、批次壓縮、熱資料夾監看與 HTTP API。
+只匯入處理核心，不會載入 gradio，適合在 cron 或工作容器中執行。
+
+    python PhotoCLI.py enhance input_images output_images --workers 8 --incremental
+    python PhotoCLI.py enhance archive enhanced --recursive --shard 2/8
+    python PhotoCLI.py compress photos/ -o compressed --target-kb 300 --webp
+    python PhotoCLI.py compress photos/ -o gallery --webp --renditions 2048:400,1024:150,512:60,256
+    python PhotoCLI.py enhance-compress input_images web --format webp --target-kb 300
+    python PhotoCLI.py watch dropbox enhanced --format jpeg --target-kb 500 --workers 4
+    python PhotoCLI.py serve --port 8080 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+
+def _add_enhance_params(parser):
+    from PhotoEnhancer import DEFAULT_PARAMS, HIGHLIGHT_METHODS
+
+    parser.add_argument("input_folder", help="輸入資料夾")
+    parser.add_argument("output_folder", help="輸出資料夾")
+    group = parser.add_argument_group("增強參數")
+    group.add_argument("--exposure", type=float, default=DEFAULT_PARAMS["exposure"])
+    group.add_argument("--dehaze-ratio", type=float, default=DEFAULT_PARAMS["dehaze_ratio"])
+    group.add_argument("--highlight-method", choices=HIGHLIGHT_METHODS,
+                       default=DEFAULT_PARAMS["highlight_method"])
+    group.add_argument("--curve-threshold", type=int, default=DEFAULT_PARAMS["curve_threshold"])
+    group.add_argument("--curve-softness", type=float, default=DEFAULT_PARAMS["curve_softness"])
+    group.add_argument("--limited-threshold", type=int, default=DEFAULT_PARAMS["limited_threshold"])
+    group.add_argument("--limited-softness", type=float, default=DEFAULT_PARAMS["limited_softness"])
+    group.add_argument("--blend-threshold", type=int, default=DEFAULT_PARAMS["blend_threshold"])
+    group.add_argument("--blend-strength", type=float, default=DEFAULT_PARAMS["blend_strength"])
+    group.add_argument("--blend-radius", type=int, default=DEFAULT_PARAMS["blend_radius"])
+    group.add_argument("--sat-strength", type=float, default=DEFAULT_PARAMS["sat_strength"])
+
+
+def _add_enumerate_args(group):
+    from PhotoFiles import parse_shard
+
+    group.add_argument("--recursive", action="store_true", help="一併處理子資料夾，輸出沿用相同的目錄結構")
+    group.add_argument("--shard", metavar="I/N", type=parse_shard, default=None,
+                       help="只處理第 I 片（共 N 片，依相對路徑雜湊分配），供多台機器分攤同一份資料")
+
+
+def _add_enhance_args(parser):
+    _add_enhance_params(parser)
+    group = parser.add_argument_group("執行方式")
+    _add_enumerate_args(group)
+    group.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    group.add_argument("--executor", choices=("thread", "process", "pipeline"), default="thread")
+    group.add_argument("--read-depth", type=int, default=4)
+    group.add_argument("--write-depth", type=int, default=4)
+    group.add_argument("--incremental", action="store_true", help="只處理新增或變更的圖片")
+    group.add_argument("--verify-content", action="store_true", help="增量模式下另以 SHA-256 比對內容")
+    group.add_argument("--tile-size", type=int, default=None, help="分塊處理的區塊邊長（超大圖用）")
+    group.add_argument("--max-side", type=int, default=None,
+                       help="輸出的長邊上限；JPEG 會直接以縮小尺寸解碼")
+
+
+def run_enhance(args):
+    from PhotoEnhancer import (DEFAULT_PARAMS, PipelineStats, process_folder,
+                               summarize_folder_results)
+
+    params = [getattr(args, name) for name in DEFAULT_PARAMS]
+    stats = PipelineStats()
+    results = process_folder(args.input_folder, args.output_folder, *params,
+                             workers=args.workers, executor=args.executor,
+                             read_depth=args.read_depth, write_depth=args.write_depth,
+                             stats=stats, incremental=args.incremental,
+                             verify_content=args.verify_content, tile_size=args.tile_size,
+                             max_side=args.max_side, recursive=args.recursive,
+                             shard=args.shard)
+    print(summarize_folder_results(results))
+    if args.executor == "pipeline":
+        print(stats.summary())
+    return 1 if any(ok is False for _, ok, _ in results) else 0
+
+
+def _add_compress_args(parser):
+    parser.add_argument("inputs", nargs="+", help="圖片檔案或資料夾（資料夾內的 PNG/JPG/JPEG）")
+    parser.add_argument("-o", "--output", required=True, help="輸出資料夾")
+    parser.add_argument("--target-kb", type=float, default=500, help="目標檔案大小 (KB)")
+    parser.add_argument("--webp", action="store_true", help="轉換為 WebP 格式")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="平行壓縮的行程數")
+    parser.add_argument("--timeout", type=float, default=None, help="單一檔案的處理秒數上限")
+    parser.add_argument("--report", help="匯出每個檔案的結果紀錄（.json 或 .csv）")
+    parser.add_argument("--renditions", metavar="SPEC", type=_parse_renditions,
+                        help="一次解碼產生多個尺寸，例如 2048:400,1024:150,512:60,256"
+                             "（長邊[:目標 KB]，full 為原尺寸）；指定時忽略 --target-kb")
+
+
+def _parse_renditions(text):
+    from PhotoCompressor import parse_renditions
+
+    return parse_renditions(text)
+
+
+def _expand_inputs(inputs):
+    from PhotoFiles import iter_image_files
+
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths += sorted(path for path, _ in iter_image_files(item))
+        else:
+            paths.append(item)
+    return paths
+
+
+def run_compress(args):
+    from PhotoCompressor import iter_batch_compression, export_records
+
+    paths = _expand_inputs(args.inputs)
+    records = []
+    if args.renditions:
+        _run_renditions(paths, args, records)
+    else:
+        for chunk in iter_batch_compression(paths, args.output, args.target_kb, args.webp,
+                                            workers=args.workers, timeout=args.timeout, records=records):
+            print(chunk, end="", flush=True)
+    if args.report:
+        export_records(records, args.report)
+    return 1 if any(r["status"] == "failed" for r in records) else 0
+
+
+def _run_renditions(paths, args, records):
+    from PhotoCompressor import iter_rendition_results, summarize_records
+
+    os.makedirs(args.output, exist_ok=True)
+    jobs = []
+    for path in paths:
+        stem, ext = os.path.splitext(os.path.basename(path))
+        mode = "webp" if args.webp else "png" if ext.lower() == ".png" else "jpeg"
+        jobs.append((path, os.path.join(args.output, stem + {"webp": ".webp", "png": ".png"}.get(mode, ext)), mode))
+    done = 0
+    for file_log, file_records in iter_rendition_results(jobs, args.renditions, workers=args.workers,
+                                                          timeout=args.timeout):
+        records.extend(file_records)
+        done += 1
+        print(f"[{done}/{len(jobs)}] " + file_log, end="", flush=True)
+    print(summarize_records(records, len(jobs)), flush=True)
+
+
+def _add_enhance_compress_args(parser):
+    from PhotoPipeline import OUTPUT_FORMATS
+
+    _add_enhance_params(parser)
+    group = parser.add_argument_group("壓縮與執行方式")
+    _add_enumerate_args(group)
+    group.add_argument("--format", choices=OUTPUT_FORMATS, default="auto",
+                       help="輸出格式；auto 依輸入副檔名（PNG 輸出 PNG，其餘輸出 JPEG）")
+    group.add_argument("--target-kb", type=float, default=500, help="目標檔案大小 (KB)")
+    group.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="平行處理的行程數")
+    group.add_argument("--timeout", type=float, default=None, help="單一檔案的處理秒數上限")
+    group.add_argument("--tile-size", type=int, default=None, help="分塊處理的區塊邊長（超大圖用）")
+    group.add_argument("--max-side", type=int, default=None,
+                       help="輸出的長邊上限；JPEG 會直接以縮小尺寸解碼")
+    group.add_argument("--report", help="匯出每個檔案的結果紀錄（.json 或 .csv）")
+
+
+def run_enhance_compress(args):
+    from PhotoEnhancer import DEFAULT_PARAMS
+    from PhotoCompressor import export_records
+    from PhotoPipeline import iter_enhance_compress
+
+    params = [getattr(args, name) for name in DEFAULT_PARAMS]
+    records = []
+    for chunk in iter_enhance_compress(args.input_folder, args.output_folder, params,
+                                       output_format=args.format, target_kb=args.target_kb,
+                                       workers=args.workers, timeout=args.timeout,
+                                       tile_size=args.tile_size, max_side=args.max_side,
+                                       records=records, recursive=args.recursive,
+                                       shard=args.shard):
+        print(chunk, end="", flush=True)
+    if args.report:
+        export_records(records, args.report)
+    return 1 if any(r["status"] == "failed" for r in records) else 0
+
+
+def _add_watch_args(parser):
+    from PhotoPipeline import OUTPUT_FORMATS
+    from PhotoWatch import SETTLE_SECONDS, POLL_INTERVAL
+
+    _add_enhance_params(parser)
+    group = parser.add_argument_group("監看與輸出")
+    group.add_argument("--format", choices=("none",) + OUTPUT_FORMATS, default="none",
+                       help="none 只增強；其他格式增強後直接壓縮到 --target-kb")
+    group.add_argument("--target-kb", type=float, default=500, help="目標檔案大小 (KB)")
+    group.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="常駐的處理行程數")
+    group.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                       help="檔案大小與修改時間維持不變多少秒才開始處理")
+    group.add_argument("--backend", choices=("auto", "inotify", "poll"), default="auto",
+                       help="偵測方式；網路磁碟請用 poll")
+    group.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="poll 模式的掃描間隔（秒）")
+    group.add_argument("--no-existing", action="store_true", help="不處理啟動前已在資料夾中的圖片")
+    group.add_argument("--tile-size", type=int, default=None, help="分塊處理的區塊邊長（超大圖用）")
+    group.add_argument("--max-side", type=int, default=None,
+                       help="輸出的長邊上限；JPEG 會直接以縮小尺寸解碼")
+
+
+def run_watch(args):
+    from PhotoEnhancer import DEFAULT_PARAMS
+    from PhotoWatch import watch_folder, format_watch_record, summarize_watch
+
+    params = [getattr(args, name) for name in DEFAULT_PARAMS]
+    records = []
+    print(f"👀 監看 {args.input_folder} → {args.output_folder}（Ctrl-C 結束）", flush=True)
+    try:
+        for record in watch_folder(args.input_folder, args.output_folder, params, workers=args.workers,
+                                   output_format=None if args.format == "none" else args.format,
+                                   target_kb=args.target_kb, tile_size=args.tile_size,
+                                   max_side=args.max_side, settle=args.settle,
+                                   poll_interval=args.poll_interval, backend=args.backend,
+                                   process_existing=not args.no_existing):
+            records.append(record)
+            print(format_watch_record(record), flush=True)
+    except KeyboardInterrupt:
+        pass
+    print(summarize_watch(records))
+    return 0
+
+
+def _add_serve_args(parser):
+    from PhotoServer import MAX_BATCH, MAX_QUEUE, REQUEST_TIMEOUT
+
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="常駐的處理行程數")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="每次送進行程的最多請求數")
+    parser.add_argument("--max-queue", type=int, default=MAX_QUEUE,
+                        help="排隊與處理中的請求上限，超過時回 503")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="單一請求的秒數上限，超過時回 504")
+    parser.add_argument("--access-log", action="store_true", help="在標準錯誤輸出每個請求")
+
+
+def run_serve(args):
+    from PhotoServer import serve
+
+    metrics = serve(args.host, args.port, args.workers, args.max_batch, args.max_queue, args.timeout,
+                    quiet=not args.access_log)
+    print(json.dumps(metrics, ensure_ascii=False, indent=1))
+    return 0
+
+
+def _add_profile_args(parser):
+    group = parser.add_argument_group("效能分析")
+    group.add_argument("--profile", action="store_true", help="結束時列出各階段的耗時與記憶體配置峰值")
+    group.add_argument("--trace", metavar="PATH", help="另外輸出 Chrome trace JSON（隱含 --profile）")
+
+
+def _run_profiled(args):
+    from PhotoProfile import Profiler
+
+    with Profiler(trace_allocations=True) as profiler:
+        code = args.func(args)
+    print(profiler.summary())
+    if args.trace:
+        profiler.dump_chrome_trace(args.trace)
+        print(f"📈 Chrome trace：{args.trace}")
+    return code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhotoEnhancer / PhotoCompressor 命令列批次工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    enhance = subparsers.add_parser("enhance", help="批次增強資料夾內的圖片")
+    _add_enhance_args(enhance)
+    enhance.set_defaults(func=run_enhance)
+    compress = subparsers.add_parser("compress", help="批次壓縮圖片到目標大小")
+    _add_compress_args(compress)
+    compress.set_defaults(func=run_compress)
+    enhance_compress = subparsers.add_parser(
+        "enhance-compress", help="增強後直接在記憶體中壓縮到目標大小，只寫出最終檔案")
+    _add_enhance_compress_args(enhance_compress)
+    enhance_compress.set_defaults(func=run_enhance_compress)
+    watch = subparsers.add_parser("watch", help="監看資料夾，新圖片寫入完成就增強（可同時壓縮）")
+    _add_watch_args(watch)
+    watch.set_defaults(func=run_watch)
+    serve = subparsers.add_parser("serve", help="啟動 HTTP API（增強 / 壓縮上傳的圖片）")
+    _add_serve_args(serve)
+    serve.set_defaults(func=run_serve)
+    for subparser in (enhance, compress, enhance_compress):
+        _add_profile_args(subparser)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "profile", False) or getattr(args, "trace", None):
+        return _run_profiled(args)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
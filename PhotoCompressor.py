@@ -1,10 +1,18 @@
 import os
 import io
+import math
 import sys
 import contextlib
+import csv
+import functools
+import json
+import signal
+import threading
+import time
 import tempfile # 依然需要
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 from PIL import Image, ExifTags
-import gradio as gr
+from PhotoProfile import Profiler, stage, hooks_active, wants_allocations, collect_stages, replay
 
 # === 1. 自動旋轉 JPEG 圖片 ===
 def auto_orient_image(img):
@@ -36,135 +44,364 @@ def get_compression_info_str(filename, original_kb, compressed_kb, target_kb):
     info += f"  原始：{original_kb:.1f} KB → 壓縮後：{compressed_kb:.1f} KB（節省 {ratio:.1f}%）\n\n"
     return info
 
+# === 2.5 以小探針預測檔案大小 ===
+# 品質搜尋：從整張圖均勻取 PROBE_GRID×PROBE_GRID 個 PROBE_CROP 方塊拼成小圖，
+# 保留原解析度的紋理，以幾個 quality 編碼後依面積比例放大，得到大小-品質曲線
+PROBE_CROP = 128
+PROBE_GRID = 4
+PROBE_QUALITIES = (20, 40, 60, 75, 85, 95)
+# 縮放搜尋：原尺寸的大小同樣由拼圖推估，另外把整張圖縮到長邊 PNG_PROBE_SIDE 編碼，
+# 兩點之間以 log(比例) 對 log(大小) 內插
+PNG_PROBE_SIDE = 512
+
+def _curve_size(curve, x):
+    """curve 為依 x 遞增的 [(x, kb), ...]；在 log(kb) 上分段線性內插，超出範圍時以端點線段外插。"""
+    i = 1
+    while i < len(curve) - 1 and x > curve[i][0]:
+        i += 1
+    (x0, s0), (x1, s1) = curve[i - 1], curve[i]
+    t = (x - x0) / (x1 - x0)
+    return math.exp(math.log(s0) + t * (math.log(s1) - math.log(s0)))
+
+def _curve_solve(curve, size_kb):
+    """_curve_size 的反函數：回傳預估大小為 size_kb 的 x。"""
+    i = 1
+    while i < len(curve) - 1 and size_kb > curve[i][1]:
+        i += 1
+    (x0, s0), (x1, s1) = curve[i - 1], curve[i]
+    if s1 <= s0: # 大小不隨 x 增加（例如全平色圖片），無法推估
+        return x1 if size_kb >= s1 else x0
+    return x0 + (x1 - x0) * (math.log(size_kb) - math.log(s0)) / (math.log(s1) - math.log(s0))
+
+def _probe_mosaic(img):
+    """取樣拼圖；圖片面積不到拼圖 4 倍時直接編碼整張圖就夠快，回傳 None。"""
+    width, height = img.size
+    side = PROBE_CROP * PROBE_GRID
+    if width * height < 4 * side * side or min(width, height) < PROBE_CROP:
+        return None
+    mosaic = Image.new(img.mode, (side, side))
+    for row in range(PROBE_GRID):
+        top = (height - PROBE_CROP) * row // (PROBE_GRID - 1)
+        for col in range(PROBE_GRID):
+            left = (width - PROBE_CROP) * col // (PROBE_GRID - 1)
+            crop = img.crop((left, top, left + PROBE_CROP, top + PROBE_CROP))
+            mosaic.paste(crop, (col * PROBE_CROP, row * PROBE_CROP))
+    return mosaic
+
+def _probe_quality_curve(img, encode):
+    """回傳預估的 [(quality, 整張圖 kb), ...]；不需要預測時回傳 None。"""
+    mosaic = _probe_mosaic(img)
+    if mosaic is None:
+        return None
+    area_ratio = img.width * img.height / (mosaic.width * mosaic.height)
+    return [(q, len(encode(mosaic, q)) / 1024 * area_ratio) for q in PROBE_QUALITIES]
+
+def _probe_scale_curve(img, encode):
+    """回傳預估的 [(log(縮放比例), kb), ...]；不需要預測時回傳 None。"""
+    width, height = img.size
+    mosaic = _probe_mosaic(img)
+    if mosaic is None or max(width, height) < 2 * PNG_PROBE_SIDE:
+        return None
+    scale = PNG_PROBE_SIDE / max(width, height)
+    probe = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    area_ratio = width * height / (mosaic.width * mosaic.height)
+    return [(math.log(scale), len(encode(probe)) / 1024),
+            (0.0, len(encode(mosaic)) / 1024 * area_ratio)]
+
+def _interpolate(x0, s0, x1, s1, size_kb):
+    """在 (x0, s0)、(x1, s1) 兩個實測點之間，以 log(kb) 線性內插出大小為 size_kb 的 x。"""
+    if s1 == s0:
+        return (x0 + x1) / 2
+    return x0 + (x1 - x0) * (math.log(size_kb) - math.log(s0)) / (math.log(s1) - math.log(s0))
+
+def _search_quality(try_quality, target_kb, min_quality, max_quality, curve=None, model_steps=6):
+    """
+    找出不超過 target_kb 的最高 quality；try_quality(q) 回傳 (是否達標, 實際 kb)。
+    有 curve 時從預測值開始，否則先試 max_quality。之後若達標/超標兩側都有實測值，
+    就在兩者之間內插；只有一側時以「實際/預估」比例校正曲線再推估。
+    連續兩次落在同一側（內插停滯）或超過 model_steps 次仍未收斂時改用二分搜尋。
+    Returns:
+        達標的最高 quality，全部超標時為 None。
+    """
+    best, fail = min_quality - 1, max_quality + 1 # best 達標、fail 超標，答案介於兩者之間
+    sizes = {}
+    last_fits = None # 上一次內插推估的結果是否達標
+    quality = math.floor(_curve_solve(curve, target_kb)) if curve else max_quality
+    while fail - best > 1:
+        quality = min(max(quality, best + 1), fail - 1)
+        fits, sizes[quality] = try_quality(quality)
+        if fits:
+            best = quality
+        else:
+            fail = quality
+        stalled = fits == last_fits
+        last_fits = None
+        if len(sizes) >= model_steps or stalled:
+            quality = (best + fail) // 2
+        elif best in sizes and fail in sizes:
+            quality = math.floor(_interpolate(best, sizes[best], fail, sizes[fail], target_kb))
+            last_fits = fits
+        elif curve:
+            ratio = sizes[quality] / _curve_size(curve, quality)
+            quality = math.floor(_curve_solve(curve, target_kb / ratio))
+        else:
+            quality = (best + fail) // 2
+    return best if best >= min_quality else None
+
 # === 3. 壓縮 PNG ===
-def compress_png(input_path, output_path, target_kb=100, step=0.85):
+# 調色盤量化的強度：(RGB 圖片的量化方法, kmeans 迭代次數)
+# 有透明度的圖片只能用 FASTOCTREE / LIBIMAGEQUANT，且無法套用既有調色盤
+PNG_QUANTIZE_EFFORT = {
+    "fast": (Image.Quantize.FASTOCTREE, 0),
+    "balanced": (Image.Quantize.MEDIANCUT, 0),
+    "best": (Image.Quantize.MEDIANCUT, 3),
+}
+
+def _quantize_png(img, quantize_effort, palette=None):
+    """量化為 palette 模式；RGB 圖片可傳入 palette 直接沿用第一次量化得到的調色盤。"""
+    with stage("quantize"):
+        if img.mode == 'RGB':
+            if palette is not None:
+                return img.quantize(palette=palette, dither=Image.Dither.NONE)
+            method, kmeans = PNG_QUANTIZE_EFFORT[quantize_effort]
+            return img.quantize(colors=256, method=method, kmeans=kmeans, dither=Image.Dither.NONE)
+        return img.quantize(colors=256, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+
+def _encode_png(img, quantize_effort, save_options, palette=None):
+    """量化後存成 PNG；回傳 (bytes, 量化後的圖片)。"""
+    # 儲存成 palette 模式，有助於壓縮
+    paletted = _quantize_png(img, quantize_effort, palette)
+    buffer = io.BytesIO()
+    paletted.save(buffer, format="PNG", **save_options)
+    return buffer.getvalue(), paletted
+
+def encode_png_to_target(img, target_kb, min_size=32, quantize_effort="fast", zlib_level=9,
+                         max_attempts=8, tolerance=0.03, curve=None, measured=None):
+    """
+    搜尋縮放比例，找出量化後檔案不超過 target_kb 的最大尺寸，全部在記憶體中進行。
+    大圖先以 _probe_scale_curve 推估大小-比例曲線作為起點；之後以實測大小校正曲線，
+    或在已知的達標/超標比例之間內插，推估下一個比例。
+    第一次量化得到的調色盤會沿用到之後的每次嘗試（不透明圖片）。
+    Args:
+        img: PIL 圖片（任何模式）。
+        quantize_effort: "fast" / "balanced" / "best"，見 PNG_QUANTIZE_EFFORT。
+        zlib_level: 0~9，9 另外開啟 optimize（最慢、最小）。
+        max_attempts: 最多編碼次數（含第一次嘗試）。
+        tolerance: 達標且與目標相差不到此比例時即停止搜尋。
+        curve: 預估的 [(log(縮放比例), kb), ...]，未提供時以 _probe_scale_curve 建立。
+        measured: 傳入 dict 時填入實測的 {縮放比例: kb}。
+    Returns:
+        (log_output, data, attempts, scale)，data 為選用的 PNG 內容，scale 為選用的縮放比例。
+    """
+    log_output = ""
+    attempts = 0
+
+    # 轉換為 RGBA 確保透明度保留；完全不透明的圖片改用 RGB，才能沿用調色盤
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    if img.getextrema()[3] == (255, 255):
+        img = img.convert('RGB')
+
+    width, height = img.size
+    save_options = {"optimize": True} if zlib_level >= 9 else {"compress_level": int(zlib_level)}
+    palette = None
+    if curve is None:
+        with stage("probe"):
+            curve = _probe_scale_curve(img, lambda probe: _encode_png(probe, quantize_effort, save_options)[0])
+
+    def encode(scale):
+        nonlocal attempts, palette, log_output
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        with stage("encode", format="png", scale=round(scale, 4)):
+            resized = img if size == img.size else img.resize(size, Image.LANCZOS)
+            data, paletted = _encode_png(resized, quantize_effort, save_options, palette)
+        if palette is None and img.mode == 'RGB':
+            palette = paletted
+        attempts += 1
+        if measured is not None:
+            measured[scale] = len(data) / 1024
+        log_output += f"  尺寸 {size[0]}x{size[1]} → {len(data) / 1024:.1f} KB"
+        log_output += f"（預估 {_curve_size(curve, math.log(scale)):.1f} KB）\n" if curve else "\n"
+        return data
+
+    def predict_scale(size_kb):
+        return math.exp(min(0.0, _curve_solve(curve, size_kb)))
+
+    # low 為達標（或下限：短邊不小於 min_size）的比例、high 為超標的比例；
+    # 還沒有超標結果時 high_data 為 None，原尺寸本身仍可嘗試
+    low = min(1.0, min_size / min(width, height))
+    high, high_data = 1.0, None
+    best = None
+    scale = predict_scale(target_kb * 0.98) if curve else 1.0
+    while True:
+        data = encode(scale)
+        size_kb = len(data) / 1024
+        if size_kb <= target_kb:
+            best, low = data, scale
+            if scale >= 1.0 or size_kb >= target_kb * (1 - tolerance):
+                break
+        else:
+            high, high_data = scale, data
+        if attempts >= max_attempts or (high - low) * max(width, height) < 1:
+            break
+        # 兩側都有實測值時在兩者之間內插；只有超標的一側時以「實際/預估」比例校正
+        # 預測曲線，沒有曲線則假設大小與面積成正比。
+        # 結果限制在搜尋區間中段，推估不準時退化為二分搜尋
+        if best is not None and high_data is not None:
+            scale = math.exp(_interpolate(math.log(low), len(best) / 1024,
+                                          math.log(high), len(high_data) / 1024, target_kb * 0.99))
+        elif curve:
+            scale = predict_scale(target_kb * 0.98 * _curve_size(curve, math.log(scale)) / size_kb)
+        else:
+            scale = scale * math.sqrt(target_kb / size_kb) * 0.98
+        margin = (high - low) * 0.1
+        lower = low + margin if best is not None else low
+        upper = high if high_data is None else high - margin
+        scale = min(max(scale, lower), upper)
+    if best is None:
+        # 下限本身已試過就不再重複編碼
+        best = high_data if high <= low else encode(low)
+        if len(best) / 1024 > target_kb:
+            log_output += f"  ⚠️ 已縮到最小尺寸仍未達目標。\n"
+
+    log_output += f"  共編碼 {attempts} 次\n"
+    return log_output, best, attempts, low
+
+def compress_png(input_path, output_path, target_kb=100, min_size=32,
+                 quantize_effort="fast", zlib_level=9, max_attempts=8, tolerance=0.03):
+    """
+    讀取 input_path，以 encode_png_to_target 壓縮後寫檔一次。
+    Returns:
+        (log_output, original_kb, compressed_kb, attempts, scale)，scale 為選用的縮放比例。
+    """
     log_output = ""
+    attempts = 0
     try:
         if not os.path.exists(input_path) or os.path.getsize(input_path) == 0:
             log_output += f"⚠️ 警告：檔案不存在或為空：{input_path}\n"
-            return log_output, 0, 0
+            return log_output, 0, 0, 0, None
 
-        img = Image.open(input_path)
+        with stage("decode"):
+            img = Image.open(input_path)
+            img.load()
         original_kb = os.path.getsize(input_path) / 1024
         display_filename = os.path.basename(output_path)
         log_output += f"處理中 (PNG)：{display_filename}\n"
 
-        # 轉換為 RGBA 確保透明度保留
-        if img.mode != 'RGBA':
-            img = img.convert('RGBA')
-
-        width, height = img.size
-        min_size = 32  # 不壓得太小
-        success = False
-
-        while True:
-            buffer = io.BytesIO()
-            resized = img.resize((int(width), int(height)), Image.LANCZOS)
-            # 儲存成 palette 模式，有助於壓縮
-            paletted = resized.convert('P', palette=Image.ADAPTIVE)
-            paletted.save(buffer, format="PNG", optimize=True)
-
-            size_kb = buffer.getbuffer().nbytes / 1024
-            log_output += f"  尺寸 {int(width)}x{int(height)} → {size_kb:.1f} KB\n"
-
-            if size_kb <= target_kb:
-                success = True
-                break
-
-            if width < min_size or height < min_size:
-                log_output += f"  ⚠️ 已縮到最小尺寸仍未達目標。\n"
-                break
-
-            width *= step
-            height *= step
+        search_log, data, attempts, scale = encode_png_to_target(
+            img, target_kb, min_size, quantize_effort, zlib_level, max_attempts, tolerance)
+        log_output += search_log
 
         # 最終儲存
-        with open(output_path, 'wb') as f:
-            f.write(buffer.getvalue())
+        with stage("write"), open(output_path, 'wb') as f:
+            f.write(data)
 
         final_kb = os.path.getsize(output_path) / 1024
         log_output += get_compression_info_str(display_filename, original_kb, final_kb, target_kb)
 
-        return log_output, original_kb, final_kb
+        return log_output, original_kb, final_kb, attempts, scale
 
     except Exception as e:
         log_output += f"❌ 錯誤處理 PNG：{e}\n"
-        return log_output, 0, 0
+        return log_output, 0, 0, attempts, None
 
 
 # === 4. 壓縮 JPEG ===
-def compress_jpeg(input_path, output_path, target_kb=100, quality_step=5):
-    # ... (代碼基本同前，加入類似 PNG 的錯誤處理和顯示文件名調整) ...
+def _encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+def _encode_quality_to_target(img, encode, label, target_kb, min_quality, max_quality,
+                              curve=None, measured=None):
+    """
+    JPEG / WebP 共用：搜尋不超過 target_kb 的最高 quality，回傳 (log_output, data, attempts, quality)。
+    全部超標時沿用最低 quality 的結果；一次都沒編碼成功時 data 與 quality 為 None。
+    curve 為預估的 [(quality, kb), ...]，未提供時以取樣探針建立；measured 傳入 dict 時填入實測的 {quality: kb}。
+    """
+    log_output = ""
+    attempts = 0
+    encoded = {} # quality -> 編碼結果，避免重複編碼
+    if curve is None:
+        with stage("probe"):
+            curve = _probe_quality_curve(img, encode)
+
+    def try_quality(quality):
+        nonlocal attempts, log_output
+        if quality not in encoded:
+            attempts += 1
+            with stage("encode", format=label, quality=quality):
+                encoded[quality] = encode(img, quality)
+            log_output += f"  嘗試 {label}={quality} → {len(encoded[quality]) / 1024:.1f} KB"
+            log_output += f"（預估 {_curve_size(curve, quality):.1f} KB）\n" if curve else "\n"
+        size_kb = len(encoded[quality]) / 1024
+        return size_kb <= target_kb, size_kb
+
+    best_quality = None
+    try: # 不超過目標的最高 quality
+        best_quality = _search_quality(try_quality, target_kb, min_quality, max_quality, curve)
+    except Exception as save_err:
+        log_output += f"  ❌ 編碼失敗: {save_err}\n"
+
+    if measured is not None:
+        measured.update((quality, len(data) / 1024) for quality, data in encoded.items())
+    if best_quality is None and encoded:
+        # 最低 quality 仍未達標時沿用最低 quality 的結果
+        best_quality = min(encoded)
+        log_output += f"  ⚠️ 未能在 {label}>={min_quality} 達到目標，使用 {label}={best_quality} 的結果。\n"
+    if best_quality is None:
+        return log_output, None, attempts, None
+    log_output += f"  選用 {label}={best_quality}（共編碼 {attempts} 次）\n"
+    return log_output, encoded[best_quality], attempts, best_quality
+
+def encode_jpeg_to_target(img, target_kb, min_quality=10, max_quality=95, curve=None, measured=None):
+    """
+    在記憶體中搜尋檔案不超過 target_kb 的最高 quality。
+    大圖先以取樣拼圖預測大小-品質曲線，直接從預測的 quality 開始（多數只需兩次完整編碼）；
+    小圖則先試 max_quality，再以二分搜尋收斂。
+    curve / measured：見 _encode_quality_to_target（encode_renditions 以較大尺寸的實測結果作為起點）。
+    Returns:
+        (log_output, data, attempts, quality)；一次都沒編碼成功時 data 與 quality 為 None。
+    """
+    if img.mode in ('RGBA', 'P', 'LA'): # 轉換為 RGB
+        img = img.convert('RGB')
+    return _encode_quality_to_target(img, _encode_jpeg, "Quality", target_kb, min_quality, max_quality,
+                                     curve, measured)
+
+def compress_jpeg(input_path, output_path, target_kb=100, min_quality=10, max_quality=95):
+    """
+    讀取 input_path，以 encode_jpeg_to_target 壓縮後寫檔一次。
+    Returns:
+        (log_output, original_kb, compressed_kb, attempts, quality)，attempts 為實際編碼次數，
+        quality 為選用的 quality（全部編碼失敗時為 None）。
+    """
     log_output = ""
     original_kb = 0
     compressed_kb = 0
+    attempts = 0
+    best_quality = None
     try:
         if not os.path.exists(input_path) or os.path.getsize(input_path) == 0:
              log_output += f"⚠️ 警告：輸入檔案 {os.path.basename(input_path)} 不存在或為空，跳過。\n"
-             return log_output, 0, 0
+             return log_output, 0, 0, 0, None
 
-        img = Image.open(input_path)
+        with stage("decode"):
+            img = Image.open(input_path)
+            img.load()
         original_kb = os.path.getsize(input_path) / 1024
         display_filename = os.path.basename(output_path)
         log_output += f"處理中 (JPEG)：{display_filename}\n"
 
         img = auto_orient_image(img)
-        if img.mode in ('RGBA', 'P', 'LA'): # 轉換為 RGB
-            img = img.convert('RGB')
-
-        quality = 95
-        best_quality = quality
-        last_compressed_kb = float('inf')
-        saved_successfully = False # 標記是否至少成功保存過一次
+        search_log, data, attempts, best_quality = encode_jpeg_to_target(img, target_kb, min_quality, max_quality)
+        log_output += search_log
 
-        while quality >= 10:
-            try:
-                img.save(output_path, format='JPEG', quality=quality, optimize=True, progressive=True)
-                # 檢查文件是否真的寫入了
-                if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
-                    raise OSError("儲存後文件不存在或為空")
-
-                compressed_kb_loop = os.path.getsize(output_path) / 1024
-                log_output += f"  嘗試 Quality={quality} → {compressed_kb_loop:.1f} KB\n"
-                last_compressed_kb = compressed_kb_loop
-                best_quality = quality
-                saved_successfully = True # 標記成功保存
-
-                if compressed_kb_loop <= target_kb:
-                    break # 達到目標
-
-            except Exception as save_err:
-                 log_output += f"  ❌ Quality={quality} 儲存失敗: {save_err}\n"
-                 # 如果特定質量儲存失敗，可能意味著圖像本身或庫有問題
-                 # 可以選擇在這裡 break 或者繼續嘗試更低質量
-                 # 這裡選擇繼續嘗試
-                 pass
-
-            quality -= quality_step
-
-        # 循環結束後，確定最終的 compressed_kb
-        if saved_successfully:
-            # 如果是因為 <= target_kb 跳出，last_compressed_kb 就是目標值
-            # 如果是循環到底部，last_compressed_kb 是 quality=10 左右的值
-            # 如果中途保存失敗但之前成功過，last_compressed_kb 是最後成功的大小
-            compressed_kb = last_compressed_kb
-
-            # 如果循環到底部仍未達標，記錄一下
-            if compressed_kb > target_kb and quality < 10 :
-                 log_output += f"  ⚠️ 未能在 Quality>=10 達到目標，使用 Quality={best_quality} 的結果。\n"
-                 # 確保 output_path 內容是 best_quality 的 (理論上最後一次循環應該寫入了)
-                 # 可以加個保險，但可能非必要
-                 # try: img.save(output_path, format='JPEG', quality=best_quality, optimize=True, progressive=True)
-                 # except: pass
-
-            # 最後再次確認文件存在性
-            if os.path.exists(output_path):
-                 compressed_kb = os.path.getsize(output_path) / 1024
-            else:
-                 log_output += "  ❌ 最終檢查時輸出檔案不存在。\n"
-                 compressed_kb = original_kb # 視為失敗
+        if data is not None:
+            with stage("write"), open(output_path, 'wb') as f:
+                f.write(data)
+            compressed_kb = os.path.getsize(output_path) / 1024
         else:
-            # 如果一次都沒保存成功
+            # 如果一次都沒編碼成功
              log_output += "  ❌ 所有 Quality 級別儲存均失敗。\n"
              compressed_kb = original_kb # 視為失敗
 
@@ -186,76 +423,471 @@ def compress_jpeg(input_path, output_path, target_kb=100, quality_step=5):
         compressed_kb = original_kb
         log_output += get_compression_info_str(display_filename, original_kb, compressed_kb, target_kb)
 
-    return log_output, original_kb, compressed_kb
+    return log_output, original_kb, compressed_kb, attempts, best_quality
+
+# WebP 輸出的最大尺寸（等比例縮入此框）
+WEBP_MAX_SIZE = (2048, 2048)
+
+def _fit_size(size, box):
+    """等比例縮入 box 後的尺寸（不放大）。"""
+    scale = min(1.0, box[0] / size[0], box[1] / size[1])
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+def _encode_webp(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format="WEBP", quality=quality)  # 拿掉 optimize=True 加速
+    return buffer.getvalue()
 
-def convert_to_webp(input_path, output_path, target_kb=100, quality_step=5):
+def encode_webp_to_target(img, target_kb, min_quality=10, max_quality=95, curve=None, measured=None):
+    """
+    縮入 WEBP_MAX_SIZE 後，與 encode_jpeg_to_target 相同地搜尋不超過 target_kb 的最高 quality。
+    Returns:
+        (log_output, data, attempts, quality)
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if img.mode == "P" else "RGB")
+
+    # 建議縮圖處理（選配）
+    with stage("resize"):
+        img.thumbnail(WEBP_MAX_SIZE, Image.LANCZOS)
+    return _encode_quality_to_target(img, _encode_webp, "quality", target_kb, min_quality, max_quality,
+                                     curve, measured)
+
+def convert_to_webp(input_path, output_path, target_kb=100, min_quality=10, max_quality=95):
+    """
+    讀取 input_path，以 encode_webp_to_target 轉換後寫檔一次。
+    Returns:
+        (log_output, original_kb, compressed_kb, attempts, quality)
+    """
     log_output = ""
+    attempts = 0
     try:
-        img = Image.open(input_path)
-        if img.mode not in ("RGB", "RGBA"):
-            img = img.convert("RGBA" if img.mode == "P" else "RGB")
-
-        # 建議縮圖處理（選配）
-        img.thumbnail((2048, 2048), Image.LANCZOS)
+        with stage("decode"):
+            img = Image.open(input_path)
+            # 只需要縮圖大小時，JPEG 直接在 DCT 階段以 1/2、1/4、1/8 解碼（其他格式 draft 無作用）
+            img.draft(None, _fit_size(img.size, WEBP_MAX_SIZE))
+            img.load()
 
         original_kb = os.path.getsize(input_path) / 1024
-        quality = 95
-        buffer = io.BytesIO()
-
-        while quality >= 10:
-            buffer.seek(0)
-            buffer.truncate()
-            img.save(buffer, format="WEBP", quality=quality)  # 拿掉 optimize=True 加速
-            size_kb = buffer.tell() / 1024
-            log_output += f"  嘗試 quality={quality} → {size_kb:.1f} KB\n"
-            if size_kb <= target_kb:
-                break
-            quality -= quality_step
+        search_log, data, attempts, quality = encode_webp_to_target(img, target_kb, min_quality, max_quality)
+        log_output += search_log
 
-        with open(output_path, 'wb') as f:
-            f.write(buffer.getvalue())
+        with stage("write"), open(output_path, 'wb') as f:
+            f.write(data)
 
         final_kb = os.path.getsize(output_path) / 1024
         log_output += get_compression_info_str(os.path.basename(output_path), original_kb, final_kb, target_kb)
-        return log_output, original_kb, final_kb
+        return log_output, original_kb, final_kb, attempts, quality
 
     except Exception as e:
-        return f"❌ WebP 轉換錯誤：{e}\n", 0, 0
+        return f"❌ WebP 轉換錯誤：{e}\n", 0, 0, attempts, None
+
+# 記憶體中的圖片直接編碼到目標大小：mode -> encode_*_to_target
+ENCODE_FUNCTIONS = {"webp": encode_webp_to_target, "png": encode_png_to_target, "jpeg": encode_jpeg_to_target}
+
+
+# === 4.5 單檔壓縮工作（可在行程池中執行） ===
+COMPRESS_FUNCTIONS = {"webp": convert_to_webp, "png": compress_png, "jpeg": compress_jpeg}
+
+# 每個檔案一筆結果紀錄（dict），欄位順序即匯出 CSV 的欄位順序；
+# quality 用於 JPEG/WebP、scale 用於 PNG，另一個欄位為 None
+RECORD_FIELDS = ("file", "input_path", "output_path", "mode", "status", "original_kb",
+                 "compressed_kb", "quality", "scale", "attempts", "elapsed_s", "message")
+
+class _FileTimeout(BaseException):
+    """單檔處理逾時；繼承 BaseException 才不會被各壓縮函數的 except Exception 吞掉。"""
+
+def _raise_timeout(signum, frame):
+    raise _FileTimeout()
+
+def _alarm_available():
+    """SIGALRM 只能在主執行緒設定；Gradio 等在工作執行緒中呼叫時無法以此逾時。"""
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+def _make_record(input_path, output_path, mode, status, original_kb=0.0, compressed_kb=0.0,
+                 setting=None, attempts=0, elapsed=0.0, message=""):
+    return {
+        "file": os.path.basename(output_path) if output_path else os.path.basename(input_path),
+        "input_path": input_path,
+        "output_path": output_path,
+        "mode": mode,
+        "status": status,
+        "original_kb": round(original_kb, 3),
+        "compressed_kb": round(compressed_kb, 3),
+        "quality": setting if mode in ("jpeg", "webp") else None,
+        "scale": round(setting, 4) if mode == "png" and setting is not None else None,
+        "attempts": attempts,
+        "elapsed_s": round(elapsed, 3),
+        "message": message,
+    }
+
+def _compress_status(original_kb, compressed_kb):
+    """必須原始和壓縮後都 > 0 且壓縮後更小才算成功；原始大小為 0（空檔、無法讀取）視為跳過。"""
+    if 0 < original_kb and 0 < compressed_kb < original_kb:
+        return "ok"
+    return "failed" if original_kb > 0 else "skipped"
+
+def _compress_failure(input_path, output_path, mode, message, elapsed=0.0):
+    """處理失敗時的結果：原始大小照算，輸出視為未壓縮。"""
+    original_kb = os.path.getsize(input_path) / 1024 if os.path.exists(input_path) else 0
+    log = f"❌❌ 處理檔案 {os.path.basename(output_path)} 時發生錯誤：{message}\n\n"
+    record = _make_record(input_path, output_path, mode, "failed", original_kb, original_kb,
+                          elapsed=elapsed, message=str(message))
+    return log, record
+
+def _compress_file(input_path, output_path, mode, target_kb, timeout=None, functions=None):
+    """
+    以 functions[mode]（預設 COMPRESS_FUNCTIONS）壓縮單一檔案，回傳 (file_log, record)。
+    functions 的值需與 compress_jpeg 相同：f(input_path, output_path, target_kb) 回傳 5 元組；
+    一個檔案有多個輸出時也可直接回傳 (file_log, records)（見 iter_rendition_results），原樣傳回。
+    timeout 以 SIGALRM 中斷處理中的檔案，只在支援 setitimer 的平台、且在主執行緒時生效
+    （行程池的工作都在各行程的主執行緒執行，見 iter_compress_results）。
+    """
+    use_alarm = bool(timeout) and _alarm_available()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    start = time.perf_counter()
+    try:
+        result = (functions or COMPRESS_FUNCTIONS)[mode](input_path, output_path, target_kb)
+        if len(result) == 2:
+            return result
+        file_log, original_kb, compressed_kb, attempts, setting = result
+        elapsed = time.perf_counter() - start
+        record = _make_record(input_path, output_path, mode, _compress_status(original_kb, compressed_kb),
+                              original_kb, compressed_kb, setting, attempts, elapsed)
+        return file_log, record
+    except _FileTimeout:
+        # 可能寫到一半，不留下不完整的輸出檔
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return _compress_failure(input_path, output_path, mode, f"逾時（超過 {timeout:g} 秒）",
+                                 time.perf_counter() - start)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+def iter_compress_results(jobs, target_kb, workers=1, timeout=None, max_in_flight=None, functions=None):
+    """
+    依完成順序逐一產生每個 (input_path, output_path, mode) 工作的 (file_log, record)。
+    workers > 1 時使用行程池，同時最多送出 max_in_flight（預設 workers*2）個工作；
+    functions 見 _compress_file，行程池模式下必須可 pickle。
+    指定 timeout 但目前不在主執行緒（例如介面的事件處理）時，workers=1 也改用單一行程的行程池，
+    讓逾時在子行程的主執行緒中生效。
+    """
+    workers = max(1, int(workers))
+    in_process = workers == 1 and not (timeout and hasattr(signal, "setitimer") and not _alarm_available())
+    if in_process:
+        for input_path, output_path, mode in jobs:
+            try:
+                yield _compress_file(input_path, output_path, mode, target_kb, timeout, functions)
+            except Exception as e:
+                yield _compress_failure(input_path, output_path, mode, e)
+        return
+
+    max_in_flight = max(workers, int(max_in_flight or workers * 2))
+    pending = {} # future -> (input_path, output_path, mode)
+    # 子行程看不到父行程註冊的掛鉤：在子行程中收集階段事件，完成後交給父行程的掛鉤
+    profiling = hooks_active()
+
+    def submit(*args):
+        if profiling:
+            return pool.submit(collect_stages, wants_allocations(), _compress_file, *args)
+        return pool.submit(_compress_file, *args)
+
+    def collect(future):
+        input_path, output_path, mode = pending.pop(future)
+        try:
+            result = future.result()
+        except Exception as e: # 例如子行程異常結束 (BrokenProcessPool)
+            return _compress_failure(input_path, output_path, mode, e)
+        if profiling:
+            result, events = result
+            replay(events)
+        return result
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for input_path, output_path, mode in jobs:
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield collect(future)
+            future = submit(input_path, output_path, mode, target_kb, timeout, functions)
+            pending[future] = (input_path, output_path, mode)
+        for future in as_completed(list(pending)):
+            yield collect(future)
+
+def export_records(records, path):
+    """依副檔名 (.json / .csv) 匯出每個檔案的結果紀錄。"""
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8-sig") as f: # BOM 讓 Excel 正確顯示中文
+            writer = csv.DictWriter(f, fieldnames=RECORD_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+
+def summarize_records(records, total_files_selected):
+    """
+    由結果紀錄產生壓縮總結；只做加總，與檔案完成的順序無關。
+    同一個輸入檔有多筆紀錄（多尺寸輸出）時，原始大小只算一次，輸出大小為各尺寸的加總；
+    全部成功才算處理成功，任一失敗即算失敗。
+    """
+    sources = {} # input_path -> 該檔案的紀錄
+    for r in records:
+        sources.setdefault(r["input_path"], []).append(r)
+    statuses = [("ok" if all(r["status"] == "ok" for r in group)
+                 else "failed" if any(r["status"] == "failed" for r in group) else "skipped")
+                for group in sources.values()]
+    processed_files = statuses.count("ok")
+    failed_files = statuses.count("failed")
+    skipped_files = statuses.count("skipped")
+    total_attempts = sum(r["attempts"] for r in records)
+    total_original_kb = sum(group[0]["original_kb"] for group in sources.values())
+    # 失敗計入原始大小（沒有任何成功輸出的檔案）
+    total_compressed_kb = sum(sum(r["compressed_kb"] for r in group if r["status"] == "ok")
+                              if any(r["status"] == "ok" for r in group) else group[0]["original_kb"]
+                              for group in sources.values())
+
+    lines = ["------------------------------------", "📊 壓縮總結："]
+    lines.append(f"  共選擇檔案：{total_files_selected} 個")
+    lines.append(f"     (圖片處理成功：{processed_files} 個)")
+    lines.append(f"     (圖片處理失敗/未壓縮：{failed_files} 個)")
+    lines.append(f"     (跳過非圖片/空檔/其他：{skipped_files} 個)")
+    if len(records) > len(sources):
+        lines.append(f"  輸出檔案：{sum(1 for r in records if r['status'] == 'ok')} / {len(records)} 個")
+    lines.append(f"  總編碼次數：{total_attempts} 次")
 
+    if total_original_kb > 0 and processed_files > 0:
+        total_ratio = 100 * (1 - total_compressed_kb / total_original_kb)
+        lines.append(f"  總原始大小 (已處理圖片)：{total_original_kb:.1f} KB")
+        lines.append(f"  總輸出大小 (含失敗)：{total_compressed_kb:.1f} KB")
+        lines.append(f"  總節省空間 (估算)：{total_ratio:.1f} %")
+    elif failed_files > 0 or skipped_files > 0:
+        if total_original_kb > 0:
+            lines.append(f"  總原始大小 (已處理圖片)：{total_original_kb:.1f} KB")
+        lines.append("  沒有圖片成功壓縮，或所有圖片均被跳過/處理失敗。")
+    elif total_files_selected == 0:
+        lines.append("  未選擇任何檔案。")
+    else:
+        lines.append("  未處理任何有效檔案。")
+    return "\n".join(lines) + "\n"
 
+# === 4.6 多尺寸輸出（srcset）：一次解碼、縮圖金字塔、由大到小沿用搜尋結果 ===
+# 只指定尺寸、沒有目標大小時 JPEG / WebP 使用的 quality（PNG 則量化後儲存、不縮放）
+RENDITION_QUALITY = 85
 
-# === 5. Gradio 的主要處理函數 (修改為處理檔案列表輸入) ===
-def run_batch_compression(input_files_list, output_folder_str, target_kb_str, convert_to_webp_flag):
+def parse_renditions(text):
+    """
+    "2048:400,1024:150,512" → [(2048, 400.0), (1024, 150.0), (512, None)]。
+    每項為 長邊像素[:目標 KB]；長邊寫 full 表示原尺寸，省略 KB 表示以 RENDITION_QUALITY 編碼。
+    """
+    renditions = []
+    for item in str(text).split(","):
+        item = item.strip()
+        if not item:
+            continue
+        side, _, kb = item.partition(":")
+        try:
+            side = None if side.strip().lower() == "full" else int(side)
+            kb = float(kb) if kb.strip() else None
+        except ValueError:
+            raise ValueError(f"尺寸格式應為 長邊[:KB]，例如 1024:150：{item}") from None
+        if (side is not None and side < 1) or (kb is not None and kb <= 0):
+            raise ValueError(f"長邊與目標大小需為正數：{item}")
+        renditions.append((side, kb))
+    if not renditions:
+        raise ValueError("至少需要一個尺寸")
+    return renditions
+
+def _rendition_name(output_path, side):
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}_{side or 'full'}{ext}"
+
+def _scaled_curve(points):
+    """[(x, kb), ...] 依 x 排序；不足兩點時無法內插，回傳 None。"""
+    points = sorted(points)
+    return points if len(points) >= 2 else None
+
+def encode_renditions(img, renditions, mode, min_quality=10, max_quality=95):
     """
-    處理批次壓縮。
+    以同一張已解碼（並已自動旋轉）的 PIL 圖片產生多個尺寸，全部在記憶體中進行。
+    由大到小處理，每個尺寸由上一個（較大的）尺寸縮小而來，不必每次都從原圖縮。
+    JPEG / WebP：最大的尺寸以取樣探針建立 每像素大小-品質 曲線，之後每個尺寸都以前面實測的結果
+    （依面積換算）作為起點，取代重新探針；PNG 則以前面實測的 長邊-大小 作為縮放搜尋的起點。
+    Args:
+        renditions: parse_renditions 的結果；長邊超過原圖時以原圖尺寸輸出，WebP 另受 WEBP_MAX_SIZE 限制。
+        mode: "jpeg" / "webp" / "png"。
+    Returns:
+        與 renditions 同順序的 [(log_output, data, attempts, setting, (寬, 高), 秒數), ...]，
+        setting 為 quality（PNG 為縮放比例）。
+    """
+    if mode == "jpeg" and img.mode in ("RGBA", "P", "LA"):
+        img = img.convert("RGB")
+    elif mode == "webp" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if img.mode == "P" else "RGB")
+    elif mode == "png":
+        # 同 encode_png_to_target：保留透明度，完全不透明時改用 RGB（P 模式也只能以最近鄰縮放）
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        if img.mode == "RGBA" and img.getextrema()[3] == (255, 255):
+            img = img.convert("RGB")
+    full_side = max(img.size)
+    limit = min(full_side, max(WEBP_MAX_SIZE)) if mode == "webp" else full_side
+    sides = [min(side or full_side, limit) for side, _ in renditions]
+
+    results = [None] * len(renditions)
+    level = img # 金字塔目前的這一層
+    bits = {} # JPEG / WebP：quality -> 每像素 KB
+    png_sizes = {} # PNG：實際輸出的長邊 -> KB
+    for i in sorted(range(len(renditions)), key=lambda i: -sides[i]):
+        start = time.perf_counter()
+        side, target_kb = sides[i], renditions[i][1]
+        size = _fit_size(img.size, (side, side))
+        if size != level.size:
+            with stage("resize", side=side):
+                level = level.resize(size, Image.LANCZOS)
+        area = size[0] * size[1]
+        log_output = f"  ▶ {size[0]}x{size[1]}" + (f"，目標 {target_kb:.1f} KB\n" if target_kb else "\n")
+
+        if target_kb is None:
+            with stage("encode", format=mode, side=side):
+                if mode == "png": # 與 encode_png_to_target 相同地量化，只是不縮放
+                    data, setting = _encode_png(level, "fast", {"optimize": True})[0], 1.0
+                else:
+                    data = (_encode_jpeg if mode == "jpeg" else _encode_webp)(level, RENDITION_QUALITY)
+                    setting = RENDITION_QUALITY
+            results[i] = (log_output, data, 1, setting, size, time.perf_counter() - start)
+            continue
+
+        measured = {}
+        if mode == "png":
+            curve = _scaled_curve((math.log(px / side), kb) for px, kb in png_sizes.items())
+            search_log, data, attempts, setting = encode_png_to_target(level, target_kb, curve=curve,
+                                                                       measured=measured)
+            png_sizes.update((side * scale, kb) for scale, kb in measured.items())
+        else:
+            encode = _encode_jpeg if mode == "jpeg" else _encode_webp
+            if not bits:
+                with stage("probe"):
+                    probe = _probe_quality_curve(level, encode)
+                bits = {quality: kb / area for quality, kb in probe or ()}
+            curve = _scaled_curve((quality, kb_px * area) for quality, kb_px in bits.items())
+            search_log, data, attempts, setting = ENCODE_FUNCTIONS[mode](
+                level, target_kb, min_quality, max_quality, curve=curve, measured=measured)
+            if setting is not None and curve:
+                # 小圖每像素的大小通常較高：先以這次的實際/預估比例校正整條曲線，再放入實測點
+                ratio = measured[setting] / _curve_size(curve, setting)
+                bits = {quality: kb_px * ratio for quality, kb_px in bits.items()}
+            bits.update((quality, kb / area) for quality, kb in measured.items())
+        results[i] = (log_output + search_log, data, attempts, setting, size, time.perf_counter() - start)
+    return results
+
+def compress_renditions(input_path, output_path, renditions, mode, min_quality=10, max_quality=95):
+    """
+    讀取一次、自動旋轉一次，以 encode_renditions 產生每個尺寸並寫檔。
+    檔名為 output_path 加上 _長邊（原尺寸為 _full），例如 photo_1024.jpg。
+    不需要原尺寸時 JPEG 直接以不小於最大尺寸的 1/2、1/4、1/8 解碼（draft）。
+    Returns:
+        (log_output, records)，每個尺寸一筆紀錄（見 RECORD_FIELDS）。
+    """
+    display_filename = os.path.basename(input_path)
+    start = time.perf_counter()
+    try:
+        original_kb = os.path.getsize(input_path) / 1024
+        with stage("decode"):
+            img = Image.open(input_path)
+            if all(side for side, _ in renditions):
+                largest = max(side for side, _ in renditions)
+                img.draft(None, _fit_size(img.size, (largest, largest)))
+            img.load()
+        img = auto_orient_image(img)
+        results = encode_renditions(img, renditions, mode, min_quality, max_quality)
+    except Exception as e:
+        outputs = [_rendition_name(output_path, side) for side, _ in renditions]
+        return (f"❌ 處理 {display_filename} 時發生錯誤：{e}\n\n",
+                [_make_record(input_path, out, mode, "failed", elapsed=time.perf_counter() - start,
+                              message=str(e)) for out in outputs])
+
+    log_output = f"處理中 ({mode.upper()} × {len(renditions)} 個尺寸)：{display_filename}\n"
+    records = []
+    for (side, target_kb), (search_log, data, attempts, setting, size, seconds) in zip(renditions, results):
+        out_path = _rendition_name(output_path, side)
+        log_output += search_log
+        if data is None:
+            records.append(_make_record(input_path, out_path, mode, "failed", original_kb, original_kb,
+                                        attempts=attempts, elapsed=seconds, message="編碼失敗"))
+            continue
+        with stage("write"), open(out_path, "wb") as f:
+            f.write(data)
+        size_kb = len(data) / 1024
+        mark = "✅" if target_kb is None or size_kb <= target_kb else "⚠️"
+        log_output += f"  {mark} {os.path.basename(out_path)}：{size_kb:.1f} KB\n"
+        records.append(_make_record(input_path, out_path, mode, _compress_status(original_kb, size_kb),
+                                    original_kb, size_kb, setting, attempts, seconds))
+    return log_output + "\n", records
+
+def _rendition_task(input_path, output_path, target_kb, renditions, mode):
+    """iter_compress_results 的處理函數：target_kb 不使用（每個尺寸各有目標）。"""
+    try:
+        return compress_renditions(input_path, output_path, renditions, mode)
+    except _FileTimeout:
+        # 逾時時已寫出的尺寸不完整，一併刪除
+        for side, _ in renditions:
+            path = _rendition_name(output_path, side)
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+def iter_rendition_results(jobs, renditions, workers=1, timeout=None, max_in_flight=None):
+    """
+    依完成順序產生每個 (input_path, output_path, mode) 工作的 (file_log, records)，見 compress_renditions。
+    行程池、逾時與各階段耗時的收集都沿用 iter_compress_results；
+    整個檔案失敗（例如逾時）時 records 只有一筆。
+    """
+    functions = {mode: functools.partial(_rendition_task, renditions=renditions, mode=mode)
+                 for mode in ENCODE_FUNCTIONS}
+    for file_log, records in iter_compress_results(jobs, None, workers, timeout, max_in_flight, functions):
+        yield file_log, records if isinstance(records, list) else [records]
+
+# === 5. 批次壓縮（逐段產生日誌，供 Gradio 串流與命令列即時輸出） ===
+def iter_batch_compression(input_files_list, output_folder_str, target_kb_str, convert_to_webp_flag,
+                           workers=1, timeout=None, records=None):
+    """
+    處理批次壓縮，每完成一個檔案就產生一段日誌字串。
     Args:
         input_files_list: Gradio gr.File(file_count="multiple") 元件的輸出，
-                           是一個包含上傳文件臨時對象的列表。
+                           是一個包含上傳文件臨時對象（或檔案路徑字串）的列表。
         output_folder_str: 使用者在 gr.Textbox 中輸入的輸出資料夾路徑字符串。
         target_kb_str: 目標大小 (KB) 的字符串。
-    Returns:
-        包含處理日誌的字符串。
+        workers: 大於 1 時以行程池平行壓縮。
+        timeout: 單一檔案的處理秒數上限，None 或 0 表示不限制。
+        records: 傳入 list 時，每個檔案的結果紀錄（見 RECORD_FIELDS）會依完成順序附加進去。
+    Yields:
+        日誌片段；串接起來即為完整的處理日誌。
     """
-    log_output = ""
-    total_original_kb = 0
-    total_compressed_kb = 0
-    processed_files = 0
-    failed_files = 0
-    skipped_files = 0 # 計數非圖片或處理前檢查失敗的文件
+    if records is None:
+        records = []
 
     # --- 輸入驗證 ---
     # 1. 驗證是否選擇了檔案
     if not input_files_list:
-        return "❌ 錯誤：請點擊上方按鈕選擇一個或多個圖片檔案。"
+        yield "❌ 錯誤：請點擊上方按鈕選擇一個或多個圖片檔案。"
+        return
     if not isinstance(input_files_list, list):
-        return "❌ 錯誤：輸入檔案格式不正確（預期為文件列表）。"
+        yield "❌ 錯誤：輸入檔案格式不正確（預期為文件列表）。"
+        return
 
     # 2. 驗證輸出資料夾路徑
     if not output_folder_str:
-        return "❌ 錯誤：請在下方文字框中提供輸出資料夾的路徑。"
+        yield "❌ 錯誤：請在下方文字框中提供輸出資料夾的路徑。"
+        return
     output_folder = os.path.abspath(output_folder_str.strip())
     if not output_folder:
-         return "❌ 錯誤：輸出資料夾路徑不能為空。"
+        yield "❌ 錯誤：輸出資料夾路徑不能為空。"
+        return
 
     # 3. 驗證目標大小
     try:
@@ -263,183 +895,204 @@ def run_batch_compression(input_files_list, output_folder_str, target_kb_str, co
         if target_kb <= 0:
             raise ValueError("目標大小必須為正數")
     except ValueError as e:
-        return f"❌ 錯誤：目標檔案大小 '{target_kb_str}' 無效。請輸入一個正數。({e})"
+        yield f"❌ 錯誤：目標檔案大小 '{target_kb_str}' 無效。請輸入一個正數。({e})"
+        return
+    workers = max(1, int(workers or 1))
+    timeout = float(timeout) if timeout else None
 
     # --- 建立輸出資料夾 ---
     try:
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
-            log_output += f"📁 已建立輸出資料夾：{output_folder}\n"
+            yield f"📁 已建立輸出資料夾：{output_folder}\n"
         elif not os.path.isdir(output_folder):
-             return f"❌ 錯誤：輸出路徑 '{output_folder}' 已存在但不是一個資料夾。"
+            yield f"❌ 錯誤：輸出路徑 '{output_folder}' 已存在但不是一個資料夾。"
+            return
         else:
-            log_output += f"📁 輸出資料夾已存在：{output_folder}\n"
+            yield f"📁 輸出資料夾已存在：{output_folder}\n"
     except OSError as e:
         if "Permission denied" in str(e):
-             return f"❌ 錯誤：無法建立或寫入輸出資料夾 '{output_folder}'。權限不足，請檢查路徑或更換位置。({e})"
+            yield f"❌ 錯誤：無法建立或寫入輸出資料夾 '{output_folder}'。權限不足，請檢查路徑或更換位置。({e})"
         else:
-             return f"❌ 錯誤：無法建立輸出資料夾 '{output_folder}'。請檢查路徑是否有效。({e})"
+            yield f"❌ 錯誤：無法建立輸出資料夾 '{output_folder}'。請檢查路徑是否有效。({e})"
+        return
     except Exception as e:
-         return f"❌ 錯誤：處理輸出資料夾路徑 '{output_folder}' 時發生錯誤。 {e}"
+        yield f"❌ 錯誤：處理輸出資料夾路徑 '{output_folder}' 時發生錯誤。 {e}"
+        return
 
-    log_output += f"\n🚀 開始處理選擇的 {len(input_files_list)} 個檔案...\n"
+    header = f"\n🚀 開始處理選擇的 {len(input_files_list)} 個檔案...\n"
     # 不再顯示來源資料夾，因為是多個檔案
-    log_output += f"⬅️  輸出到：{output_folder}\n"
-    log_output += f"🎯 目標檔案大小：{target_kb:.1f} KB\n"
-    log_output += "------------------------------------\n\n"
-
-    # --- 批次處理 (遍歷選擇的文件列表) ---
+    header += f"⬅️  輸出到：{output_folder}\n"
+    header += f"🎯 目標檔案大小：{target_kb:.1f} KB\n"
+    if workers > 1:
+        header += f"⚙️ 平行處理：{workers} 個行程\n"
+    if timeout:
+        header += f"⏱️ 單檔逾時：{timeout:g} 秒\n"
+    yield header + "------------------------------------\n\n"
+
+    # --- 整理工作清單 (遍歷選擇的文件列表) ---
+    jobs = [] # (input_path, output_path, mode)
     for temp_file in input_files_list:
+        # 新版 Gradio 與命令列直接傳入路徑字串，舊版為帶有 .name 的暫存檔物件
+        is_path = isinstance(temp_file, (str, os.PathLike))
+        input_path = os.fspath(temp_file) if is_path else getattr(temp_file, 'name', temp_file) # 臨時文件的路徑
         try:
-            # 獲取原始文件名和臨時文件路徑
-            original_filename = getattr(temp_file, 'orig_name', None)
-            input_path = temp_file.name # 臨時文件的路徑
-
-            if not original_filename:
+            # 獲取原始文件名：路徑直接取檔名，只有缺少 orig_name 的暫存檔物件才需要警告
+            if is_path:
                 original_filename = os.path.basename(input_path)
-                log_output += f"⚠️ 警告：無法獲取文件 {input_path} 的原始名稱，將使用 {original_filename}。\n"
+            else:
+                original_filename = getattr(temp_file, 'orig_name', None)
+                if not original_filename:
+                    original_filename = os.path.basename(input_path)
+                    yield f"⚠️ 警告：無法獲取文件 {input_path} 的原始名稱，將使用 {original_filename}。\n"
 
             if not original_filename: # 如果連推斷都失敗
-                 log_output += f"❌ 無法確定檔案 {input_path} 的名稱，跳過。\n"
-                 skipped_files += 1
-                 continue
+                yield f"❌ 無法確定檔案 {input_path} 的名稱，跳過。\n"
+                records.append(_make_record(input_path, None, None, "skipped", message="無法確定檔名"))
+                continue
 
             # 檢查文件擴展名 (使用原始文件名) - 預先過濾
             ext_lower = os.path.splitext(original_filename)[1].lower()
             if ext_lower not in ['.png', '.jpg', '.jpeg']:
-                log_output += f"⏭️ 跳過非 PNG/JPG/JPEG 檔案：{original_filename}\n"
-                skipped_files += 1
+                yield f"⏭️ 跳過非 PNG/JPG/JPEG 檔案：{original_filename}\n"
+                records.append(_make_record(input_path, None, None, "skipped", message="不支援的副檔名"))
                 continue
 
             # 構造輸出路徑
-            output_path = os.path.join(output_folder, original_filename)
-
-            # 檢查輸出文件是否已存在 (可選：添加覆蓋邏輯或提示)
-            # if os.path.exists(output_path):
-            #     log_output += f"🟡 警告：輸出檔案 {original_filename} 已存在，將被覆蓋。\n"
-
-            file_log = ""
-            original_kb = 0
-            compressed_kb = 0
-
             if convert_to_webp_flag:
                 output_filename = os.path.splitext(original_filename)[0] + ".webp"
-                output_path = os.path.join(output_folder, output_filename)
-                file_log, original_kb, compressed_kb = convert_to_webp(input_path, output_path, target_kb)
+                jobs.append((input_path, os.path.join(output_folder, output_filename), "webp"))
             else:
-                output_path = os.path.join(output_folder, original_filename)
-                if ext_lower == '.png':
-                    file_log, original_kb, compressed_kb = compress_png(input_path, output_path, target_kb)
-                elif ext_lower in ['.jpg', '.jpeg']:
-                    file_log, original_kb, compressed_kb = compress_jpeg(input_path, output_path, target_kb)
-
-            log_output += file_log
-            total_original_kb += original_kb
-
-            # 統計成功/失敗
-            if 0 < original_kb and 0 < compressed_kb < original_kb: # 必須原始和壓縮後都>0 且壓縮後更小
-                total_compressed_kb += compressed_kb
-                processed_files += 1
-            elif original_kb > 0: # 處理了但失敗/未壓縮/變大
-                total_compressed_kb += original_kb # 失敗計入原始大小
-                failed_files += 1
-            elif original_kb == 0 and file_log: # 函數返回了日誌但原始大小為0 (例如跳過的空文件)
-                skipped_files += 1
-            # else: 原始大小為0且無日誌，可能未進入處理
-
+                mode = "png" if ext_lower == '.png' else "jpeg"
+                jobs.append((input_path, os.path.join(output_folder, original_filename), mode))
 
         except Exception as e:
-            # 捕獲處理單個文件的意外循環外錯誤
-            filename_for_error = getattr(temp_file, 'orig_name', temp_file.name)
-            log_output += f"❌❌ 處理檔案 {filename_for_error} 時發生嚴重外部錯誤：{e}\n\n"
-            failed_files += 1
-            # 嘗試計入原始大小
-            try:
-                if os.path.exists(temp_file.name):
-                   current_original_kb = os.path.getsize(temp_file.name) / 1024
-                   total_original_kb += current_original_kb
-                   total_compressed_kb += current_original_kb
-            except: pass
+            filename_for_error = input_path if is_path \
+                else getattr(temp_file, 'orig_name', input_path)
+            yield f"❌❌ 處理檔案 {filename_for_error} 時發生嚴重外部錯誤：{e}\n\n"
+            records.append(_make_record(input_path, None, None, "failed", message=str(e)))
+
+    # --- 批次處理：結果依完成順序回來 ---
+    done = 0
+    for file_log, record in iter_compress_results(jobs, target_kb, workers, timeout):
+        records.append(record)
+        done += 1
+        yield f"[{done}/{len(jobs)}] " + file_log
 
     # --- 總結 ---
-    log_output += "------------------------------------\n"
-    log_output += "📊 壓縮總結：\n"
-    total_files_selected = len(input_files_list)
-    log_output += f"  共選擇檔案：{total_files_selected} 個\n"
-    # 顯示的計數應基於實際處理情況
-    log_output += f"     (圖片處理成功：{processed_files} 個)\n"
-    log_output += f"     (圖片處理失敗/未壓縮：{failed_files} 個)\n"
-    log_output += f"     (跳過非圖片/空檔/其他：{skipped_files} 個)\n"
-    # 確保計數總和等於選擇的檔案數 (用於調試)
-    # assert total_files_selected == processed_files + failed_files + skipped_files, "檔案計數不匹配!"
-
+    yield summarize_records(records, len(input_files_list))
+    yield "\n✅ 所有選擇的檔案處理流程結束。\n"
 
-    if total_original_kb > 0 and processed_files > 0:
-        total_ratio = 100 * (1 - total_compressed_kb / total_original_kb)
-        log_output += f"  總原始大小 (已處理圖片)：{total_original_kb:.1f} KB\n"
-        log_output += f"  總輸出大小 (含失敗)：{total_compressed_kb:.1f} KB\n"
-        log_output += f"  總節省空間 (估算)：{total_ratio:.1f} %\n"
-    elif failed_files > 0 or skipped_files > 0:
-         if total_original_kb > 0:
-             log_output += f"  總原始大小 (已處理圖片)：{total_original_kb:.1f} KB\n"
-         log_output += "  沒有圖片成功壓縮，或所有圖片均被跳過/處理失敗。\n"
-    elif total_files_selected == 0: # 應該在開始時就處理了，但再加個保險
-        log_output += "  未選擇任何檔案。\n"
-    else:
-        log_output += "  未處理任何有效檔案。\n"
+def run_batch_compression(input_files_list, output_folder_str, target_kb_str, convert_to_webp_flag,
+                          workers=1, timeout=None, records=None):
+    """
+    iter_batch_compression 的一次性版本。
+    Returns:
+        包含處理日誌的字符串。
+    """
+    return "".join(iter_batch_compression(input_files_list, output_folder_str, target_kb_str,
+                                          convert_to_webp_flag, workers, timeout, records))
 
-    log_output += "\n✅ 所有選擇的檔案處理流程結束。\n"
+# Gradio 串流更新的最短間隔（秒）；每次更新都要送出整段日誌，不必每個檔案都送
+STREAM_INTERVAL = 0.5
+REPORT_NAME = "compression_report"
 
-    return log_output
+def stream_batch_compression(input_files_list, output_folder_str, target_kb_str, convert_to_webp_flag,
+                             workers=1, timeout=None, report_format="none", profile=False):
+    """
+    Gradio 用的串流版本：逐步產生 (目前的完整日誌, 報表路徑)。
+    report_format 為 "json" 或 "csv" 時，結束後在輸出資料夾寫出 compression_report.json/.csv。
+    profile 為 True 時在日誌最後附上各階段耗時（見 PhotoProfile.Profiler）。
+    """
+    chunks = []
+    records = []
+    last_update = float("-inf")
+    profiler = Profiler(trace_allocations=True, keep_events=False)
+    with profiler if profile else contextlib.nullcontext():
+        for chunk in iter_batch_compression(input_files_list, output_folder_str, target_kb_str,
+                                            convert_to_webp_flag, workers, timeout, records):
+            chunks.append(chunk)
+            # 第一個檔案有結果之前（驗證訊息與標題）每段都立即送出，之後才限制更新頻率
+            if not records or time.monotonic() - last_update >= STREAM_INTERVAL:
+                last_update = time.monotonic()
+                yield "".join(chunks), None
+    if profile:
+        chunks.append(profiler.summary() + "\n")
+
+    report_path = None
+    report_format = (report_format or "none").lower()
+    if report_format in ("json", "csv") and records:
+        report_path = os.path.join(os.path.abspath(output_folder_str.strip()), f"{REPORT_NAME}.{report_format}")
+        try:
+            export_records(records, report_path)
+            chunks.append(f"📄 結果紀錄已匯出：{report_path}\n")
+        except OSError as e:
+            chunks.append(f"❌ 無法匯出結果紀錄：{e}\n")
+            report_path = None
+    yield "".join(chunks), report_path
 
 # === 6. 建立 Gradio 介面 (改為選擇檔案) ===
-with gr.Blocks(theme=gr.themes.Soft()) as iface:
-    gr.Markdown(
-        """
-        # 圖片壓縮工具 (PNG/JPEG)
-
-        1.  點擊下方按鈕 **選擇一個或多個圖片檔案** (PNG, JPG, JPEG)。
-        2.  在**輸出資料夾路徑** 文字框中，**輸入或貼上**希望儲存壓縮後圖片的資料夾路徑。
-            *   如果該資料夾不存在，程式會嘗試自動建立。
-        3.  設定壓縮後的**目標檔案大小** (KB)。
-        4.  點擊**開始壓縮** 按鈕。
-        5.  在右側**處理日誌**中查看詳細過程和結果。
-        """
-    )
-    with gr.Row():
-        with gr.Column(scale=1):
-            # 修改為選擇多個檔案
-            input_file_selector = gr.File(
-                label="1. 點擊選擇圖片檔案 (可多選)",
-                file_count="multiple", # 關鍵修改: 從 "directory" 改為 "multiple"
-                file_types=["image", ".png", ".jpg", ".jpeg"], # 限制可選的文件類型 (前端提示)
-            )
-            convert_webp_checkbox = gr.Checkbox(label="是否轉換為 WebP 格式", value=False)
-
-            output_dir_textbox = gr.Textbox(
-                label="2. 輸入或貼上輸出資料夾路徑",
-                placeholder="例如：C:/Users/Public/Output 或 ./output_images",
-                value="./output_images"
-            )
-            target_size_kb = gr.Number(label="3. 目標檔案大小 (KB)", value=500, minimum=1)
-            compress_button = gr.Button("🚀 開始壓縮", variant="primary")
-        with gr.Column(scale=2):
-             output_log = gr.Textbox(
-                 label="處理日誌",
-                 lines=20,
-                 interactive=False,
-                 autoscroll=True
-            )
-
-    compress_button.click(
-    fn=run_batch_compression,
-    inputs=[input_file_selector, output_dir_textbox, target_size_kb, convert_webp_checkbox],
-    outputs=output_log
-    )  
+def build_interface():
+    # gradio 只在建立介面時才匯入，命令列批次壓縮不需要載入
+    import gradio as gr
+
+    with gr.Blocks(theme=gr.themes.Soft()) as iface:
+        gr.Markdown(
+            """
+            # 圖片壓縮工具 (PNG/JPEG)
+
+            1.  點擊下方按鈕 **選擇一個或多個圖片檔案** (PNG, JPG, JPEG)。
+            2.  在**輸出資料夾路徑** 文字框中，**輸入或貼上**希望儲存壓縮後圖片的資料夾路徑。
+                *   如果該資料夾不存在，程式會嘗試自動建立。
+            3.  設定壓縮後的**目標檔案大小** (KB)。
+            4.  點擊**開始壓縮** 按鈕。
+            5.  在右側**處理日誌**中查看詳細過程和結果。
+            """
+        )
+        with gr.Row():
+            with gr.Column(scale=1):
+                # 修改為選擇多個檔案
+                input_file_selector = gr.File(
+                    label="1. 點擊選擇圖片檔案 (可多選)",
+                    file_count="multiple", # 關鍵修改: 從 "directory" 改為 "multiple"
+                    file_types=["image", ".png", ".jpg", ".jpeg"], # 限制可選的文件類型 (前端提示)
+                )
+                convert_webp_checkbox = gr.Checkbox(label="是否轉換為 WebP 格式", value=False)
+
+                output_dir_textbox = gr.Textbox(
+                    label="2. 輸入或貼上輸出資料夾路徑",
+                    placeholder="例如：C:/Users/Public/Output 或 ./output_images",
+                    value="./output_images"
+                )
+                target_size_kb = gr.Number(label="3. 目標檔案大小 (KB)", value=500, minimum=1)
+                with gr.Row():
+                    workers_number = gr.Number(label="平行行程數", value=1, minimum=1, precision=0)
+                    timeout_number = gr.Number(label="單檔逾時秒數 (0 = 不限制)", value=0, minimum=0)
+                report_format_radio = gr.Radio(["none", "json", "csv"], value="none",
+                                               label="匯出每個檔案的結果紀錄")
+                profile_checkbox = gr.Checkbox(label="在日誌最後列出各階段耗時", value=False)
+                compress_button = gr.Button("🚀 開始壓縮", variant="primary")
+            with gr.Column(scale=2):
+                 output_log = gr.Textbox(
+                     label="處理日誌",
+                     lines=20,
+                     interactive=False,
+                     autoscroll=True
+                )
+                 report_file = gr.File(label="結果紀錄", interactive=False)
+
+        compress_button.click(
+        fn=stream_batch_compression,
+        inputs=[input_file_selector, output_dir_textbox, target_size_kb, convert_webp_checkbox,
+                workers_number, timeout_number, report_format_radio, profile_checkbox],
+        outputs=[output_log, report_file]
+        )
+
+    return iface
 
 
 # === 7. 執行 Gradio 應用 ===
 if __name__ == "__main__":
     print("Gradio 應用程式啟動中...")
     print("請在瀏覽器開啟提供的網址。")
-    iface.launch()
+    build_interface().launch()
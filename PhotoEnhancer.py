@@ -1,172 +1,1076 @@
-import gradio as gr
 import cv2
 import numpy as np
 import os
-import glob
+import math
+import time
+import queue
+import threading
+import json
+import hashlib
+import contextlib
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                wait, as_completed, FIRST_COMPLETED)
+from PhotoProfile import Profiler, stage, hooks_active, wants_allocations, collect_stages, replay
+from PhotoFiles import iter_image_files, mirror_path
 
-# ---------- 影像處理邏輯 ----------
-def apply_fixed_bright_and_dehaze(img, exposure=1.10, dehaze_ratio=0.66):
-    img_float = img.astype(np.float32) / 255.0
+# ---------- 查表 (LUT) ----------
+# 曝光/去霧與亮部壓縮都只和單一 8-bit 數值有關，
+# 依參數組合預先算好 256 項對照表，之後每個像素只需 cv2.LUT 查表。
+LUT_CACHE_SIZE = 64
+_LUT_INPUT = np.arange(256, dtype=np.uint8).reshape(1, 256)
+
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def _tone_lut(exposure, dehaze_ratio):
+    img_float = _LUT_INPUT.astype(np.float32) / 255.0
     img_bright = np.clip(img_float * exposure, 0, 1)
     contrast_strength = 1 + exposure * dehaze_ratio
-    return cv2.convertScaleAbs(img_bright * 255, alpha=contrast_strength, beta=0)
+    lut = cv2.convertScaleAbs(img_bright * 255, alpha=contrast_strength, beta=0)
+    lut.flags.writeable = False
+    return lut
 
-def suppress_highlights_curve(img, threshold=230, softness=0.15):
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
-    h, s, v = cv2.split(hsv)
-    v_norm = v / 255.0
+@lru_cache(maxsize=LUT_CACHE_SIZE)
+def _highlight_lut(threshold, softness, limited):
+    v_norm = _LUT_INPUT.astype(np.float32) / 255.0
     t_norm = threshold / 255.0
-    v_compressed = v_norm / (1 + softness * ((v_norm - t_norm) ** 2))
-    v_new = np.clip(v_compressed * 255.0, 0, 255).astype(np.uint8)
-    return cv2.cvtColor(cv2.merge([h.astype(np.uint8), s.astype(np.uint8), v_new]), cv2.COLOR_HSV2BGR)
+    if limited:
+        mask = v_norm > t_norm
+        v_norm[mask] = v_norm[mask] / (1 + softness * ((v_norm[mask] - t_norm) ** 2))
+        v_compressed = v_norm
+    else:
+        v_compressed = v_norm / (1 + softness * ((v_norm - t_norm) ** 2))
+    lut = np.clip(v_compressed * 255.0, 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+def _saturation_lut(strength, s_mean):
+    # 自然飽和度只和 S 值與整張圖的 S 平均有關，平均每張圖不同，不快取
+    s = _LUT_INPUT.astype(np.float32)
+    s = s + (s_mean - s) * (-strength)
+    return np.clip(s, 0, 255).astype(np.uint8)
+
+def _hsv_lut(highlight_method, curve_threshold, curve_softness,
+             limited_threshold, limited_softness, sat_strength, s_mean):
+    # H 不變、S 做自然飽和度、V 做 curve/limited 亮部壓縮，合成一張三通道表，
+    # 一次 cv2.LUT 就地處理交錯的 HSV 影像，不需 split / merge
+    if highlight_method == "curve":
+        v_lut = _highlight_lut(float(curve_threshold), float(curve_softness), False)
+    elif highlight_method == "limited":
+        v_lut = _highlight_lut(float(limited_threshold), float(limited_softness), True)
+    else:
+        v_lut = _LUT_INPUT
+    return cv2.merge([_LUT_INPUT, _saturation_lut(sat_strength, s_mean), v_lut])
+
+# ---------- 暫存緩衝區 ----------
+# 每個執行緒保留一組具名的暫存陣列，批次中的圖片重複使用（容量只增不減），
+# 避免每張大圖都重新配置並觸發分頁錯誤。回傳的陣列只能在同一次呼叫內使用。
+_scratch = threading.local()
+# 單張處理（介面的工作執行緒）結束後每個執行緒最多保留的暫存位元組數：
+# 預覽代理圖的緩衝區留著重複使用，全解析度大圖的緩衝區則釋放
+SCRATCH_KEEP_BYTES = 64 * 1024 * 1024
+
+def _scratch_buffer(name, shape, dtype=np.uint8):
+    buffers = _scratch.__dict__.setdefault("buffers", {})
+    size = int(np.prod(shape))
+    buf = buffers.get(name)
+    if buf is None or buf.dtype != dtype or buf.size < size:
+        buf = buffers[name] = np.empty(size, dtype)
+    return buf[:size].reshape(shape)
+
+def release_scratch_buffers(keep_bytes=0):
+    """
+    釋放目前執行緒的暫存緩衝區（下一次處理時會重新配置）；
+    keep_bytes > 0 時由大到小釋放，直到剩下的總量不超過 keep_bytes。
+    """
+    buffers = _scratch.__dict__.get("buffers")
+    if not buffers:
+        return
+    total = sum(buf.nbytes for buf in buffers.values())
+    for name, buf in sorted(buffers.items(), key=lambda item: -item[1].nbytes):
+        if total <= keep_bytes:
+            break
+        del buffers[name]
+        total -= buf.nbytes
+
+# blend 的浮點混合以帶狀區進行，浮點暫存只和這個像素數有關
+BLEND_BAND_PIXELS = 1 << 18
+
+def _bands(height, width):
+    rows = max(1, BLEND_BAND_PIXELS // max(width, 1))
+    for y in range(0, height, rows):
+        yield slice(y, min(y + rows, height))
+
+# ---------- 影像處理邏輯 ----------
+def apply_fixed_bright_and_dehaze(img, exposure=1.10, dehaze_ratio=0.66, dst=None):
+    return cv2.LUT(img, _tone_lut(float(exposure), float(dehaze_ratio)), dst=dst)
+
+def _channel_max(img):
+    # HSV 的 V 即各通道最大值，不需要為遮罩額外轉一次 HSV
+    c0, c1, c2 = cv2.split(img)
+    cv2.max(c0, c1, dst=c0)
+    return cv2.max(c0, c2, dst=c0)
+
+def _blend_highlights(img, v, threshold, blend_strength, blur_radius, dst=None):
+    """
+    v 為 HSV 的 V 通道（即各通道最大值），用來產生亮部遮罩。
+    遮罩與模糊圖放在暫存緩衝區，遮罩就地模糊；浮點混合逐帶狀區進行，結果與整張一次計算相同。
+    dst 可為 img 本身（就地覆寫）。
+    """
+    height, width = img.shape[:2]
+    mask_blur = _scratch_buffer("blend_mask", (height, width), np.float32)
+    np.greater(v, threshold, out=mask_blur, casting="unsafe")
+    cv2.GaussianBlur(mask_blur, (blur_radius, blur_radius), 0, dst=mask_blur)
+    soft = cv2.GaussianBlur(img, (blur_radius, blur_radius), 0, dst=_scratch_buffer("blend_soft", img.shape))
+    out = dst if dst is not None else np.empty_like(img)
+    for ys in _bands(height, width):
+        weight = mask_blur[ys, :, None] * blend_strength
+        blended = img[ys].astype(np.float32) * (1 - weight) + soft[ys].astype(np.float32) * weight
+        out[ys] = np.clip(blended, 0, 255, out=blended)
+    return out
+
+# blend 快速模式：縮小後高斯模糊至少保留的 sigma（像素），決定縮小倍率
+FAST_BLEND_MIN_SIGMA = 2.0
+
+def _gaussian_sigma(ksize):
+    # 與 OpenCV 在 sigma=0 時由核大小推算 sigma 的公式相同
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+def _small_gaussian_sigma(blur_radius, factor):
+    # 扣除縮小（box）與線性放大（三角）本身帶來的模糊
+    sigma = _gaussian_sigma(blur_radius)
+    variance = sigma ** 2 - (factor ** 2 - 1) / 12 - factor ** 2 / 6
+    return math.sqrt(max(variance, 0.25)) / factor
+
+def _blend_highlights_fast(img, v, threshold, blend_strength, blur_radius, dst=None):
+    """
+    _blend_highlights 的近似版：
+    1. 只處理亮部遮罩外擴模糊半徑後的外接矩形，沒有亮部時直接回傳；
+    2. 大半徑的高斯模糊在縮小的圖上進行，再以線性內插放大；
+    3. 以 cv2.blendLinear 直接在 uint8 上逐帶狀區混合，不建立三通道浮點暫存。
+    dst 可為 img 本身（就地覆寫）。
+    """
+    result = dst if dst is not None else img.copy()
+    if result is not img and dst is not None:
+        result[...] = img
+    mask = cv2.compare(v, threshold, cv2.CMP_GT)
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return result
+
+    height, width = img.shape[:2]
+    half = blur_radius // 2
+    # 輸出區：遮罩模糊後可能非零的範圍；取樣區：再外擴一次讓模糊有足夠鄰域
+    out_x0, out_y0 = max(x - half, 0), max(y - half, 0)
+    out_x1, out_y1 = min(x + w + half, width), min(y + h + half, height)
+    in_x0, in_y0 = max(out_x0 - half, 0), max(out_y0 - half, 0)
+    in_x1, in_y1 = min(out_x1 + half, width), min(out_y1 + half, height)
+
+    region = img[in_y0:in_y1, in_x0:in_x1]
+    region_mask = mask[in_y0:in_y1, in_x0:in_x1]
+    factor = max(1, int(_gaussian_sigma(blur_radius) / FAST_BLEND_MIN_SIGMA))
+    if factor > 1:
+        small_size = (max(1, region.shape[1] // factor), max(1, region.shape[0] // factor))
+        small_sigma = _small_gaussian_sigma(blur_radius, factor)
+        kernel = 2 * math.ceil(3 * small_sigma) + 1
+        small_mask = cv2.resize(region_mask, small_size, interpolation=cv2.INTER_AREA)
+        small_img = cv2.resize(region, small_size, interpolation=cv2.INTER_AREA)
+        # 在小圖上就先乘上強度，放大後即為混合權重
+        small_weight = cv2.GaussianBlur(small_mask.astype(np.float32) * (blend_strength / 255.0),
+                                        (kernel, kernel), small_sigma)
+        full_size = (region.shape[1], region.shape[0])
+        weight = cv2.resize(small_weight, full_size, interpolation=cv2.INTER_LINEAR,
+                            dst=_scratch_buffer("fast_weight", region.shape[:2], np.float32))
+        soft = cv2.resize(cv2.GaussianBlur(small_img, (kernel, kernel), small_sigma), full_size,
+                          interpolation=cv2.INTER_LINEAR, dst=_scratch_buffer("fast_soft", region.shape))
+    else:
+        weight = cv2.GaussianBlur(region_mask.astype(np.float32) * (blend_strength / 255.0),
+                                  (blur_radius, blur_radius), 0)
+        soft = cv2.GaussianBlur(region, (blur_radius, blur_radius), 0)
+
+    crop = (slice(out_y0 - in_y0, out_y1 - in_y0), slice(out_x0 - in_x0, out_x1 - in_x0))
+    region, soft, weight = region[crop], soft[crop], weight[crop]
+    # 逐帶狀區混合：1 - weight 的浮點暫存只有一條帶狀區大小；
+    # 就地覆寫時 region 為 result 的一部分，同一帶狀區先算完再寫回，不影響其他帶狀區
+    target = result[out_y0:out_y1, out_x0:out_x1]
+    for ys in _bands(*weight.shape):
+        band_weight = weight[ys]
+        target[ys] = cv2.blendLinear(region[ys], soft[ys], 1 - band_weight, band_weight)
+    return result
+
+# 以下單一步驟的版本與 enhance_image 共用 _finish_in_hsv 的就地查表（飽和度強度 0 即不變）
+def suppress_highlights_curve(img, threshold=230, softness=0.15):
+    return _finish_in_hsv(img, cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR, "curve",
+                          threshold, softness, 0, 0, 0.0)
 
 def suppress_highlights_limited(img, threshold=230, softness=0.15):
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
-    h, s, v = cv2.split(hsv)
-    v_norm = v / 255.0
-    t_norm = threshold / 255.0
-    mask = v_norm > t_norm
-    v_norm[mask] = v_norm[mask] / (1 + softness * ((v_norm[mask] - t_norm) ** 2))
-    v_new = np.clip(v_norm * 255.0, 0, 255).astype(np.uint8)
-    return cv2.cvtColor(cv2.merge([h.astype(np.uint8), s.astype(np.uint8), v_new]), cv2.COLOR_HSV2BGR)
+    return _finish_in_hsv(img, cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR, "limited",
+                          0, 0, threshold, softness, 0.0)
 
 def suppress_highlights_blend(img, threshold=230, blend_strength=0.4, blur_radius=41):
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     _, _, v = cv2.split(hsv)
-    mask = (v > threshold).astype(np.float32)
-    mask_blur = cv2.GaussianBlur(mask, (blur_radius, blur_radius), 0)
-    soft = cv2.GaussianBlur(img, (blur_radius, blur_radius), 0)
-    blended = img.astype(np.float32) * (1 - mask_blur[..., None] * blend_strength) + \
-              soft.astype(np.float32) * (mask_blur[..., None] * blend_strength)
-    return np.clip(blended, 0, 255).astype(np.uint8)
+    return _blend_highlights(img, v, threshold, blend_strength, blur_radius)
+
+def suppress_highlights_blend_fast(img, threshold=230, blend_strength=0.4, blur_radius=41):
+    return _blend_highlights_fast(img, _channel_max(img), threshold, blend_strength, blur_radius)
 
 def enhance_saturation_natural(img, strength=0.25):
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
-    h, s, v = cv2.split(hsv)
-    s_mean = np.mean(s)
-    s = s + (s_mean - s) * (-strength)
-    s = np.clip(s, 0, 255)
-    return cv2.cvtColor(cv2.merge([h, s, v]).astype(np.uint8), cv2.COLOR_HSV2BGR)
+    return _finish_in_hsv(img, cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR, None, 0, 0, 0, 0, strength)
 
 # ---------- 主處理流程 ----------
+def _hsv_codes(is_rgb):
+    return ((cv2.COLOR_RGB2HSV, cv2.COLOR_HSV2RGB) if is_rgb
+            else (cv2.COLOR_BGR2HSV, cv2.COLOR_HSV2BGR))
+
+def _tone_and_blend(img, exposure, dehaze_ratio, highlight_method,
+                    blend_threshold, blend_strength, blend_radius, dst=None):
+    # 曝光/去霧寫到 dst（None 時為新陣列），之後的 blend 都在這塊陣列上就地進行
+    with stage("tone"):
+        img = apply_fixed_bright_and_dehaze(img, exposure, dehaze_ratio, dst=dst)
+    if highlight_method == "blend":
+        with stage("highlight_blend"):
+            img = _blend_highlights(img, _channel_max(img), blend_threshold, blend_strength, blend_radius, img)
+    elif highlight_method == "blend_fast":
+        with stage("highlight_blend_fast"):
+            img = _blend_highlights_fast(img, _channel_max(img), blend_threshold, blend_strength,
+                                         blend_radius, img)
+    return img
+
+def _finish_in_hsv(img, to_hsv, from_hsv, highlight_method,
+                   curve_threshold, curve_softness,
+                   limited_threshold, limited_softness,
+                   sat_strength, s_mean=None, dst=None):
+    # HSV 放在暫存緩衝區，亮部壓縮與自然飽和度合成一次就地查表，轉回後寫到 dst
+    with stage("hsv_convert"):
+        hsv = cv2.cvtColor(img, to_hsv, dst=_scratch_buffer("hsv", img.shape))
+    with stage("hsv_lut"):
+        if s_mean is None:
+            s_mean = cv2.mean(hsv)[1]
+        cv2.LUT(hsv, _hsv_lut(highlight_method, curve_threshold, curve_softness,
+                              limited_threshold, limited_softness, sat_strength, s_mean), dst=hsv)
+    with stage("hsv_convert"):
+        return cv2.cvtColor(hsv, from_hsv, dst=dst)
+
+def enhance_image(img, exposure, dehaze_ratio, highlight_method,
+                  curve_threshold, curve_softness,
+                  limited_threshold, limited_softness,
+                  blend_threshold, blend_strength, blend_radius,
+                  sat_strength, is_rgb=False, tile_size=None, inplace=False):
+    """
+    融合版處理流程：曝光/去霧 → 亮部壓制 → 自然飽和度，只做一次 HSV 來回轉換。
+    曝光/去霧與 blend 都是逐通道運算，不受通道順序影響，
+    因此 is_rgb=True 時可直接處理 RGB 圖片，不需額外的 RGB↔BGR 轉換。
+    inplace=True 時結果直接寫回 img（批次處理剛解碼的圖片時使用），否則回傳新陣列；
+    全程只多一份 HSV 暫存（blend 另需遮罩與模糊圖），皆為可重複使用的暫存緩衝區。
+    指定 tile_size 且圖片大於一塊時改用分塊處理（見 _enhance_image_tiled），
+    分塊處理一律寫回傳入的陣列，因此 inplace=False 時先複製一份。
+    """
+    with stage("enhance", method=highlight_method):
+        if tile_size and max(img.shape[:2]) > tile_size:
+            return _enhance_image_tiled(img if inplace else img.copy(), exposure, dehaze_ratio, highlight_method,
+                                        curve_threshold, curve_softness,
+                                        limited_threshold, limited_softness,
+                                        blend_threshold, blend_strength, blend_radius,
+                                        sat_strength, is_rgb, tile_size)
+
+        to_hsv, from_hsv = _hsv_codes(is_rgb)
+        img = _tone_and_blend(img, exposure, dehaze_ratio, highlight_method,
+                              blend_threshold, blend_strength, blend_radius, img if inplace else None)
+        return _finish_in_hsv(img, to_hsv, from_hsv, highlight_method,
+                              curve_threshold, curve_softness,
+                              limited_threshold, limited_softness,
+                              sat_strength, dst=img)
+
+# ---------- 分塊處理（超大圖 / 全景圖）----------
+MIN_TILE_SIZE = 64
+
+def _tiles(height, width, tile, y0=0, y1=None):
+    for y in range(y0, height if y1 is None else y1, tile):
+        for x in range(0, width, tile):
+            yield slice(y, min(y + tile, height)), slice(x, min(x + tile, width))
+
+def _row_bands(height, width, tile):
+    # 逐點運算改用整列的帶狀區（像素數與一塊相同），記憶體連續，
+    # 且 OpenCV 向量化的切分方式與整張處理一致
+    rows = max(1, tile * tile // width)
+    for y in range(0, height, rows):
+        yield slice(y, min(y + rows, height))
+
+def _enhance_image_tiled(img, exposure, dehaze_ratio, highlight_method,
+                         curve_threshold, curve_softness,
+                         limited_threshold, limited_softness,
+                         blend_threshold, blend_strength, blend_radius,
+                         sat_strength, is_rgb, tile_size):
+    """
+    以 tile_size × tile_size 的區塊分兩趟處理，結果直接寫回 img，
+    浮點暫存只和區塊大小有關，與整張圖的尺寸無關。
+    第一趟：曝光/去霧與 blend（區塊外擴模糊核半徑的 halo，接縫處與整張處理結果一致），
+            同時累計整張圖的 S 總和；
+    第二趟：以整張圖的 S 平均做亮部壓縮與自然飽和度。
+    """
+    to_hsv, from_hsv = _hsv_codes(is_rgb)
+    height, width = img.shape[:2]
+    tile = max(int(tile_size), MIN_TILE_SIZE)
+    s_total = 0
+
+    def accumulate_s(region):
+        return int(np.sum(cv2.cvtColor(region, to_hsv)[..., 1], dtype=np.uint64))
+
+    if highlight_method in ("blend", "blend_fast"):
+        # 下一條帶狀區的 halo 需要讀到上一條帶狀區的原始像素，
+        # 因此每條結果先暫存，等下一條算完才寫回 img
+        halo = int(blend_radius) // 2
+        tile = max(tile, halo + 1)
+        pending = None
+        for y in range(0, height, tile):
+            y_end = min(y + tile, height)
+            band = np.empty((y_end - y, width, 3), dtype=np.uint8)
+            for ys, xs in _tiles(height, width, tile, y, y_end):
+                top, left = max(ys.start - halo, 0), max(xs.start - halo, 0)
+                bottom, right = min(ys.stop + halo, height), min(xs.stop + halo, width)
+                region = _tone_and_blend(img[top:bottom, left:right], exposure, dehaze_ratio,
+                                         highlight_method, blend_threshold, blend_strength, blend_radius)
+                region = region[ys.start - top:ys.stop - top, xs.start - left:xs.stop - left]
+                band[:, xs] = region
+                s_total += accumulate_s(region)
+            if pending is not None:
+                img[pending[0]:y] = pending[1]
+            pending = (y, band)
+        img[pending[0]:] = pending[1]
+    else:
+        for ys in _row_bands(height, width, tile):
+            with stage("tone"):
+                apply_fixed_bright_and_dehaze(img[ys], exposure, dehaze_ratio, dst=img[ys])
+            s_total += accumulate_s(img[ys])
+
+    s_mean = s_total / (height * width)
+    for ys in _row_bands(height, width, tile):
+        img[ys] = _finish_in_hsv(img[ys], to_hsv, from_hsv, highlight_method,
+                                 curve_threshold, curve_softness,
+                                 limited_threshold, limited_softness,
+                                 sat_strength, s_mean, dst=img[ys])
+    return img
+
+HIGHLIGHT_METHODS = ("curve", "limited", "blend", "blend_fast")
+
+# 介面與命令列共用的預設參數（順序與 process_single_image 的參數一致）
+DEFAULT_PARAMS = {
+    "exposure": 0.83,
+    "dehaze_ratio": 0.45,
+    "highlight_method": "limited",
+    "curve_threshold": 240,
+    "curve_softness": 0.15,
+    "limited_threshold": 240,
+    "limited_softness": 0.15,
+    "blend_threshold": 240,
+    "blend_strength": 0.4,
+    "blend_radius": 41,
+    "sat_strength": 0.35,
+}
+
+# ---------- 單張結果快取 ----------
+# 介面單張模式來回切換亮部方式或重按「開始處理」時，相同的輸入與參數直接回傳上次的結果
+RESULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# 各亮部方式實際用到的參數（DEFAULT_PARAMS 的索引），其餘參數不影響結果，不放進快取鍵
+_METHOD_PARAM_INDEX = {"curve": (3, 4), "limited": (5, 6), "blend": (7, 8, 9), "blend_fast": (7, 8, 9)}
+
+def _effective_params(params):
+    method = params[2]
+    used = _METHOD_PARAM_INDEX.get(method, ())
+    return tuple(p if i < 3 or i == 10 or i in used else None for i, p in enumerate(params))
+
+class ResultCache:
+    """
+    以「輸入像素的 SHA-256 + 形狀 + 實際用到的參數」為鍵的 LRU 快取，總位元組數不超過 max_bytes。
+    存入的結果設為唯讀並直接回傳，不另外複製；單一結果大於 max_bytes 時不快取。
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(img, *params):
+        digest = hashlib.sha256(np.ascontiguousarray(img).data).hexdigest()
+        return digest, img.shape, img.dtype.str, params
+
+    def get(self, key):
+        with self._lock:
+            result = self._items.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            if result.nbytes > self.max_bytes or key in self._items:
+                return
+            # 只有真正存入的結果設為唯讀；未快取的結果維持可寫，呼叫端可照常就地修改
+            result.flags.writeable = False
+            self._items[key] = result
+            self.bytes += result.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"🗂️ 結果快取：命中 {self.hits} 次 / 未命中 {self.misses} 次（命中率 {rate:.0f}%），"
+                f"{len(self._items)} 筆 {self.bytes / (1024 * 1024):.1f} / {self.max_bytes / (1024 * 1024):.0f} MB，"
+                f"淘汰 {self.evictions} 筆")
+
+# 介面共用的快取
+RESULT_CACHE = ResultCache()
+
 def process_single_image(input_img, exposure, dehaze_ratio, highlight_method,
                          curve_threshold, curve_softness,
                          limited_threshold, limited_softness,
                          blend_threshold, blend_strength, blend_radius,
-                         sat_strength):
-    
-    img = cv2.cvtColor(input_img, cv2.COLOR_RGB2BGR)
-    img = apply_fixed_bright_and_dehaze(img, exposure, dehaze_ratio)
+                         sat_strength, tile_size=None, cache=None):
+    """處理單張 RGB 圖片；傳入 ResultCache 時先查快取（存入或命中快取的結果為唯讀陣列）。"""
+    params = (exposure, dehaze_ratio, highlight_method,
+              curve_threshold, curve_softness,
+              limited_threshold, limited_softness,
+              blend_threshold, blend_strength, blend_radius,
+              sat_strength)
+    if cache is not None:
+        key = cache.key(input_img, _effective_params(params), tile_size)
+        result = cache.get(key)
+        if result is not None:
+            return result
+    try:
+        result = enhance_image(input_img, *params, is_rgb=True, tile_size=tile_size)
+    finally:
+        # 介面在各個工作執行緒中呼叫：不讓每個執行緒都留著最大那張圖的緩衝區
+        release_scratch_buffers(SCRATCH_KEEP_BYTES)
+    if cache is not None:
+        cache.put(key, result)
+    return result
 
-    if highlight_method == "curve":
-        img = suppress_highlights_curve(img, curve_threshold, curve_softness)
-    elif highlight_method == "limited":
-        img = suppress_highlights_limited(img, limited_threshold, limited_softness)
-    elif highlight_method == "blend":
-        img = suppress_highlights_blend(img, blend_threshold, blend_strength, blend_radius)
+# ---------- 低解析度預覽 ----------
+PREVIEW_MAX_SIDE = 1024
+
+def _scale_blend_radius(blend_radius, scale):
+    # blend 的模糊半徑依縮放比例換算，讓縮小圖的柔化範圍與原圖一致（需為奇數）
+    return max(1, int(round(blend_radius * scale)) | 1)
+
+def _scaled_params(params, scale):
+    """依縮放比例換算 process_folder 參數組 (見 DEFAULT_PARAMS 的順序) 中的 blend_radius。"""
+    if scale == 1.0:
+        return params
+    params = list(params)
+    params[9] = _scale_blend_radius(params[9], scale)
+    return tuple(params)
 
-    img = enhance_saturation_natural(img, sat_strength)
-    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+def make_preview_proxy(input_img, max_side=PREVIEW_MAX_SIDE):
+    """上傳時建立縮小版代理圖，回傳 (proxy, scale)，scale 為代理圖相對原圖的比例。"""
+    height, width = input_img.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        input_img = cv2.resize(input_img, size, interpolation=cv2.INTER_AREA)
+    return input_img, scale
+
+def process_preview(proxy, scale, exposure, dehaze_ratio, highlight_method,
+                    curve_threshold, curve_softness,
+                    limited_threshold, limited_softness,
+                    blend_threshold, blend_strength, blend_radius,
+                    sat_strength, cache=None):
+    blend_radius = _scale_blend_radius(blend_radius, scale)
+    return process_single_image(proxy, exposure, dehaze_ratio, highlight_method,
+                                curve_threshold, curve_softness,
+                                limited_threshold, limited_softness,
+                                blend_threshold, blend_strength, blend_radius,
+                                sat_strength, cache=cache)
+
+# ---------- 縮小解碼 ----------
+# JPEG 可在 DCT 階段直接解出 1/2、1/4、1/8 尺寸，只解出需要的像素
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                  (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def read_image(path, max_side=None):
+    """
+    讀取圖片（BGR）；指定 max_side 時縮小到長邊不超過 max_side，回傳 (img, scale)。
+    JPEG 先以不小於目標尺寸的最大 IMREAD_REDUCED_COLOR_* 比例解碼，再以 INTER_AREA 縮到目標大小。
+    讀取失敗時 img 為 None。
+    """
+    with stage("decode"):
+        return _decode_image(path, max_side)
+
+def _decode_image(path, max_side):
+    if not max_side:
+        return cv2.imread(path), 1.0
+    from PIL import Image # 只用來讀檔頭的尺寸與格式，不解碼像素
+
+    flags = cv2.IMREAD_COLOR
+    try:
+        with Image.open(path) as header:
+            long_side, is_jpeg = max(header.size), header.format == "JPEG"
+    except Exception:
+        long_side, is_jpeg = 0, False
+    if is_jpeg:
+        for factor, reduced in _REDUCED_FLAGS:
+            if long_side // factor >= max_side:
+                flags = reduced
+                break
+    img = cv2.imread(path, flags)
+    if img is None:
+        return None, 1.0
+    height, width = img.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale < 1.0:
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    # 相對於原圖的比例（含 DCT 階段的縮小）
+    return img, max(img.shape[:2]) / long_side if long_side else scale
+
+def _init_worker():
+    # 多行程模式下每個行程只用一條 OpenCV 執行緒，避免核心數被重複瓜分
+    cv2.setNumThreads(1)
+
+def _warm_up_worker(delay=0.0):
+    """常駐行程池用：以小圖跑一次完整增強（OpenCV 初始化、查表快取），讓第一個真正的工作不必等待。"""
+    enhance_image(np.full((64, 64, 3), 128, np.uint8), *DEFAULT_PARAMS.values())
+    time.sleep(delay) # 佔住這個行程，讓同時送出的其他預熱工作分到不同的行程
+    return os.getpid()
+
+def load_and_enhance(path, params, tile_size=None, max_side=None):
+    """
+    讀取並增強單一圖片，回傳 BGR 陣列；無法讀取時回傳 None。
+    指定 max_side 時縮小到長邊不超過 max_side（見 read_image），blend 半徑隨之換算。
+    """
+    img, scale = read_image(path, max_side)
+    if img is None:
+        return None
+    return enhance_image(img, *_scaled_params(params, scale), tile_size=tile_size, inplace=True)
+
+def _enhance_file(path, out_path, params, tile_size=None, max_side=None):
+    """讀取、處理並寫出單一圖片，回傳 (path, ok, message)。可在執行緒或行程池中執行。"""
+    try:
+        img = load_and_enhance(path, params, tile_size, max_side)
+        if img is None:
+            return path, False, "無法讀取圖片"
+        with stage("write"):
+            written = cv2.imwrite(out_path, img)
+        if not written:
+            return path, False, f"無法寫入 {out_path}"
+        return path, True, out_path
+    except Exception as e:
+        return path, False, str(e)
+
+# ---------- 串流管線：讀取 → 處理 → 寫出 ----------
+class PipelineStats:
+    """各階段的處理數量、實際工作時間與等待佇列的時間，用來找出瓶頸階段。"""
+
+    STAGES = ("read", "enhance", "write")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = dict.fromkeys(self.STAGES, 0)
+        self.busy = dict.fromkeys(self.STAGES, 0.0)
+        self.wait = dict.fromkeys(self.STAGES, 0.0)
+        self.megapixels = 0.0
+        self.wall = 0.0
+
+    def record(self, stage, busy, wait=0.0, megapixels=0.0):
+        with self._lock:
+            self.count[stage] += 1
+            self.busy[stage] += busy
+            self.wait[stage] += wait
+            self.megapixels += megapixels
+
+    def throughput(self, stage):
+        """該階段單獨運作時每秒可處理的張數。"""
+        return self.count[stage] / self.busy[stage] if self.busy[stage] else 0.0
+
+    def summary(self):
+        lines = [f"⏱️ 管線總耗時 {self.wall:.2f} 秒（{self.megapixels:.1f} MP）"]
+        for stage in self.STAGES:
+            lines.append(f"  {stage:<8}{self.count[stage]:>6} 張  工作 {self.busy[stage]:7.2f} 秒  "
+                         f"等待 {self.wait[stage]:7.2f} 秒  {self.throughput(stage):6.2f} 張/秒")
+        return "\n".join(lines)
+
+_DONE = object()
+
+def run_pipeline(jobs, params, enhance_workers=1, read_depth=4, write_depth=4, stats=None,
+                 tile_size=None, max_side=None, on_result=None):
+    """
+    以有界佇列串接 讀取 → 處理 → 寫出 三個階段，讓磁碟/網路 I/O 與運算重疊。
+    Args:
+        jobs: (輸入路徑, 輸出路徑) 的可迭代物件，會被逐一取用。
+        enhance_workers: 處理階段的執行緒數。
+        read_depth / write_depth: 預讀佇列與待寫佇列的長度，決定記憶體中最多暫存的圖片數。
+        stats: 傳入 PipelineStats 以取得各階段統計。
+        tile_size: 傳給 enhance_image 的分塊大小。
+        max_side: 輸出的長邊上限（見 read_image）。
+        on_result: 每個檔案完成時以 (path, ok, message) 呼叫（在寫出執行緒中）。
+    Returns:
+        每個檔案的結果列表 [(path, ok, message), ...]
+    Raises:
+        jobs 迭代時發生的例外（已讀取的圖片會先處理完）。
+    """
+    stats = stats if stats is not None else PipelineStats()
+    enhance_workers = max(1, int(enhance_workers))
+    read_q = queue.Queue(maxsize=max(1, int(read_depth)))
+    write_q = queue.Queue(maxsize=max(1, int(write_depth)))
+    results = []
+    reader_error = []
+
+    def add_result(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    def reader():
+        # jobs 本身也可能出錯（例如資料夾無法列舉）：無論如何都要送出結束標記，
+        # 否則處理與寫出執行緒會一直等待；錯誤在所有執行緒結束後由 run_pipeline 拋出
+        try:
+            for path, out_path in jobs:
+                t0 = time.perf_counter()
+                try:
+                    img, scale = read_image(path, max_side)
+                    item = (path, out_path, img, scale, None if img is not None else "無法讀取圖片")
+                except Exception as e:
+                    item = (path, out_path, None, 1.0, str(e))
+                t1 = time.perf_counter()
+                read_q.put(item)
+                stats.record("read", t1 - t0, time.perf_counter() - t1)
+        except BaseException as e:
+            reader_error.append(e)
+        finally:
+            for _ in range(enhance_workers):
+                read_q.put(_DONE)
+
+    def enhancer():
+        while True:
+            t0 = time.perf_counter()
+            item = read_q.get()
+            if item is _DONE:
+                write_q.put(_DONE)
+                return
+            path, out_path, img, scale, error = item
+            t1 = time.perf_counter()
+            megapixels = 0.0
+            if img is not None:
+                try:
+                    megapixels = img.shape[0] * img.shape[1] / 1e6
+                    img = enhance_image(img, *_scaled_params(params, scale), tile_size=tile_size,
+                                        inplace=True)
+                except Exception as e:
+                    img, error = None, str(e)
+            t2 = time.perf_counter()
+            write_q.put((path, out_path, img, error))
+            stats.record("enhance", t2 - t1, (t1 - t0) + (time.perf_counter() - t2), megapixels)
+
+    def writer():
+        remaining = enhance_workers
+        while remaining:
+            t0 = time.perf_counter()
+            item = write_q.get()
+            if item is _DONE:
+                remaining -= 1
+                continue
+            path, out_path, img, error = item
+            t1 = time.perf_counter()
+            if img is None:
+                add_result((path, False, error))
+                continue
+            try:
+                with stage("write"):
+                    written = cv2.imwrite(out_path, img)
+                result = (path, True, out_path) if written else (path, False, f"無法寫入 {out_path}")
+            except Exception as e:
+                result = (path, False, str(e))
+            add_result(result)
+            stats.record("write", time.perf_counter() - t1, t1 - t0)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=reader, daemon=True),
+               threading.Thread(target=writer, daemon=True)]
+    threads += [threading.Thread(target=enhancer, daemon=True) for _ in range(enhance_workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats.wall = time.perf_counter() - start
+    if reader_error:
+        raise reader_error[0]
+    return results
+
+# ---------- 增量處理 manifest ----------
+MANIFEST_NAME = ".photo_enhancer_manifest.json"
+MANIFEST_VERSION = 1
+
+def _params_digest(params):
+    return hashlib.sha256(json.dumps([MANIFEST_VERSION, *params]).encode("utf-8")).hexdigest()
+
+def _file_fingerprint(path, verify_content=False):
+    st = os.stat(path)
+    fingerprint = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if verify_content:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+def load_manifest(output_folder):
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+def save_manifest(output_folder, manifest):
+    # 先寫暫存檔再取代，避免中斷時留下損壞的 manifest
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+def _is_unchanged(entry, fingerprint, digest, out_path):
+    if not entry or entry.get("params") != digest or not os.path.exists(out_path):
+        return False
+    # 只比對本次有計算的欄位（未開啟內容雜湊時不比 sha256）
+    return all(entry.get(key) == value for key, value in fingerprint.items())
+
+# ---------- 批次處理 ----------
+def _run_jobs(jobs, params, workers, executor, max_in_flight, read_depth, write_depth, stats,
+              tile_size, max_side, on_result=None):
+    # on_result：每個檔案完成時立即以 (path, ok, message) 呼叫，中斷時已完成的部分不會遺失
+    workers = max(1, int(workers))
+    if executor == "pipeline":
+        return run_pipeline(jobs, params, workers, read_depth, write_depth, stats, tile_size, max_side,
+                            on_result)
+    results = []
+
+    def add_result(result):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    if workers == 1:
+        for path, out_path in jobs:
+            add_result(_enhance_file(path, out_path, params, tile_size, max_side))
+        return results
+
+    if executor == "process":
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    elif executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f"未知的 executor：{executor}")
+
+    # 子行程看不到父行程註冊的掛鉤：在子行程中收集階段事件，完成後交給父行程的掛鉤
+    profiling = executor == "process" and hooks_active()
+
+    def submit(path, out_path):
+        if profiling:
+            return pool.submit(collect_stages, wants_allocations(), _enhance_file,
+                               path, out_path, params, tile_size, max_side)
+        return pool.submit(_enhance_file, path, out_path, params, tile_size, max_side)
+
+    def result_of(future):
+        if not profiling:
+            return future.result()
+        result, events = future.result()
+        replay(events)
+        return result
+
+    max_in_flight = max(workers, int(max_in_flight or workers * 2))
+    pending = set()
+    with pool:
+        try:
+            for path, out_path in jobs:
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        pending.discard(f)
+                        add_result(result_of(f))
+                pending.add(submit(path, out_path))
+            while pending:
+                f = next(as_completed(pending))
+                pending.discard(f)
+                add_result(result_of(f))
+        except BaseException:
+            # 中斷時不再送出新工作，等執行中的完成後仍回報已寫出的檔案
+            pool.shutdown(cancel_futures=True)
+            for f in pending:
+                if not f.cancelled() and f.exception() is None:
+                    add_result(result_of(f))
+            raise
+    return results
 
 def process_folder(input_folder, output_folder, exposure, dehaze_ratio,
                    highlight_method, curve_threshold, curve_softness,
                    limited_threshold, limited_softness,
                    blend_threshold, blend_strength, blend_radius,
-                   sat_strength):
-    
+                   sat_strength, workers=1, executor="thread", max_in_flight=None,
+                   read_depth=4, write_depth=4, stats=None,
+                   incremental=False, verify_content=False, tile_size=None, max_side=None,
+                   recursive=False, shard=None):
+    """
+    批次處理資料夾內的圖片。
+    Args:
+        workers: 同時處理的數量；1 表示在目前執行緒中逐張處理。
+        executor: "thread"（OpenCV 大部分運算會釋放 GIL）、"process"，
+                  或 "pipeline"（讀取/處理/寫出分階段重疊，見 run_pipeline）。
+        max_in_flight: 同時送進池中的最多圖片數，用來限制記憶體用量，預設為 workers * 2。
+        read_depth / write_depth: pipeline 模式的佇列長度。
+        stats: pipeline 模式下傳入 PipelineStats 以取得各階段統計。
+        incremental: 依輸出資料夾中的 manifest 略過未變更的圖片；參數改變時全部重做。
+        verify_content: 除了大小與修改時間外，另以 SHA-256 比對檔案內容。
+        tile_size: 分塊處理的區塊邊長，超大圖時用來限制記憶體用量（見 _enhance_image_tiled）。
+        max_side: 輸出的長邊上限；JPEG 會直接以縮小尺寸解碼（見 read_image）。
+        recursive: 一併處理子資料夾，輸出資料夾沿用相同的目錄結構。
+        shard: (i, N)，只處理第 i 片（見 PhotoFiles.parse_shard）。
+    Returns:
+        每個檔案的結果列表 [(path, ok, message), ...]，ok 為 None 表示未變更而略過。
+        輸入資料夾不存在，或其中的子資料夾無法讀取時，以該資料夾路徑回報一筆失敗。
+        可用 summarize_folder_results 轉成文字。
+    """
+    if not os.path.isdir(input_folder):
+        return [(input_folder, False, "找不到輸入資料夾")]
     os.makedirs(output_folder, exist_ok=True)
-    image_paths = glob.glob(os.path.join(input_folder, "*.[jJpP]*[gGnN]*"))
-    count = 0
-    for path in image_paths:
-        img = cv2.imread(path)
-        if img is None: continue
+    params = (exposure, dehaze_ratio, highlight_method,
+              curve_threshold, curve_softness,
+              limited_threshold, limited_softness,
+              blend_threshold, blend_strength, blend_radius,
+              sat_strength)
+    # 邊列舉邊處理：第一個檔案找到就開始，不必先列完整個資料夾
+    created = set()
+    folder_errors = [] # 無法讀取的子資料夾，列舉結束後附在結果最後
+
+    def unreadable(error):
+        folder_errors.append((error.filename or input_folder, False,
+                              f"無法讀取資料夾：{error.strerror or error}"))
+
+    jobs = ((path, mirror_path(rel_path, output_folder, created=created))
+            for path, rel_path in iter_image_files(input_folder, recursive, shard, exclude=(output_folder,),
+                                                   on_error=unreadable))
+
+    if not incremental:
+        try:
+            return _run_jobs(jobs, params, workers, executor, max_in_flight,
+                             read_depth, write_depth, stats, tile_size, max_side) + folder_errors
+        finally:
+            release_scratch_buffers()
 
-        img = apply_fixed_bright_and_dehaze(img, exposure, dehaze_ratio)
+    manifest = load_manifest(output_folder)
+    digest = _params_digest(params if not max_side else (*params, int(max_side)))
+    skipped = []
+    fingerprints = {}
 
-        if highlight_method == "curve":
-            img = suppress_highlights_curve(img, curve_threshold, curve_softness)
-        elif highlight_method == "limited":
-            img = suppress_highlights_limited(img, limited_threshold, limited_softness)
-        elif highlight_method == "blend":
-            img = suppress_highlights_blend(img, blend_threshold, blend_strength, blend_radius)
+    def changed_jobs():
+        for path, out_path in jobs:
+            key = os.path.relpath(path, input_folder).replace(os.sep, "/")
+            try:
+                fingerprint = _file_fingerprint(path, verify_content)
+            except OSError as e:
+                skipped.append((path, False, str(e)))
+                continue
+            if _is_unchanged(manifest["files"].get(key), fingerprint, digest, out_path):
+                skipped.append((path, None, "未變更，略過"))
+                continue
+            fingerprints[path] = (key, fingerprint)
+            yield path, out_path
 
-        img = enhance_saturation_natural(img, sat_strength)
+    lock = threading.Lock() # pipeline 模式在寫出執行緒中回報結果
 
-        out_path = os.path.join(output_folder, os.path.basename(path))
-        cv2.imwrite(out_path, img)
-        count += 1
+    def record(result):
+        # 每完成一張就更新 manifest，中斷（Ctrl-C 或例外）時 finally 存下的就是實際進度
+        path, ok, _ = result
+        key, fingerprint = fingerprints.pop(path)
+        with lock:
+            if ok:
+                manifest["files"][key] = dict(fingerprint, params=digest)
+            else:
+                manifest["files"].pop(key, None)
 
-    return f"✅ 批次處理完成，共處理 {count} 張圖片。"
+    try:
+        results = _run_jobs(changed_jobs(), params, workers, executor, max_in_flight,
+                            read_depth, write_depth, stats, tile_size, max_side, on_result=record)
+    finally:
+        release_scratch_buffers()
+        with lock:
+            save_manifest(output_folder, manifest)
+    return skipped + results + folder_errors
+
+def summarize_folder_results(results):
+    ok_count = sum(1 for _, ok, _ in results if ok)
+    skipped_count = sum(1 for _, ok, _ in results if ok is None)
+    lines = [f"✅ 批次處理完成，共處理 {ok_count} 張圖片。"]
+    if skipped_count:
+        lines.append(f"⏭️ 未變更略過 {skipped_count} 張。")
+    failed = [(path, msg) for path, ok, msg in results if ok is False]
+    if failed:
+        lines.append(f"❌ 失敗 {len(failed)} 張：")
+        lines += [f"  {os.path.basename(path)}：{msg}" for path, msg in failed]
+    return "\n".join(lines)
 
 # ---------- Gradio UI ----------
-with gr.Blocks(theme=gr.themes.Soft()) as demo:
-    gr.Markdown("# 📸 Photo Enhancer")
-
-    mode = gr.Radio(choices=["單張處理", "資料夾批次"], value="單張處理", label="選擇模式")
-
-    with gr.Row():
-        with gr.Column():
-            image_input = gr.Image(type="numpy", label="上傳圖片（單張模式）")
-            input_dir = gr.Textbox(label="輸入資料夾", value="input_images", visible=False)
-            output_dir = gr.Textbox(label="輸出資料夾", value="output_images", visible=False)
-        output_img = gr.Image(label="處理後圖片", visible=True)
-        output_msg = gr.Textbox(label="處理結果", visible=False)
-
-    exposure = gr.Slider(0.7, 1.5, value=0.83, label="曝光倍率 exposure")
-    dehaze_ratio = gr.Slider(0.0, 1.0, value=0.45, label="去霧強度 dehaze ratio")
-    sat_strength = gr.Slider(0.0, 1.0, value=0.35, label="自然飽和度強度")
-
-    highlight_method = gr.Radio(choices=["curve", "limited", "blend"], value="limited", label="亮部壓制方式")
-
-    with gr.Tab("curve 參數"):
-        curve_threshold = gr.Slider(180, 255, value=240, label="threshold")
-        curve_softness = gr.Slider(0.05, 0.5, value=0.15, label="softness")
-
-    with gr.Tab("limited 參數"):
-        limited_threshold = gr.Slider(180, 255, value=240, label="threshold")
-        limited_softness = gr.Slider(0.05, 0.5, value=0.15, label="softness")
-
-    with gr.Tab("blend 參數"):
-        blend_threshold = gr.Slider(180, 255, value=240, label="threshold")
-        blend_strength = gr.Slider(0.0, 1.0, value=0.4, label="blend strength")
-        blend_radius = gr.Slider(5, 61, step=2, value=41, label="模糊範圍 blur radius")
-
-    
-
-    run_btn = gr.Button("🚀 開始處理")
-
-    def handle_run(mode, image_input, input_dir, output_dir, *params):
-        if mode == "單張處理" and image_input is not None:
-            result = process_single_image(image_input, *params)
-            return result, gr.update(visible=True), gr.update(visible=False)
-        elif mode == "資料夾批次":
-            msg = process_folder(input_dir, output_dir, *params)
-            return None, gr.update(visible=False), gr.update(value=msg, visible=True)
-        else:
-            return None, gr.update(visible=False), gr.update(value="❌ 請上傳圖片或確認資料夾", visible=True)
-
-    run_btn.click(
-        fn=handle_run,
-        inputs=[
-            mode, image_input, input_dir, output_dir,
+def build_demo():
+    # gradio 只在建立介面時才匯入，讓批次處理 / 命令列使用時不必載入
+    import gradio as gr
+
+    with gr.Blocks(theme=gr.themes.Soft()) as demo:
+        gr.Markdown("# 📸 Photo Enhancer")
+
+        mode = gr.Radio(choices=["單張處理", "資料夾批次"], value="單張處理", label="選擇模式")
+
+        with gr.Row():
+            with gr.Column():
+                image_input = gr.Image(type="numpy", label="上傳圖片（單張模式）")
+                input_dir = gr.Textbox(label="輸入資料夾", value="input_images", visible=False)
+                output_dir = gr.Textbox(label="輸出資料夾", value="output_images", visible=False)
+                workers = gr.Number(value=os.cpu_count() or 1, minimum=1, precision=0,
+                                    label="平行處理數 workers", visible=False)
+                executor = gr.Radio(choices=["thread", "process", "pipeline"], value="thread",
+                                    label="平行方式", visible=False)
+                incremental = gr.Checkbox(value=True, label="只處理新增或變更的圖片", visible=False)
+                profile_stages = gr.Checkbox(value=False, label="列出各階段耗時")
+            output_img = gr.Image(label="處理後圖片", visible=True)
+            output_msg = gr.Textbox(label="處理結果", visible=False)
+
+        exposure = gr.Slider(0.7, 1.5, value=DEFAULT_PARAMS["exposure"], label="曝光倍率 exposure")
+        dehaze_ratio = gr.Slider(0.0, 1.0, value=DEFAULT_PARAMS["dehaze_ratio"], label="去霧強度 dehaze ratio")
+        sat_strength = gr.Slider(0.0, 1.0, value=DEFAULT_PARAMS["sat_strength"], label="自然飽和度強度")
+
+        highlight_method = gr.Radio(choices=list(HIGHLIGHT_METHODS),
+                                    value=DEFAULT_PARAMS["highlight_method"],
+                                    label="亮部壓制方式（blend_fast 為 blend 的快速近似版）")
+
+        with gr.Tab("curve 參數"):
+            curve_threshold = gr.Slider(180, 255, value=DEFAULT_PARAMS["curve_threshold"], label="threshold")
+            curve_softness = gr.Slider(0.05, 0.5, value=DEFAULT_PARAMS["curve_softness"], label="softness")
+
+        with gr.Tab("limited 參數"):
+            limited_threshold = gr.Slider(180, 255, value=DEFAULT_PARAMS["limited_threshold"], label="threshold")
+            limited_softness = gr.Slider(0.05, 0.5, value=DEFAULT_PARAMS["limited_softness"], label="softness")
+
+        with gr.Tab("blend 參數"):
+            blend_threshold = gr.Slider(180, 255, value=DEFAULT_PARAMS["blend_threshold"], label="threshold")
+            blend_strength = gr.Slider(0.0, 1.0, value=DEFAULT_PARAMS["blend_strength"], label="blend strength")
+            blend_radius = gr.Slider(5, 61, step=2, value=DEFAULT_PARAMS["blend_radius"], label="模糊範圍 blur radius")
+
+        tile_size = gr.Number(value=0, minimum=0, precision=0,
+                              label="分塊大小 tile size（0 = 不分塊；超大圖/全景圖可設 1024~4096 限制記憶體）")
+        live_preview = gr.Checkbox(value=True, label=f"即時預覽（長邊 {PREVIEW_MAX_SIDE}px 代理圖）")
+        preview_state = gr.State()
+
+        run_btn = gr.Button("🚀 開始處理")
+
+        enhance_params = [
             exposure, dehaze_ratio, highlight_method,
             curve_threshold, curve_softness,
             limited_threshold, limited_softness,
             blend_threshold, blend_strength, blend_radius,
             sat_strength
-        ],
-        outputs=[output_img, output_img, output_msg]
-    )
-
-    def toggle_mode(mode):
-        return {
-            image_input: gr.update(visible=(mode == "單張處理")),
-            input_dir: gr.update(visible=(mode == "資料夾批次")),
-            output_dir: gr.update(visible=(mode == "資料夾批次")),
-            output_img: gr.update(visible=(mode == "單張處理")),
-            output_msg: gr.update(visible=(mode == "資料夾批次"))
-        }
-
-    mode.change(toggle_mode, inputs=[mode], outputs=[image_input, input_dir, output_dir, output_img, output_msg])
-
-demo.launch()
+        ]
+
+        def handle_run(mode, image_input, input_dir, output_dir, workers, executor, incremental,
+                       tile_size, profile, *params):
+            tile_size = int(tile_size or 0) or None
+            profiler = Profiler(trace_allocations=True, keep_events=False)
+            if mode == "單張處理" and image_input is not None:
+                with profiler if profile else contextlib.nullcontext():
+                    result = process_single_image(image_input, *params, tile_size=tile_size,
+                                                  cache=RESULT_CACHE)
+                msg = RESULT_CACHE.summary()
+                if profile:
+                    msg += "\n" + profiler.summary()
+                return result, gr.update(visible=True), gr.update(value=msg, visible=True)
+            elif mode == "資料夾批次":
+                stats = PipelineStats()
+                with profiler if profile else contextlib.nullcontext():
+                    results = process_folder(input_dir, output_dir, *params,
+                                             workers=workers, executor=executor, stats=stats,
+                                             incremental=incremental, tile_size=tile_size)
+                msg = summarize_folder_results(results)
+                if executor == "pipeline":
+                    msg += "\n" + stats.summary()
+                if profile:
+                    msg += "\n" + profiler.summary()
+                return None, gr.update(visible=False), gr.update(value=msg, visible=True)
+            else:
+                return None, gr.update(visible=False), gr.update(value="❌ 請上傳圖片或確認資料夾", visible=True)
+
+        run_btn.click(
+            fn=handle_run,
+            inputs=[mode, image_input, input_dir, output_dir, workers, executor, incremental,
+                    tile_size, profile_stages] + enhance_params,
+            outputs=[output_img, output_img, output_msg]
+        )
+
+        def handle_upload(image_input, live_preview, *params):
+            if image_input is None:
+                return None, None
+            proxy = make_preview_proxy(image_input)
+            preview = process_preview(*proxy, *params, cache=RESULT_CACHE) if live_preview else None
+            return proxy, preview
+
+        def handle_preview(mode, preview_state, live_preview, *params):
+            if mode != "單張處理" or not live_preview or preview_state is None:
+                return gr.update()
+            return process_preview(*preview_state, *params, cache=RESULT_CACHE)
+
+        image_input.change(
+            fn=handle_upload,
+            inputs=[image_input, live_preview] + enhance_params,
+            outputs=[preview_state, output_img]
+        )
+
+        # 拖曳滑桿時只重算代理圖；完整解析度仍由「開始處理」產生
+        for component in enhance_params + [live_preview]:
+            component.change(
+                fn=handle_preview,
+                inputs=[mode, preview_state, live_preview] + enhance_params,
+                outputs=output_img,
+                trigger_mode="always_last",
+                show_progress="hidden"
+            )
+
+        def toggle_mode(mode):
+            return {
+                image_input: gr.update(visible=(mode == "單張處理")),
+                input_dir: gr.update(visible=(mode == "資料夾批次")),
+                output_dir: gr.update(visible=(mode == "資料夾批次")),
+                workers: gr.update(visible=(mode == "資料夾批次")),
+                executor: gr.update(visible=(mode == "資料夾批次")),
+                incremental: gr.update(visible=(mode == "資料夾批次")),
+                live_preview: gr.update(visible=(mode == "單張處理")),
+                output_img: gr.update(visible=(mode == "單張處理")),
+                output_msg: gr.update(visible=(mode == "資料夾批次"))
+            }
+
+        mode.change(toggle_mode, inputs=[mode],
+                    outputs=[image_input, input_dir, output_dir, workers, executor, incremental,
+                             live_preview, output_img, output_msg])
+
+    return demo
+
+if __name__ == "__main__":
+    build_demo().launch()
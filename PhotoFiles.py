@@ -0,0 +1,103 @@
+"""
+批次處理的檔案列舉：以 os.scandir 逐一產生圖片路徑，第一個檔案找到就能開始處理，
+不必等整個資料夾（或整棵目錄樹）列完。
+
+    from PhotoFiles import iter_image_files, parse_shard
+
+    for path, rel_path in iter_image_files("archive", recursive=True, shard=parse_shard("2/8")):
+        ...
+
+只接受 IMAGE_EXTENSIONS 中的副檔名（不分大小寫），略過以 "." 開頭的檔案與資料夾，
+不跟隨資料夾的符號連結（避免循環）。同一資料夾內的順序為檔案系統回傳的順序。
+無法列舉的資料夾（權限不足、列舉途中被刪除）只略過該資料夾，不中斷整批。
+分片：依相對路徑（以 "/" 分隔）的 CRC32 決定屬於哪一片，與列舉順序、掛載位置和機器無關，
+多台機器各自指定 --shard 1/N … N/N 即可不經協調地分攤同一份資料。
+"""
+import os
+import zlib
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def parse_shard(text):
+    """把 "i/N"（1 ≤ i ≤ N）解析成 (i, N)；None 或空字串表示不分片。"""
+    if not text:
+        return None
+    try:
+        index, count = (int(part) for part in str(text).split("/"))
+    except ValueError:
+        raise ValueError(f"分片格式應為 i/N，例如 1/4：{text}") from None
+    if not 1 <= index <= count:
+        raise ValueError(f"分片編號需介於 1 與 {count} 之間：{text}")
+    return index, count
+
+def in_shard(rel_path, shard):
+    if shard is None:
+        return True
+    index, count = shard
+    key = rel_path.replace(os.sep, "/").encode("utf-8", "surrogateescape")
+    return zlib.crc32(key) % count == index - 1
+
+def is_image_name(name, extensions=IMAGE_EXTENSIONS):
+    return not name.startswith(".") and os.path.splitext(name)[1].lower() in extensions
+
+def iter_image_files(input_folder, recursive=False, shard=None, exclude=(), extensions=IMAGE_EXTENSIONS,
+                     on_error=None):
+    """
+    逐一產生 (路徑, 相對於 input_folder 的路徑)。
+    Args:
+        recursive: 是否進入子資料夾（深度優先，先處理完目前資料夾的檔案）。
+        shard: parse_shard 的結果，只產生屬於這一片的檔案。
+        exclude: 不進入的資料夾，例如位於輸入資料夾內的輸出資料夾。
+        on_error: 資料夾無法列舉時以該 OSError 呼叫（同 os.walk 的 onerror），之後略過該資料夾；
+            預設直接略過。input_folder 本身也適用，需要區分時由呼叫端先檢查。
+    """
+    excluded = {os.path.realpath(path) for path in exclude}
+    folders = [("", input_folder)]
+    while folders:
+        rel_folder, folder = folders.pop()
+        subfolders = []
+        try:
+            entries = os.scandir(folder)
+        except OSError as e:
+            if on_error is not None:
+                on_error(e)
+            continue
+        with entries:
+            while True:
+                try:
+                    entry = next(entries, None)
+                except OSError as e: # 讀取目錄內容時出錯（例如資料夾被移除）
+                    if on_error is not None:
+                        on_error(e)
+                    break
+                if entry is None:
+                    break
+                if entry.name.startswith("."):
+                    continue
+                rel_path = os.path.join(rel_folder, entry.name)
+                try:
+                    if recursive and entry.is_dir(follow_symlinks=False):
+                        if os.path.realpath(entry.path) not in excluded:
+                            subfolders.append((rel_path, entry.path))
+                    elif is_image_name(entry.name, extensions) and entry.is_file() \
+                            and in_shard(rel_path, shard):
+                        yield entry.path, rel_path
+                except OSError:
+                    continue # 列舉途中被刪除或無權限
+        folders.extend(reversed(subfolders))
+
+def mirror_path(rel_path, output_folder, extension=None, created=None):
+    """
+    輸出資料夾中對應 rel_path 的路徑，需要時建立中間資料夾；extension 指定時替換副檔名。
+    傳入同一個 set 作為 created 可省去重複的 makedirs。
+    """
+    if extension:
+        rel_path = os.path.splitext(rel_path)[0] + extension
+    out_path = os.path.join(output_folder, rel_path)
+    folder = os.path.dirname(out_path)
+    if created is None or folder not in created:
+        os.makedirs(folder, exist_ok=True)
+        if created is not None:
+            created.add(folder)
+    return out_path
@@ -0,0 +1,141 @@
+"""
+增強 → 壓縮 一次完成：增強後的陣列直接在記憶體中交給目標大小編碼器，不寫出中間檔，
+每張圖片只解碼一次、只寫出最終檔案。
+
+    from PhotoEnhancer import DEFAULT_PARAMS
+    from PhotoPipeline import run_enhance_compress
+
+    print(run_enhance_compress("raw_photos", "web", DEFAULT_PARAMS.values(),
+                               output_format="webp", target_kb=300, workers=8))
+"""
+import functools
+import os
+
+import cv2
+from PIL import Image
+
+from PhotoEnhancer import load_and_enhance
+from PhotoFiles import iter_image_files, mirror_path
+from PhotoProfile import stage
+from PhotoCompressor import (ENCODE_FUNCTIONS, WEBP_MAX_SIZE, get_compression_info_str,
+                             iter_compress_results, summarize_records)
+
+# "auto" 依輸入副檔名決定（PNG 輸出 PNG，其餘輸出 JPEG），其他為固定輸出格式
+OUTPUT_FORMATS = ("auto", "jpeg", "webp", "png")
+OUTPUT_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+
+
+def enhance_and_compress(input_path, output_path, target_kb, mode, params,
+                         tile_size=None, max_side=None, encode_options=None):
+    """
+    讀取 → 增強 → 在記憶體中編碼到 target_kb → 寫檔一次。
+    Args:
+        mode: "jpeg" / "webp" / "png"，對應 PhotoCompressor.ENCODE_FUNCTIONS。
+        params: 增強參數，順序同 PhotoEnhancer.DEFAULT_PARAMS。
+        tile_size / max_side: 見 PhotoEnhancer.process_folder；WebP 輸出本來就會縮入
+            WEBP_MAX_SIZE，因此 max_side 至多取其長邊，JPEG 直接以縮小尺寸解碼與增強。
+        encode_options: 傳給編碼函數的其他參數，例如 {"quantize_effort": "best"}。
+    Returns:
+        與 PhotoCompressor.compress_jpeg 相同的 (log_output, original_kb, compressed_kb, attempts, setting)。
+    """
+    display_filename = os.path.basename(output_path)
+    log_output = f"處理中 (增強 → {mode.upper()})：{display_filename}\n"
+    attempts = 0
+    try:
+        if not os.path.exists(input_path) or os.path.getsize(input_path) == 0:
+            log_output += f"⚠️ 警告：檔案不存在或為空：{input_path}\n"
+            return log_output, 0, 0, 0, None
+        original_kb = os.path.getsize(input_path) / 1024
+
+        if mode == "webp":
+            max_side = min(max_side or max(WEBP_MAX_SIZE), max(WEBP_MAX_SIZE))
+        img = load_and_enhance(input_path, params, tile_size, max_side)
+        if img is None:
+            log_output += f"❌ 錯誤：檔案 {display_filename} 不是有效的圖片格式或已損壞。\n\n"
+            return log_output, original_kb, original_kb, 0, None
+        with stage("to_pil"):
+            img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+        search_log, data, attempts, setting = ENCODE_FUNCTIONS[mode](img, target_kb, **(encode_options or {}))
+        log_output += search_log
+        if data is None:
+            log_output += get_compression_info_str(display_filename, original_kb, original_kb, target_kb)
+            return log_output, original_kb, original_kb, attempts, None
+
+        with stage("write"), open(output_path, "wb") as f:
+            f.write(data)
+        final_kb = os.path.getsize(output_path) / 1024
+        log_output += get_compression_info_str(display_filename, original_kb, final_kb, target_kb)
+        return log_output, original_kb, final_kb, attempts, setting
+
+    except Exception as e:
+        log_output += f"❌ 處理 {display_filename} 時發生錯誤：{e}\n\n"
+        original_kb = os.path.getsize(input_path) / 1024 if os.path.exists(input_path) else 0
+        return log_output, original_kb, original_kb, attempts, None
+
+
+def output_job(rel_path, output_folder, output_format, created=None):
+    """
+    依輸出格式決定 (輸出路徑, mode)；"auto" 時 PNG 輸出 PNG、其餘輸出 JPEG，並沿用原檔名。
+    rel_path 為相對於輸入資料夾的路徑，輸出沿用相同的子資料夾（見 PhotoFiles.mirror_path）。
+    """
+    if output_format == "auto":
+        mode, extension = ("png" if rel_path.lower().endswith(".png") else "jpeg"), None
+    else:
+        mode, extension = output_format, OUTPUT_EXTENSIONS[output_format]
+    return mirror_path(rel_path, output_folder, extension, created), mode
+
+
+def iter_enhance_compress(input_folder, output_folder, params, output_format="auto", target_kb=500,
+                          workers=1, timeout=None, tile_size=None, max_side=None,
+                          encode_options=None, records=None, recursive=False, shard=None):
+    """
+    批次處理資料夾：每個檔案完成時產生一段日誌字串，最後產生總結。
+    檔案邊列舉邊送出（見 PhotoFiles.iter_image_files），因此進度只顯示已完成的數量。
+    Args:
+        output_format: OUTPUT_FORMATS 之一。
+        workers / timeout: 見 PhotoCompressor.iter_batch_compression。
+        records: 傳入 list 時附加每個檔案的結果紀錄（見 PhotoCompressor.RECORD_FIELDS）。
+        recursive / shard: 見 PhotoEnhancer.process_folder。
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"未知的輸出格式：{output_format}")
+    if records is None:
+        records = []
+    if not os.path.isdir(input_folder):
+        yield f"❌ 錯誤：找不到輸入資料夾 '{input_folder}'。\n"
+        return
+    os.makedirs(output_folder, exist_ok=True)
+
+    # 每種輸出格式一個可 pickle 的處理函數，供行程池使用
+    functions = {mode: functools.partial(enhance_and_compress, mode=mode, params=tuple(params),
+                                         tile_size=tile_size, max_side=max_side,
+                                         encode_options=encode_options)
+                 for mode in ENCODE_FUNCTIONS}
+    created = set()
+    folder_errors = [] # 無法讀取的子資料夾，略過後在總結前列出
+    jobs = ((path, *output_job(rel_path, output_folder, output_format, created))
+            for path, rel_path in iter_image_files(input_folder, recursive, shard, exclude=(output_folder,),
+                                                   on_error=folder_errors.append))
+
+    yield (f"🚀 增強並壓縮：{input_folder} → {output_folder}\n"
+           f"🎯 目標檔案大小：{float(target_kb):.1f} KB（輸出格式 {output_format}）\n"
+           "------------------------------------\n\n")
+    done = 0
+    for file_log, record in iter_compress_results(jobs, float(target_kb), workers, timeout,
+                                                  functions=functions):
+        records.append(record)
+        done += 1
+        yield f"[{done}] " + file_log
+    for error in folder_errors:
+        yield f"⚠️ 無法讀取資料夾，已略過：{error.filename}（{error.strerror or error}）\n"
+    yield summarize_records(records, done)
+
+
+def run_enhance_compress(input_folder, output_folder, params, output_format="auto", target_kb=500,
+                         workers=1, timeout=None, tile_size=None, max_side=None,
+                         encode_options=None, records=None, recursive=False, shard=None):
+    """iter_enhance_compress 的一次性版本，回傳完整日誌。"""
+    return "".join(iter_enhance_compress(input_folder, output_folder, params, output_format, target_kb,
+                                         workers, timeout, tile_size, max_side, encode_options, records,
+                                         recursive, shard))
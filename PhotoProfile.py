@@ -0,0 +1,181 @@
+"""
+各處理階段的計時與記憶體配置掛鉤。
+
+程式以 `with stage("decode"):` 標出階段；沒有註冊任何掛鉤時只多一次清單檢查。
+掛鉤是任何具有 on_stage(event) 方法的物件，以 add_hook / remove_hook 註冊；event 為 dict：
+    name, start（perf_counter 秒）, seconds, alloc_bytes（未追蹤配置時為 None）, pid, tid, args
+Profiler 是內建的掛鉤：彙總每個階段的次數、耗時與配置峰值，並可匯出 Chrome trace
+（chrome://tracing 或 https://ui.perfetto.dev 開啟）。
+
+    from PhotoProfile import Profiler
+
+    with Profiler(trace_allocations=True) as profiler:
+        results = process_folder("raw", "out", *DEFAULT_PARAMS.values(), workers=4, executor="process")
+    print(profiler.summary())
+    profiler.dump_chrome_trace("trace.json")
+
+配置量以 tracemalloc 量測：numpy 陣列（含 OpenCV 的輸出）與編碼結果的 bytes 會被追蹤，
+Pillow 內部的像素緩衝區則不會。數值為整個行程的峰值，多執行緒同時處理時只是近似值；
+行程池的子行程各自量測後送回父行程。
+"""
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_hooks = [] # 只以整份替換的方式修改，stage() 讀取時不需上鎖
+_hooks_lock = threading.Lock()
+_local = threading.local()
+
+def add_hook(hook):
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + [hook]
+
+def remove_hook(hook):
+    global _hooks
+    with _hooks_lock:
+        _hooks = [h for h in _hooks if h is not hook]
+
+def hooks_active():
+    return bool(_hooks)
+
+def wants_allocations():
+    """是否有掛鉤要求配置量（決定子行程是否開啟 tracemalloc）。"""
+    return any(getattr(h, "trace_allocations", False) for h in _hooks)
+
+@contextmanager
+def stage(name, **args):
+    """標記一個處理階段；巢狀階段的配置峰值會併入外層。"""
+    hooks = _hooks
+    if not hooks:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # 每層記錄 [開始時的配置量, 內層回報的峰值]；重設峰值前先把目前峰值交給外層
+        stack = _local.__dict__.setdefault("alloc_stack", [])
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1][1] = max(stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        stack.append([current, 0])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        alloc_bytes = None
+        if tracing:
+            base, inner_peak = stack.pop()
+            peak = max(tracemalloc.get_traced_memory()[1], inner_peak)
+            alloc_bytes = max(0, peak - base)
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+        event = {"name": name, "start": start, "seconds": seconds, "alloc_bytes": alloc_bytes,
+                 "pid": os.getpid(), "tid": threading.get_ident(), "args": args}
+        for hook in hooks:
+            hook.on_stage(event)
+
+def replay(events):
+    """把其他行程收集到的事件交給目前註冊的掛鉤。"""
+    for hook in _hooks:
+        for event in events:
+            hook.on_stage(event)
+
+class _Collector:
+    def __init__(self):
+        self.events = []
+
+    def on_stage(self, event):
+        self.events.append(event)
+
+def collect_stages(trace_allocations, func, *args):
+    """
+    在行程池的子行程中執行 func(*args)，回傳 (結果, 期間的階段事件)；父行程再以 replay 轉交。
+    子行程中另行註冊的掛鉤不受影響。
+    """
+    collector = _Collector()
+    started = trace_allocations and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    add_hook(collector)
+    try:
+        return func(*args), collector.events
+    finally:
+        remove_hook(collector)
+        if started:
+            tracemalloc.stop()
+
+class Profiler:
+    """
+    彙總各階段的次數、總耗時與最大配置峰值，並保留事件供匯出 Chrome trace。
+    以 with 使用時自動註冊/取消註冊；trace_allocations=True 時在期間開啟 tracemalloc。
+    """
+
+    def __init__(self, trace_allocations=False, keep_events=True):
+        self.trace_allocations = trace_allocations
+        self.keep_events = keep_events
+        self._lock = threading.Lock()
+        self.count = {}
+        self.seconds = {}
+        self.alloc_bytes = {}
+        self.events = []
+        self.wall = 0.0
+        self._started_tracing = False
+
+    def on_stage(self, event):
+        name = event["name"]
+        with self._lock:
+            self.count[name] = self.count.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + event["seconds"]
+            if event["alloc_bytes"] is not None:
+                self.alloc_bytes[name] = max(self.alloc_bytes.get(name, 0), event["alloc_bytes"])
+            if self.keep_events:
+                self.events.append(event)
+
+    def __enter__(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._start = time.perf_counter()
+        add_hook(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_hook(self)
+        self.wall += time.perf_counter() - self._start
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def summary(self):
+        """依總耗時排序的文字摘要；巢狀階段的時間同時計入內外層。"""
+        if not self.count:
+            return "⏱️ 各階段耗時：沒有紀錄"
+        lines = [f"⏱️ 各階段耗時（總耗時 {self.wall:.2f} 秒；行程池時為各行程加總）"]
+        for name in sorted(self.seconds, key=self.seconds.get, reverse=True):
+            count, seconds = self.count[name], self.seconds[name]
+            line = f"  {name:<22}{count:>6} 次  {seconds:8.3f} 秒  平均 {seconds / count * 1000:8.1f} ms"
+            if name in self.alloc_bytes:
+                line += f"  配置峰值 {self.alloc_bytes[name] / (1024 * 1024):8.1f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Chrome trace 格式（Trace Event Format 的 complete event）。"""
+        events = []
+        for e in self.events:
+            args = dict(e["args"])
+            if e["alloc_bytes"] is not None:
+                args["alloc_mb"] = round(e["alloc_bytes"] / (1024 * 1024), 3)
+            events.append({"name": e["name"], "ph": "X", "ts": e["start"] * 1e6, "dur": e["seconds"] * 1e6,
+                           "pid": e["pid"], "tid": e["tid"], "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump_chrome_trace(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
@@ -0,0 +1,453 @@
+"""
+HTTP API：上傳圖片位元組與參數，回傳增強或壓縮後的圖片，處理核心與介面、命令列相同。
+只用標準函式庫（http.server），不會載入 gradio。
+
+    python PhotoCLI.py serve --port 8080 --workers 4
+
+    curl --data-binary @photo.jpg "http://127.0.0.1:8080/enhance?highlight_method=blend&format=webp&target_kb=300" -o out.webp
+    curl --data-binary @shot.png "http://127.0.0.1:8080/compress?format=png&target_kb=200" -o out.png
+    curl http://127.0.0.1:8080/metrics
+
+端點：
+    POST /enhance   查詢參數：DEFAULT_PARAMS 中的增強參數（未指定的用預設值）、format（jpeg / png / webp，預設 jpeg）、
+                    target_kb（指定時壓縮到目標大小，否則 JPEG/WebP 以 quality 95、PNG 無損編碼）、max_side（長邊上限）。
+    POST /compress  format（預設 jpeg）、target_kb（預設 500）。
+    GET  /metrics   各端點的延遲 p50/p99、吞吐量、佇列深度、批次大小與拒絕次數（JSON）。
+    GET  /health
+回應標頭 X-Queue-Ms / X-Process-Ms 為等待與處理時間；壓縮到目標大小時另有 X-Attempts 與 X-Quality 或 X-Scale。
+
+排程：請求先進入佇列，有閒置的行程時把目前排隊的請求切成批次送出（每批最多 max_batch 個，平均分給閒置的行程），
+一個批次只需一次行程池往返；行程都在忙時排隊的請求自然累積成較大的批次，閒置時單一請求不必等待。
+背壓：排隊與處理中的請求達到 max_queue 時，新請求在讀取內容前就回 503（附 Retry-After）；
+超過 request_timeout 仍未完成的請求回 504，還在排隊的會從佇列中移除。
+"""
+import collections
+import functools
+import io
+import json
+import math
+import signal
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from PhotoEnhancer import (DEFAULT_PARAMS, HIGHLIGHT_METHODS, _init_worker, _scaled_params,
+                           _warm_up_worker, enhance_image, make_preview_proxy)
+from PhotoCompressor import ENCODE_FUNCTIONS, WEBP_MAX_SIZE, _fit_size, auto_orient_image
+from PhotoProfile import stage
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}
+ENDPOINTS = ("/enhance", "/compress")
+MAX_BATCH = 8
+MAX_QUEUE = 64
+REQUEST_TIMEOUT = 60.0
+MAX_BODY_MB = 100
+COMPRESS_TARGET_KB = 500
+# 增強參數的允許範圍 (最小, 最大)，None 表示不限；blend_radius 另需為奇數（高斯核大小）
+PARAM_LIMITS = {
+    "exposure": (0, None),
+    "dehaze_ratio": (0, None),
+    "curve_threshold": (0, 255),
+    "curve_softness": (0, None),
+    "limited_threshold": (0, 255),
+    "limited_softness": (0, None),
+    "blend_threshold": (0, 255),
+    "blend_strength": (0, None),
+    "blend_radius": (1, 255),
+    "sat_strength": (0, None),
+}
+# /metrics 的延遲百分位取最近 LATENCY_SAMPLES 個請求，吞吐量取最近 THROUGHPUT_WINDOW 秒
+LATENCY_SAMPLES = 10000
+THROUGHPUT_WINDOW = 60.0
+
+
+class RequestError(ValueError):
+    """請求本身有誤（參數、圖片內容），回 400。"""
+
+class Overloaded(Exception):
+    """佇列已滿或服務已關閉，回 503。"""
+
+
+# ---------- 參數 ----------
+def _number(query, name, convert, default=None, minimum=None, maximum=None):
+    if name not in query:
+        return default
+    try:
+        value = convert(query[name])
+    except ValueError:
+        raise RequestError(f"{name} 不是有效的數值：{query[name]}") from None
+    if not math.isfinite(value):
+        raise RequestError(f"{name} 不是有效的數值：{query[name]}")
+    if minimum is not None and value < minimum:
+        raise RequestError(f"{name} 需不小於 {minimum}：{value}")
+    if maximum is not None and value > maximum:
+        raise RequestError(f"{name} 需不大於 {maximum}：{value}")
+    return value
+
+def parse_options(endpoint, query_string):
+    """把查詢字串轉成處理選項；參數有誤時丟出 RequestError。"""
+    query = {key: values[-1] for key, values in parse_qs(query_string, keep_blank_values=True).items()}
+    allowed = {"format", "target_kb"} | (set(DEFAULT_PARAMS) | {"max_side"} if endpoint == "/enhance" else set())
+    unknown = sorted(set(query) - allowed)
+    if unknown:
+        raise RequestError(f"未知的參數：{', '.join(unknown)}")
+    output_format = query.get("format", "jpeg")
+    if output_format not in CONTENT_TYPES:
+        raise RequestError(f"format 需為 {' / '.join(CONTENT_TYPES)}：{output_format}")
+    options = {"format": output_format, "target_kb": _number(
+        query, "target_kb", float, COMPRESS_TARGET_KB if endpoint == "/compress" else None, minimum=1)}
+    if endpoint == "/enhance":
+        params = []
+        for name, default in DEFAULT_PARAMS.items():
+            if isinstance(default, str):
+                params.append(query.get(name, default))
+            else:
+                params.append(_number(query, name, type(default), default, *PARAM_LIMITS[name]))
+        if params[9] % 2 == 0:
+            raise RequestError(f"blend_radius 需為奇數：{params[9]}")
+        if params[2] not in HIGHLIGHT_METHODS:
+            raise RequestError(f"highlight_method 需為 {' / '.join(HIGHLIGHT_METHODS)}：{params[2]}")
+        options["params"] = tuple(params)
+        options["max_side"] = _number(query, "max_side", int, minimum=1)
+    return options
+
+
+# ---------- 處理（在行程池中執行） ----------
+def _encode_plain(img, output_format):
+    ext, flags = {"jpeg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 95]), "png": (".png", []),
+                  "webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, 95])}[output_format]
+    with stage("encode", format=output_format):
+        ok, buffer = cv2.imencode(ext, img, flags)
+    if not ok:
+        raise RuntimeError(f"{output_format} 編碼失敗")
+    return buffer.tobytes(), {}
+
+def _encode_to_target(img, output_format, target_kb):
+    _, data, attempts, setting = ENCODE_FUNCTIONS[output_format](img, target_kb)
+    if data is None:
+        raise RuntimeError(f"{output_format} 編碼失敗")
+    headers = {"X-Attempts": attempts}
+    if setting is not None:
+        headers["X-Scale" if output_format == "png" else "X-Quality"] = round(setting, 4)
+    return data, headers
+
+def _enhance_bytes(data, options):
+    with stage("decode"):
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise RequestError("無法解碼圖片")
+    params = options["params"]
+    if options["max_side"]:
+        img, scale = make_preview_proxy(img, options["max_side"])
+        params = _scaled_params(params, scale)
+    img = enhance_image(img, *params, inplace=True)
+    if options["target_kb"] is None:
+        return _encode_plain(img, options["format"])
+    with stage("to_pil"):
+        img = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    return _encode_to_target(img, options["format"], options["target_kb"])
+
+def _compress_bytes(data, options):
+    try:
+        with stage("decode"):
+            img = Image.open(io.BytesIO(data))
+            if options["format"] == "webp": # 同 convert_to_webp：JPEG 直接以縮小尺寸解碼
+                img.draft(None, _fit_size(img.size, WEBP_MAX_SIZE))
+            img.load()
+    except Exception:
+        raise RequestError("無法解碼圖片") from None
+    return _encode_to_target(auto_orient_image(img), options["format"], options["target_kb"])
+
+def _handle(endpoint, options, data):
+    """回傳 (HTTP 狀態碼, 內容, 額外標頭, 處理秒數)。"""
+    start = time.perf_counter()
+    try:
+        body, headers = (_enhance_bytes if endpoint == "/enhance" else _compress_bytes)(data, options)
+        status = 200
+    except RequestError as e:
+        status, body, headers = 400, str(e).encode("utf-8"), {}
+    except Exception as e:
+        status, body, headers = 500, f"處理失敗：{e}".encode("utf-8"), {}
+    return status, body, headers, time.perf_counter() - start
+
+def _handle_batch(batch):
+    return [_handle(*item) for item in batch]
+
+
+# ---------- 排程與背壓 ----------
+class _Job:
+    __slots__ = ("endpoint", "options", "data", "received", "future")
+
+    def __init__(self, endpoint, options, data):
+        self.endpoint, self.options, self.data = endpoint, options, data
+        self.received = time.perf_counter()
+        self.future = Future()
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+class ServiceMetrics:
+    """每個端點最近 LATENCY_SAMPLES 個請求的延遲、各狀態碼次數、拒絕次數與批次大小。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))
+        self.status = collections.Counter()
+        self.rejected = 0
+        self.timeouts = 0
+        self.batches = 0
+        self.batched = 0
+        self.largest_batch = 0
+
+    def record(self, endpoint, status, latency, process_s):
+        with self._lock:
+            self.status[status] += 1
+            self.samples[endpoint].append((time.monotonic(), latency, process_s))
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def record_batch(self, size):
+        with self._lock:
+            self.batches += 1
+            self.batched += size
+            self.largest_batch = max(self.largest_batch, size)
+
+    def snapshot(self):
+        now = time.monotonic()
+        window = min(THROUGHPUT_WINDOW, max(now - self.started, 1e-9))
+        with self._lock:
+            endpoints = {}
+            for endpoint, samples in self.samples.items():
+                latencies = sorted(latency for _, latency, _ in samples)
+                processing = sorted(process_s for _, _, process_s in samples)
+                recent = sum(1 for finished, _, _ in samples if finished >= now - window)
+                endpoints[endpoint] = {
+                    "samples": len(latencies),
+                    "latency_ms": {f"p{p}": round(_percentile(latencies, p) * 1000, 1) for p in (50, 90, 99)},
+                    "process_ms": {f"p{p}": round(_percentile(processing, p) * 1000, 1) for p in (50, 99)},
+                    "throughput_rps": round(recent / window, 2),
+                }
+            return {"uptime_s": round(now - self.started, 1), "endpoints": endpoints,
+                    "status": {str(code): count for code, count in sorted(self.status.items())},
+                    "rejected": self.rejected, "timeouts": self.timeouts, "batches": self.batches,
+                    "mean_batch": round(self.batched / self.batches, 2) if self.batches else 0.0,
+                    "largest_batch": self.largest_batch}
+
+class BatchingService:
+    """
+    常駐行程池 + 請求佇列：submit 放入佇列，背景執行緒在有閒置行程時切成批次送出。
+    以 with 使用時自動 start / close。
+    """
+
+    def __init__(self, workers=1, max_batch=MAX_BATCH, max_queue=MAX_QUEUE, request_timeout=REQUEST_TIMEOUT):
+        self.workers = max(1, int(workers))
+        self.max_batch = max(1, int(max_batch))
+        self.max_queue = max(1, int(max_queue))
+        self.request_timeout = request_timeout
+        self.metrics = ServiceMetrics()
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._busy = 0 # 送出中的批次數
+        self._in_flight = 0 # 送出中的請求數
+        self._closed = True
+        self._pool = None
+        self._dispatcher = None
+
+    def start(self):
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        for future in [self._pool.submit(_warm_up_worker, 0.2) for _ in range(self.workers)]:
+            future.result()
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            while self._queue:
+                self._queue.popleft().future.set_exception(Overloaded("服務已關閉"))
+        if self._dispatcher:
+            self._dispatcher.join()
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def depth(self):
+        return len(self._queue) + self._in_flight
+
+    def admit(self):
+        """還能接受新請求時回傳 True；在讀取請求內容前先檢查，額滿時不必讀完上傳的圖片。"""
+        if self._closed or self.depth() >= self.max_queue:
+            self.metrics.record_rejected()
+            return False
+        return True
+
+    def submit(self, endpoint, options, data):
+        job = _Job(endpoint, options, data)
+        with self._cond:
+            if self._closed or self.depth() >= self.max_queue:
+                self.metrics.record_rejected()
+                raise Overloaded("佇列已滿")
+            self._queue.append(job)
+            self._cond.notify()
+        return job
+
+    def cancel(self, job):
+        """逾時的請求：還在排隊就移出佇列；已送出的無法中斷，結果直接丟棄。"""
+        with self._cond:
+            try:
+                self._queue.remove(job)
+            except ValueError:
+                pass
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queue or self._busy >= self.workers):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # 排隊的請求平均分給閒置的行程，避免一批塞滿而其他行程閒著
+                size = min(self.max_batch, math.ceil(len(self._queue) / (self.workers - self._busy)))
+                batch = [self._queue.popleft() for _ in range(size)]
+                self._busy += 1
+                self._in_flight += size
+            self.metrics.record_batch(size)
+            future = self._pool.submit(_handle_batch, [(j.endpoint, j.options, j.data) for j in batch])
+            future.add_done_callback(functools.partial(self._finish, batch))
+
+    def _finish(self, batch, future):
+        try:
+            results = future.result()
+        except Exception as e: # 例如子行程異常結束
+            results = [(500, f"處理失敗：{e}".encode("utf-8"), {}, 0.0)] * len(batch)
+        with self._cond:
+            self._busy -= 1
+            self._in_flight -= len(batch)
+            self._cond.notify()
+        for job, result in zip(batch, results):
+            job.future.set_result(result)
+
+
+# ---------- HTTP ----------
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "PhotoEnhancer"
+    service = None
+    max_body = MAX_BODY_MB * 1024 * 1024
+    quiet = True
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="text/plain; charset=utf-8", headers=None, close=False):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        if close:
+            # 沒有讀取請求內容就回應時必須關閉連線，否則殘留的內容會被當成下一個請求
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._send(200, b"ok")
+        elif path == "/metrics":
+            metrics = self.service.metrics.snapshot()
+            metrics.update(queue_depth=self.service.depth(), max_queue=self.service.max_queue,
+                           workers=self.service.workers, max_batch=self.service.max_batch)
+            self._send(200, json.dumps(metrics, ensure_ascii=False, indent=1).encode("utf-8"),
+                       "application/json")
+        else:
+            self._send(404, "找不到此端點".encode("utf-8"))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path not in ENDPOINTS:
+            return self._send(404, "找不到此端點".encode("utf-8"), close=True)
+        try:
+            options = parse_options(url.path, url.query)
+        except RequestError as e:
+            return self._send(400, str(e).encode("utf-8"), close=True)
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            return self._send(411, "需要 Content-Length".encode("utf-8"), close=True)
+        if int(length) > self.max_body:
+            return self._send(413, f"圖片超過 {self.max_body // (1024 * 1024)} MB".encode("utf-8"), close=True)
+        if not self.service.admit():
+            return self._send(503, "忙碌中，請稍後再試".encode("utf-8"), headers={"Retry-After": 1}, close=True)
+
+        data = self.rfile.read(int(length))
+        try:
+            job = self.service.submit(url.path, options, data)
+            status, body, headers, process_s = job.future.result(timeout=self.service.request_timeout)
+        except Overloaded as e:
+            return self._send(503, str(e).encode("utf-8"), headers={"Retry-After": 1})
+        except TimeoutError:
+            self.service.cancel(job)
+            self.service.metrics.record_timeout()
+            return self._send(504, f"超過 {self.service.request_timeout:g} 秒仍未完成".encode("utf-8"))
+        latency = time.perf_counter() - job.received
+        self.service.metrics.record(url.path, status, latency, process_s)
+        headers = dict(headers, **{"X-Process-Ms": round(process_s * 1000, 1),
+                                   "X-Queue-Ms": round(max(latency - process_s, 0.0) * 1000, 1)})
+        content_type = CONTENT_TYPES[options["format"]] if status == 200 else "text/plain; charset=utf-8"
+        self._send(status, body, content_type, headers)
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 128 # listen backlog；預設 5 在大量同時連線時會直接拒絕連線
+
+def make_server(service, host="127.0.0.1", port=8080, quiet=True):
+    """建立 HTTP 伺服器（每個連線一條執行緒；實際處理量由 service 的佇列上限控制）。"""
+    handler = type("Handler", (_Handler,), {"service": service, "quiet": quiet})
+    return _Server((host, port), handler)
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def serve(host="127.0.0.1", port=8080, workers=1, max_batch=MAX_BATCH, max_queue=MAX_QUEUE,
+          request_timeout=REQUEST_TIMEOUT, quiet=True):
+    """啟動服務直到 KeyboardInterrupt，回傳最後的 metrics。"""
+    with BatchingService(workers, max_batch, max_queue, request_timeout) as service:
+        server = make_server(service, host, port, quiet)
+        print(f"🌐 http://{host}:{server.server_address[1]}  （{service.workers} 個行程，"
+              f"每批最多 {service.max_batch} 個，佇列上限 {service.max_queue}）", flush=True)
+        if threading.current_thread() is threading.main_thread():
+            # systemd / docker stop 送的 SIGTERM 與 Ctrl-C 相同處理，讓行程池正常關閉
+            signal.signal(signal.SIGTERM, _raise_interrupt)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return service.metrics.snapshot()
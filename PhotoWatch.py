@@ -0,0 +1,284 @@
+"""
+熱資料夾模式：持續監看輸入資料夾，新增或修改的圖片一寫入完成就增強（可選擇同時壓縮到目標大小），
+不必每次重跑整個資料夾。
+
+    from PhotoEnhancer import DEFAULT_PARAMS
+    from PhotoWatch import watch_folder
+
+    for record in watch_folder("dropbox", "enhanced", DEFAULT_PARAMS.values(), workers=4):
+        print(format_watch_record(record))
+
+偵測：Linux 以 inotify（ctypes 直接呼叫 libc，不需額外套件）等待事件，其他平台或 backend="poll"
+時以 os.scandir 定時比對 (大小, 修改時間)。inotify 看不到其他主機在網路磁碟上的寫入，
+監看 SMB/NFS 掛載點時請用 poll；兩者都會每 RESCAN_INTERVAL 秒全面比對一次，補上遺漏的事件。
+防抖：檔案的 (大小, 修改時間) 連續 settle 秒沒有變化才視為寫入完成。
+處理：啟動時先建立並預熱行程池，每個檔案完成時產生一筆紀錄，含從偵測到輸出的延遲。
+"""
+import ctypes
+import ctypes.util
+import functools
+import os
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PhotoEnhancer import _enhance_file, _init_worker, _warm_up_worker
+from PhotoCompressor import _compress_file
+from PhotoFiles import is_image_name
+from PhotoPipeline import OUTPUT_FORMATS, enhance_and_compress, output_job
+
+# 大小與修改時間維持不變多久才視為寫入完成（秒）
+SETTLE_SECONDS = 0.5
+# poll 模式的掃描間隔，以及兩種模式的全面比對間隔（秒）
+POLL_INTERVAL = 1.0
+RESCAN_INTERVAL = 60.0
+# 有檔案等待寫入完成或處理中時，主迴圈最長的等待時間（秒）
+TICK_SECONDS = 0.05
+
+
+# ---------- 偵測 ----------
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _scan(folder):
+    """{檔名: (大小, 修改時間)}，只含圖片。"""
+    snapshot = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if is_image_name(entry.name) and entry.is_file():
+                st = entry.stat()
+                snapshot[entry.name] = (st.st_size, st.st_mtime_ns)
+    return snapshot
+
+# inotify 事件旗標（<sys/inotify.h>）
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+class _InotifyWatcher:
+    """wait(timeout) 回傳 (有事件的檔名集合, 是否需要全面比對)。"""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失敗")
+        mask = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(folder), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"無法監看 {folder}")
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set(), False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set(), False
+        names, overflow, offset = set(), False, 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            start = offset + _EVENT_HEADER.size
+            name = data[start:start + length].rstrip(b"\0")
+            offset = start + length
+            overflow |= bool(mask & _IN_Q_OVERFLOW)
+            if name:
+                names.add(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        os.close(self._fd)
+
+class _PollingWatcher:
+    """每 interval 秒掃描一次，回傳 (大小, 修改時間) 有變化的檔名。"""
+
+    def __init__(self, folder, interval=POLL_INTERVAL):
+        self.folder = folder
+        self.interval = interval
+        self._snapshot = _scan(folder)
+        self._next_scan = time.monotonic() + interval
+
+    def wait(self, timeout):
+        delay = self._next_scan - time.monotonic()
+        if timeout is not None and timeout < delay:
+            time.sleep(max(timeout, 0))
+            return set(), False
+        time.sleep(max(delay, 0))
+        self._next_scan = time.monotonic() + self.interval
+        snapshot = _scan(self.folder)
+        changed = {name for name, sig in snapshot.items() if self._snapshot.get(name) != sig}
+        self._snapshot = snapshot
+        return changed, False
+
+    def close(self):
+        pass
+
+def _make_watcher(folder, backend, poll_interval):
+    if backend not in ("auto", "inotify", "poll"):
+        raise ValueError(f"未知的 backend：{backend}")
+    if backend != "poll" and sys.platform.startswith("linux"):
+        try:
+            return _InotifyWatcher(folder), "inotify"
+        except (OSError, AttributeError):
+            if backend == "inotify":
+                raise
+    elif backend == "inotify":
+        raise OSError("此平台不支援 inotify")
+    return _PollingWatcher(folder, poll_interval), "poll"
+
+
+# ---------- 處理（在行程池中執行） ----------
+def _process_file(path, out_path, mode, params, target_kb, tile_size, max_side, encode_options):
+    """回傳 (ok, message, 開始時間, 結束時間)，時間為 time.time()，可跨行程比較。"""
+    start = time.time()
+    if mode is None:
+        _, ok, message = _enhance_file(path, out_path, params, tile_size, max_side)
+        return ok, message, start, time.time()
+    function = functools.partial(enhance_and_compress, mode=mode, params=params, tile_size=tile_size,
+                                 max_side=max_side, encode_options=encode_options)
+    _, record = _compress_file(path, out_path, mode, target_kb, functions={mode: function})
+    message = record["message"] or f"{record['original_kb']:.1f} KB → {record['compressed_kb']:.1f} KB"
+    return record["status"] == "ok", message, start, time.time()
+
+
+# ---------- 主迴圈 ----------
+def _output_for(path, output_folder, output_format):
+    if output_format is None:
+        return os.path.join(output_folder, os.path.basename(path)), None
+    return output_job(os.path.basename(path), output_folder, output_format)
+
+def _needs_output(path, out_path):
+    # 啟動時沿用已有的輸出：輸出存在且不比輸入舊就略過
+    try:
+        return os.path.getmtime(out_path) < os.path.getmtime(path)
+    except OSError:
+        return True
+
+def watch_folder(input_folder, output_folder, params, workers=1, output_format=None, target_kb=500,
+                 tile_size=None, max_side=None, encode_options=None, settle=SETTLE_SECONDS,
+                 poll_interval=POLL_INTERVAL, backend="auto", process_existing=True, stop_event=None):
+    """
+    監看 input_folder，逐一產生每個處理完成的檔案紀錄（dict），直到 stop_event 被設定或 KeyboardInterrupt。
+    Args:
+        params: 增強參數，順序同 PhotoEnhancer.DEFAULT_PARAMS。
+        output_format: None 只做增強（沿用原檔名與格式）；OUTPUT_FORMATS 之一時增強後直接在記憶體中
+            壓縮到 target_kb（見 PhotoPipeline.enhance_and_compress）。
+        settle: 大小與修改時間維持不變多久才開始處理（秒）。
+        backend: "auto"（Linux 用 inotify，其他用 poll）、"inotify" 或 "poll"。
+        process_existing: 啟動時處理資料夾中還沒有（或比輸入舊）輸出的圖片。
+    紀錄欄位：file, input_path, output_path, status ("ok"/"failed"), message,
+        latency_s（偵測到 → 輸出完成）, settle_s（等待寫入完成）, queue_s（等待行程）, process_s。
+    """
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"未知的輸出格式：{output_format}")
+    if os.path.abspath(input_folder) == os.path.abspath(output_folder):
+        raise ValueError("輸出資料夾不能與輸入資料夾相同")
+    os.makedirs(output_folder, exist_ok=True)
+    params = tuple(params)
+    workers = max(1, int(workers))
+
+    watcher, backend = _make_watcher(input_folder, backend, poll_interval)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    pending = {} # 檔名 -> [簽章, 最後變動的 monotonic 時間, 偵測到的 time.time()]
+    running = {} # future -> (檔名, 簽章, 偵測時間, 送出時間)
+    done = {} # 檔名 -> 已處理的簽章
+    try:
+        for future in [pool.submit(_warm_up_worker, 0.2) for _ in range(workers)]:
+            future.result()
+
+        def observe(name, now, wall):
+            sig = _signature(os.path.join(input_folder, name))
+            if sig is None or done.get(name) == sig:
+                pending.pop(name, None)
+                return
+            entry = pending.get(name)
+            if entry is None:
+                pending[name] = [sig, now, wall]
+            elif entry[0] != sig:
+                entry[0], entry[1] = sig, now
+
+        now, wall = time.monotonic(), time.time()
+        for name, sig in _scan(input_folder).items():
+            path = os.path.join(input_folder, name)
+            if process_existing and _needs_output(path, _output_for(path, output_folder, output_format)[0]):
+                # 修改時間已超過 settle 的檔案視為已寫完，不必再等
+                settled = wall - sig[1] / 1e9 >= settle
+                pending[name] = [sig, now - settle if settled else now, wall]
+            else:
+                done[name] = sig
+        next_rescan = now + RESCAN_INTERVAL
+
+        while not (stop_event and stop_event.is_set()):
+            timeout = TICK_SECONDS if pending or running else 0.5
+            names, rescan = watcher.wait(timeout)
+            now, wall = time.monotonic(), time.time()
+            if rescan or now >= next_rescan:
+                names |= set(_scan(input_folder))
+                next_rescan = now + RESCAN_INTERVAL
+            for name in names:
+                if is_image_name(name):
+                    observe(name, now, wall)
+
+            busy = {item[0] for item in running.values()}
+            for name, (sig, changed_at, detected) in list(pending.items()):
+                if now - changed_at < settle or name in busy:
+                    continue
+                path = os.path.join(input_folder, name)
+                current = _signature(path)
+                if current != sig:
+                    observe(name, now, wall)
+                    continue
+                if sig[0] == 0:
+                    continue # 空檔：可能還沒開始寫入
+                del pending[name]
+                out_path, mode = _output_for(path, output_folder, output_format)
+                future = pool.submit(_process_file, path, out_path, mode, params, target_kb,
+                                     tile_size, max_side, encode_options)
+                running[future] = (name, sig, detected, wall, out_path)
+
+            finished = [f for f in running if f.done()]
+            for future in finished:
+                name, sig, detected, dispatched, out_path = running.pop(future)
+                try:
+                    ok, message, start, end = future.result()
+                except Exception as e: # 例如子行程異常結束
+                    ok, message, start, end = False, str(e), dispatched, time.time()
+                done[name] = sig
+                yield {"file": name, "input_path": os.path.join(input_folder, name), "output_path": out_path,
+                       "status": "ok" if ok else "failed", "message": message,
+                       "latency_s": round(end - detected, 3), "settle_s": round(dispatched - detected, 3),
+                       "queue_s": round(max(start - dispatched, 0.0), 3), "process_s": round(end - start, 3)}
+    finally:
+        watcher.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def format_watch_record(record):
+    icon = "✅" if record["status"] == "ok" else "❌"
+    return (f"{icon} {record['file']}  延遲 {record['latency_s']:.2f} 秒（等待寫入完成 {record['settle_s']:.2f}、"
+            f"排隊 {record['queue_s']:.2f}、處理 {record['process_s']:.2f}）  {record['message']}")
+
+def summarize_watch(records):
+    if not records:
+        return "👀 監看結束，沒有處理任何檔案。"
+    latencies = sorted(r["latency_s"] for r in records)
+    failed = sum(1 for r in records if r["status"] != "ok")
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+
+    return (f"👀 監看結束：處理 {len(records)} 個檔案（失敗 {failed} 個）\n"
+            f"  延遲 p50 {percentile(50):.2f} 秒  p95 {percentile(95):.2f} 秒  最大 {latencies[-1]:.2f} 秒")
@@ -0,0 +1,128 @@
+"""
+縮小解碼的基準測試：比較完整解碼後再縮圖，與 JPEG 在 DCT 階段直接縮小解碼的時間與記憶體。
+
+    python bench_decode.py                    # 產生 6000x4000 的測試 JPEG
+    python bench_decode.py photo.jpg --max-side 1024
+
+每個情境在獨立的子行程中執行，峰值記憶體為解碼前後常駐記憶體峰值的差（Linux / macOS）。
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+REPEAT = 3
+
+
+def _peak_rss_mb():
+    # Linux 的 ru_maxrss 會沿用 exec 前父行程的峰值，優先讀本行程自己的 VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位為 KB，macOS 為 bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _make_test_jpeg(path, width=6000, height=4000):
+    """平滑漸層加上紋理與雜訊，讓 JPEG 大小接近一般照片。"""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 200, y / height * 200, (x + y) / (width + height) * 255], axis=-1)
+    texture = 30 * np.sin(x / 7)[..., None] * np.cos(y / 11)[..., None]
+    img = base + texture + rng.normal(0, 6, base.shape)
+    cv2.imwrite(path, np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def _run_case(case, path, max_side):
+    """在子行程中執行單一情境，回傳 (輸出圖片, 秒數)。"""
+    from PIL import Image
+    from PhotoCompressor import WEBP_MAX_SIZE, _fit_size
+    from PhotoEnhancer import read_image
+
+    start = time.perf_counter()
+    if case == "webp_full":
+        with Image.open(path) as img:
+            img.thumbnail(WEBP_MAX_SIZE, Image.LANCZOS)
+            out = np.asarray(img)
+    elif case == "webp_draft":
+        with Image.open(path) as img:
+            img.draft(None, _fit_size(img.size, WEBP_MAX_SIZE))
+            img.thumbnail(WEBP_MAX_SIZE, Image.LANCZOS)
+            out = np.asarray(img)
+    elif case == "enhance_full":
+        img = cv2.imread(path)
+        scale = max_side / max(img.shape[:2])
+        out = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    elif case == "enhance_reduced":
+        out, _ = read_image(path, max_side)
+    else:
+        raise ValueError(case)
+    return out, time.perf_counter() - start
+
+
+def _child(case, path, max_side, out_path):
+    before = _peak_rss_mb()
+    out, seconds = _run_case(case, path, max_side)
+    peak = _peak_rss_mb() - before
+    np.save(out_path, out)
+    print(json.dumps({"seconds": seconds, "peak_mb": peak, "shape": list(out.shape)}))
+
+
+def _psnr(a, b):
+    if a.shape != b.shape:
+        return float("nan")
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("image", nargs="?", help="測試用 JPEG；省略時產生 6000x4000 的合成圖")
+    parser.add_argument("--max-side", type=int, default=1500, help="enhance 情境的輸出長邊")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return _child(args.child[0], args.image, args.max_side, args.child[1])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.image
+        if not path:
+            path = os.path.join(tmp, "bench.jpg")
+            _make_test_jpeg(path)
+        print(f"{path}  max_side={args.max_side}  webp_box=2048x2048")
+        pairs = (("webp_full", "webp_draft"), ("enhance_full", "enhance_reduced"))
+        for before_case, after_case in pairs:
+            outputs = {}
+            for case in (before_case, after_case):
+                runs = []
+                out_path = os.path.join(tmp, case + ".npy")
+                for _ in range(REPEAT):
+                    result = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), path, "--max-side", str(args.max_side),
+                         "--child", case, out_path],
+                        check=True, capture_output=True, text=True,
+                        cwd=os.path.dirname(os.path.abspath(__file__)))
+                    runs.append(json.loads(result.stdout))
+                outputs[case] = np.load(out_path)
+                best = min(runs, key=lambda r: r["seconds"])
+                print(f"  {case:<16} {best['seconds'] * 1000:8.1f} ms  峰值 +{best['peak_mb']:7.1f} MB  "
+                      f"輸出 {best['shape'][1]}x{best['shape'][0]}")
+            print(f"  {'PSNR':<16} {_psnr(outputs[before_case], outputs[after_case]):8.2f} dB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
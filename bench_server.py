@@ -0,0 +1,149 @@
+"""
+HTTP API 負載測試：多條連線同時送出同一張合成圖片，量測用戶端看到的延遲百分位、吞吐量與 503/504 比例，
+最後附上伺服器 /metrics 的統計。
+
+    python bench_server.py                                    # 在子行程啟動本機伺服器並測試
+    python bench_server.py --concurrency 32 --max-batch 1     # 比較停用批次
+    python bench_server.py --url http://10.0.0.5:8080 --endpoint compress --query "format=webp&target_kb=100"
+
+未指定 --url 時以 PhotoCLI.py serve 啟動伺服器（--workers / --max-batch / --max-queue 傳給它），測完即關閉。
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import cv2
+
+from bench_suite import _dimensions, _photo_image
+
+CONCURRENCY = 8
+DURATION = 10.0
+MEGAPIXELS = 0.5
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, max(0, -(-p * len(sorted_values) // 100) - 1))]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(args):
+    port = _free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "PhotoCLI.py"),
+               "serve", "--port", str(port), "--workers", str(args.workers),
+               "--max-batch", str(args.max_batch), "--max-queue", str(args.max_queue)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    print(process.stdout.readline().strip(), flush=True) # 行程池預熱完成後才會印出網址
+    return process, f"http://127.0.0.1:{port}"
+
+
+def _client(url, path, body, deadline, results):
+    parts = urlsplit(url)
+    connection = None
+    while time.perf_counter() < deadline:
+        if connection is None:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=120)
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body, {"Content-Type": "application/octet-stream"})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader("Connection", "").lower() == "close":
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            status = "error"
+            connection.close()
+            connection = None
+        results.append((status, time.perf_counter() - start))
+        if status == 503:
+            time.sleep(0.05) # 模擬用戶端退避，避免空轉
+    if connection is not None:
+        connection.close()
+
+
+def run_load(url, endpoint, query, body, concurrency, duration):
+    path = f"/{endpoint}" + (f"?{query}" if query else "")
+    results = []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_client, args=(url, path, body, deadline, results))
+               for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - start
+
+
+def _fetch_metrics(url):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=10)
+    connection.request("GET", "/metrics")
+    return json.loads(connection.getresponse().read())
+
+
+def _report(results, wall):
+    ok = sorted(latency for status, latency in results if status == 200)
+    counts = {}
+    for status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    lines = [f"請求 {len(results)} 個，{wall:.1f} 秒：" + "  ".join(f"{k}×{v}" for k, v in sorted(counts.items(), key=str)),
+             f"成功吞吐量 {len(ok) / wall:.2f} req/s"]
+    if ok:
+        lines.append("成功延遲 " + "  ".join(f"p{p} {_percentile(ok, p) * 1000:.0f} ms" for p in (50, 90, 99))
+                     + f"  最大 {ok[-1] * 1000:.0f} ms")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PhotoServer 負載測試")
+    parser.add_argument("--url", help="已啟動的伺服器；未指定時在子行程啟動本機伺服器")
+    parser.add_argument("--endpoint", choices=("enhance", "compress"), default="enhance")
+    parser.add_argument("--query", default="", help="查詢參數，例如 highlight_method=blend&format=webp")
+    parser.add_argument("--megapixels", type=float, default=MEGAPIXELS, help="合成測試圖片的大小")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="同時連線數")
+    parser.add_argument("--duration", type=float, default=DURATION, help="測試秒數")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    width, height = _dimensions(args.megapixels)
+    body = cv2.imencode(".jpg", _photo_image(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+    print(f"測試圖片 {width}x{height}（{len(body) / 1024:.0f} KB），{args.concurrency} 條連線，"
+          f"{args.duration:g} 秒，POST /{args.endpoint}?{args.query}", flush=True)
+
+    process, url = (None, args.url) if args.url else _start_server(args)
+    try:
+        results, wall = run_load(url, args.endpoint, args.query, body, args.concurrency, args.duration)
+        print(_report(results, wall))
+        metrics = _fetch_metrics(url)
+        endpoint = metrics["endpoints"].get(f"/{args.endpoint}", {})
+        print(f"伺服器：延遲 {endpoint.get('latency_ms')}  處理 {endpoint.get('process_ms')}  "
+              f"平均批次 {metrics['mean_batch']}（最大 {metrics['largest_batch']}）  拒絕 {metrics['rejected']}")
+    finally:
+        if process is not None:
+            # 以 Ctrl-C 結束，讓伺服器關閉行程池
+            process.send_signal(signal.SIGINT if os.name == "posix" else signal.SIGTERM)
+            process.wait()
+    return 1 if not any(status == 200 for status, _ in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,377 @@
+"""
+效能基準測試：以固定亂數種子產生的合成圖片，量測每個增強與壓縮步驟的速度、記憶體與編碼次數，
+並和儲存的基準比較，變慢時以非零結束碼失敗。
+
+    python bench_suite.py --save-baseline bench_baseline.json       # 建立基準
+    python bench_suite.py --baseline bench_baseline.json            # 比較，退步時回傳 1
+    python bench_suite.py --sizes 2,12 --stages compress_png,convert_to_webp --repeat 1
+
+測試圖片：2 / 12 / 24 / 50 MP（3:2），內容為照片（漸層、紋理、雜訊與亮部）或平面（螢幕截圖風格的色塊與細線），
+各有含 / 不含 alpha 兩種。增強步驟只跑不含 alpha 的圖片；另外量測 blend_fast 在各模糊半徑下相對 blend 的 PSNR。
+*_float 為查表 (LUT) 之前的浮點運算版本，與同名的 LUT 步驟比較速度，並記錄兩者輸出的最大差異。
+每個情境在獨立的子行程中執行，峰值記憶體為步驟執行期間常駐記憶體峰值減去開始前的常駐記憶體。
+完整的 enhance_image（就地處理）另有記憶體預算 MEMORY_BUDGET，超過時不論有無基準都會失敗。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from bench_decode import _peak_rss_mb, _psnr
+
+SIZES_MP = (2, 12, 24, 50)
+CONTENTS = ("photo", "flat")
+ENHANCE_STAGES = ("bright_dehaze", "highlights_curve", "highlights_limited",
+                  "bright_dehaze_float", "highlights_curve_float", "highlights_limited_float",
+                  "highlights_blend", "highlights_blend_fast", "saturation",
+                  "enhance_curve", "enhance_limited", "enhance_blend", "enhance_blend_fast")
+# enhance_image(inplace=True) 的峰值記憶體預算：每個輸入像素的位元組數（另加 PEAK_SLACK_MB）。
+# HSV 暫存 3 B/px；blend 另有浮點遮罩 4 B/px 與模糊圖 3 B/px
+MEMORY_BUDGET = {"enhance_curve": 4, "enhance_limited": 4, "enhance_blend": 12, "enhance_blend_fast": 12}
+COMPRESS_STAGES = ("compress_jpeg", "compress_png", "convert_to_webp")
+PSNR_STAGE = "blend_fast_psnr"
+PSNR_RADII = (11, 41, 101, 201)
+# 壓縮目標：每百萬輸出像素的 KB 數
+TARGET_KB_PER_MP = 50
+REPEAT = 3
+DEFAULT_BASELINE = "bench_baseline.json"
+# 基準比較：速度與記憶體的容許比例、記憶體的固定容許量、PSNR 容許下降量
+TOLERANCE = 0.3
+PEAK_SLACK_MB = 16
+PSNR_SLACK_DB = 0.5
+
+
+# ---------- 合成測試圖片 ----------
+def _dimensions(megapixels):
+    width = int(round((megapixels * 1e6 * 1.5) ** 0.5 / 2)) * 2
+    return width, int(round(width / 1.5 / 2)) * 2
+
+
+def _photo_image(width, height, seed=0):
+    """平滑漸層 + 紋理 + 雜訊，上方有一片超過亮部門檻的天空與太陽；分段產生以控制記憶體。"""
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), np.uint8)
+    x = np.arange(width, dtype=np.float32)
+    sun_x, sun_y, sun_r = width * 0.7, height * 0.15, min(width, height) * 0.08
+    for y0 in range(0, height, 256):
+        y = np.arange(y0, min(y0 + 256, height), dtype=np.float32)[:, None]
+        sky = np.clip(1.0 - y / (height * 0.35), 0, 1)
+        base = np.stack([x / width * 160 + 40 + 0 * y, y / height * 160 + 30 + 0 * x,
+                         (x + y) / (width + height) * 200 + 30], axis=-1)
+        base = base * (1 - sky[..., None]) + 235 * sky[..., None]
+        texture = 25 * (np.sin(x / 7) * np.cos(y / 11))[..., None]
+        sun = ((x - sun_x) ** 2 + (y - sun_y) ** 2) < sun_r ** 2
+        band = base + texture + rng.normal(0, 6, base.shape).astype(np.float32)
+        band[sun] = 255
+        img[y0:y0 + band.shape[0]] = np.clip(band, 0, 255).astype(np.uint8)
+    return img
+
+
+def _flat_image(width, height, seed=0):
+    """螢幕截圖風格：少數純色的色塊、視窗框與大量細線（模擬文字）。"""
+    rng = np.random.default_rng(seed)
+    img = np.full((height, width, 3), 245, np.uint8)
+    palette = rng.integers(0, 256, (12, 3)).tolist()
+    unit = max(1, width // 400)
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        x1, y1 = x0 + int(rng.integers(width // 20, width // 3)), y0 + int(rng.integers(height // 20, height // 3))
+        color = palette[int(rng.integers(len(palette)))]
+        cv2.rectangle(img, (x0, y0), (x1, y1), color, -1)
+        cv2.rectangle(img, (x0, y0), (x1, y1), (60, 60, 60), unit)
+    for y in range(0, height, 6 * unit):
+        x0 = int(rng.integers(0, width // 2))
+        x1 = x0 + int(rng.integers(width // 10, width // 2))
+        cv2.line(img, (x0, y), (x1, y), (30, 30, 30), unit)
+    return img
+
+
+def _alpha_channel(width, height):
+    """中心不透明、往四角漸淡，角落完全透明。"""
+    x = np.linspace(-1, 1, width, dtype=np.float32)
+    y = np.linspace(-1, 1, height, dtype=np.float32)[:, None]
+    return np.clip((1.4 - np.sqrt(x ** 2 + y ** 2)) * 255, 0, 255).astype(np.uint8)
+
+
+def _image_path(work_dir, content, megapixels, alpha):
+    # 照片存 JPEG（壓縮時的常見輸入），平面與含 alpha 的圖片存 PNG
+    ext = ".jpg" if content == "photo" and not alpha else ".png"
+    return os.path.join(work_dir, f"{content}{'_alpha' if alpha else ''}_{megapixels}mp{ext}")
+
+
+def make_test_image(work_dir, content, megapixels, alpha=False):
+    """產生（或沿用已產生的）測試圖片，回傳路徑。同樣的參數永遠得到同樣的像素。"""
+    path = _image_path(work_dir, content, megapixels, alpha)
+    if os.path.exists(path):
+        return path
+    width, height = _dimensions(megapixels)
+    img = (_photo_image if content == "photo" else _flat_image)(width, height)
+    if alpha:
+        img = np.dstack([img, _alpha_channel(width, height)])
+    params = [cv2.IMWRITE_JPEG_QUALITY, 92] if path.endswith(".jpg") else [cv2.IMWRITE_PNG_COMPRESSION, 1]
+    cv2.imwrite(path, img, params)
+    return path
+
+
+# ---------- 查表之前的浮點運算版本（對照組）----------
+def reference_tone(img, exposure, dehaze_ratio):
+    img_float = img.astype(np.float32) / 255.0
+    img_bright = np.clip(img_float * exposure, 0, 1)
+    contrast_strength = 1 + exposure * dehaze_ratio
+    return cv2.convertScaleAbs(img_bright * 255, alpha=contrast_strength, beta=0)
+
+
+def reference_highlights(img, threshold, softness, limited):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
+    h, s, v = cv2.split(hsv)
+    v_norm = v / 255.0
+    t_norm = threshold / 255.0
+    if limited:
+        mask = v_norm > t_norm
+        v_norm[mask] = v_norm[mask] / (1 + softness * ((v_norm[mask] - t_norm) ** 2))
+    else:
+        v_norm = v_norm / (1 + softness * ((v_norm - t_norm) ** 2))
+    v_new = np.clip(v_norm * 255.0, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(cv2.merge([h.astype(np.uint8), s.astype(np.uint8), v_new]), cv2.COLOR_HSV2BGR)
+
+
+# ---------- 子行程：執行單一情境 ----------
+def _reset_peak_rss():
+    """Linux 寫入 5 到 clear_refs 會重設 VmHWM；不支援時峰值會包含之前的用量。"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _current_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _peak_rss_mb()
+
+
+def _enhance_stage(stage):
+    import PhotoEnhancer as pe
+    if stage.startswith("enhance_"):
+        params = dict(pe.DEFAULT_PARAMS, highlight_method=stage[len("enhance_"):],
+                      curve_threshold=210, limited_threshold=210, blend_threshold=210)
+        return lambda img: pe.enhance_image(img, *params.values(), inplace=True)
+    return {
+        "bright_dehaze": lambda img: pe.apply_fixed_bright_and_dehaze(img, 1.10, 0.66),
+        "highlights_curve": lambda img: pe.suppress_highlights_curve(img, 210, 0.15),
+        "highlights_limited": lambda img: pe.suppress_highlights_limited(img, 210, 0.15),
+        "highlights_blend": lambda img: pe.suppress_highlights_blend(img, 210, 0.4, 41),
+        "highlights_blend_fast": lambda img: pe.suppress_highlights_blend_fast(img, 210, 0.4, 41),
+        "saturation": lambda img: pe.enhance_saturation_natural(img, 0.25),
+        "bright_dehaze_float": lambda img: reference_tone(img, 1.10, 0.66),
+        "highlights_curve_float": lambda img: reference_highlights(img, 210, 0.15, False),
+        "highlights_limited_float": lambda img: reference_highlights(img, 210, 0.15, True),
+    }[stage]
+
+
+def _target_kb(stage, width, height):
+    from PhotoCompressor import WEBP_MAX_SIZE, _fit_size
+    if stage == "convert_to_webp":
+        width, height = _fit_size((width, height), WEBP_MAX_SIZE)
+    return max(10, round(TARGET_KB_PER_MP * width * height / 1e6))
+
+
+def _measure(func, repeat, setup=None):
+    """
+    執行 repeat 次，回傳 (最後一次的結果, 最短秒數, 最大峰值增量 MB)。
+    setup 的回傳值作為 func 的參數，不計入時間與記憶體（例如就地處理前先複製輸入）。
+    """
+    best, peak, result = float("inf"), 0.0, None
+    for _ in range(repeat):
+        result = None
+        args = (setup(),) if setup else ()
+        before = _current_rss_mb()
+        _reset_peak_rss()
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, _peak_rss_mb() - before)
+    return result, best, peak
+
+
+def _child(stage, path, repeat):
+    from PIL import Image
+    with Image.open(path) as img:
+        width, height = img.size
+    out = {"megapixels": width * height / 1e6}
+    if stage in COMPRESS_STAGES:
+        import PhotoCompressor as pc
+        func = getattr(pc, stage)
+        target_kb = _target_kb(stage, width, height)
+        with tempfile.TemporaryDirectory() as tmp:
+            ext = {"compress_jpeg": ".jpg", "compress_png": ".png", "convert_to_webp": ".webp"}[stage]
+            result, seconds, peak = _measure(lambda: func(path, os.path.join(tmp, "out" + ext), target_kb), repeat)
+        _, _, compressed_kb, attempts, _ = result
+        out.update(seconds=seconds, peak_mb=peak, attempts=attempts,
+                   target_kb=target_kb, output_kb=round(compressed_kb, 1))
+    elif stage == PSNR_STAGE:
+        import PhotoEnhancer as pe
+        img = cv2.imread(path)
+        out["psnr"] = {str(r): round(_psnr(pe.suppress_highlights_blend(img, 210, 0.4, r),
+                                           pe.suppress_highlights_blend_fast(img, 210, 0.4, r)), 2)
+                       for r in PSNR_RADII}
+    else:
+        img = cv2.imread(path)
+        func = _enhance_stage(stage)
+        if stage in MEMORY_BUDGET:
+            _, seconds, peak = _measure(func, repeat, setup=img.copy)
+            out["budget_mb"] = MEMORY_BUDGET[stage] * width * height / (1024 * 1024) + PEAK_SLACK_MB
+        else:
+            result, seconds, peak = _measure(lambda: func(img), repeat)
+            if stage.endswith("_float"):
+                lut_result = _enhance_stage(stage[:-len("_float")])(img)
+                out["max_diff"] = int(cv2.absdiff(result, lut_result).max())
+        out.update(seconds=seconds, peak_mb=peak)
+    print(json.dumps(out))
+
+
+# ---------- 主行程 ----------
+def _cases(sizes, stages):
+    for megapixels in sizes:
+        for content in CONTENTS:
+            for alpha in (False, True):
+                for stage in stages:
+                    if stage in COMPRESS_STAGES or not alpha and (stage != PSNR_STAGE or content == "photo"):
+                        yield stage, content, megapixels, alpha
+
+
+def _case_key(stage, content, megapixels, alpha):
+    return f"{stage}/{content}{'+alpha' if alpha else ''}/{megapixels}mp"
+
+
+def _run_child(stage, path, repeat):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", stage, path, "--repeat", str(repeat)],
+        check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _format_result(key, r):
+    if "psnr" in r:
+        return f"  {key:<40} " + "  ".join(f"r={k}: {v:6.2f} dB" for k, v in r["psnr"].items())
+    line = (f"  {key:<40} {r['seconds'] * 1000:9.1f} ms  {r['megapixels'] / r['seconds']:8.1f} MP/s"
+            f"  峰值 +{r['peak_mb']:7.1f} MB")
+    if "attempts" in r:
+        line += f"  編碼 {r['attempts']} 次  {r['output_kb']:.1f}/{r['target_kb']} KB"
+    if "budget_mb" in r:
+        line += f"  預算 {r['budget_mb']:.1f} MB"
+    if "max_diff" in r:
+        line += f"  與 LUT 最大差異 {r['max_diff']}"
+    return line
+
+
+def check_memory_budget(results):
+    """回傳超過 MEMORY_BUDGET 的項目說明清單。"""
+    return [f"{key}: 峰值記憶體 {r['peak_mb']:.1f} MB 超過預算 {r['budget_mb']:.1f} MB"
+            for key, r in results.items() if "budget_mb" in r and r["peak_mb"] > r["budget_mb"]]
+
+
+def compare_to_baseline(results, baseline, tolerance=TOLERANCE):
+    """回傳退步項目的說明清單；基準中沒有的情境不比較。"""
+    regressions = []
+    for key, r in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if "psnr" in r:
+            for radius, value in r["psnr"].items():
+                if radius in base.get("psnr", {}) and value < base["psnr"][radius] - PSNR_SLACK_DB:
+                    regressions.append(f"{key} r={radius}: PSNR {base['psnr'][radius]:.2f} → {value:.2f} dB")
+            continue
+        speed, base_speed = r["megapixels"] / r["seconds"], base["megapixels"] / base["seconds"]
+        if speed < base_speed * (1 - tolerance):
+            regressions.append(f"{key}: {base_speed:.1f} → {speed:.1f} MP/s（{speed / base_speed - 1:+.0%}）")
+        if r["peak_mb"] > base["peak_mb"] * (1 + tolerance) + PEAK_SLACK_MB:
+            regressions.append(f"{key}: 峰值記憶體 {base['peak_mb']:.1f} → {r['peak_mb']:.1f} MB")
+        if r.get("attempts", 0) > base.get("attempts", r.get("attempts", 0)):
+            regressions.append(f"{key}: 編碼次數 {base['attempts']} → {r['attempts']}")
+    return regressions
+
+
+def _parse_list(text, choices, convert=str):
+    values = [convert(v) for v in text.split(",") if v]
+    unknown = [v for v in values if v not in choices]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"未知的值：{unknown}，可用：{list(choices)}")
+    return values
+
+
+def main(argv=None):
+    all_stages = ENHANCE_STAGES + COMPRESS_STAGES + (PSNR_STAGE,)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda t: _parse_list(t, SIZES_MP, int), default=list(SIZES_MP),
+                        help="要測的百萬像素，逗號分隔（預設 2,12,24,50）")
+    parser.add_argument("--stages", type=lambda t: _parse_list(t, all_stages), default=list(all_stages),
+                        help="要測的步驟，逗號分隔：" + ",".join(all_stages))
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="每個情境重複次數，取最快的一次")
+    parser.add_argument("--work-dir", help="測試圖片存放處（可重複使用）；預設為暫存資料夾")
+    parser.add_argument("--baseline", help=f"比較的基準 JSON；預設為存在時的 {DEFAULT_BASELINE}")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把這次的結果存成基準")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="速度與記憶體容許退步的比例")
+    parser.add_argument("--json", metavar="PATH", help="另外輸出完整結果 JSON")
+    parser.add_argument("--child", nargs=2, metavar=("STAGE", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return _child(args.child[0], args.child[1], args.repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = os.path.abspath(args.work_dir or tmp)
+        os.makedirs(work_dir, exist_ok=True)
+        results = {}
+        for stage, content, megapixels, alpha in _cases(args.sizes, args.stages):
+            key = _case_key(stage, content, megapixels, alpha)
+            path = make_test_image(work_dir, content, megapixels, alpha)
+            results[key] = _run_child(stage, path, args.repeat)
+            print(_format_result(key, results[key]), flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 已儲存基準：{args.save_baseline}")
+
+    failed = False
+    over_budget = check_memory_budget(results)
+    if over_budget:
+        failed = True
+        print(f"\n❌ 超過記憶體預算 {len(over_budget)} 項：")
+        for line in over_budget:
+            print("  " + line)
+
+    baseline_path = args.baseline or (DEFAULT_BASELINE if os.path.exists(DEFAULT_BASELINE)
+                                      and not args.save_baseline else None)
+    if not baseline_path:
+        return 1 if failed else 0
+    with open(baseline_path, encoding="utf-8") as f:
+        regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n❌ 相對 {baseline_path} 退步 {len(regressions)} 項：")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print(f"\n✅ 沒有超過容許範圍的退步（基準：{baseline_path}）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
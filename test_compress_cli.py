@@ -0,0 +1,38 @@
+"""
+PhotoCLI compress（命令列批次壓縮）的日誌檢查。
+
+    python -m pytest -q test_compress_cli.py
+"""
+import os
+import types
+
+import cv2
+import numpy as np
+
+import PhotoCLI
+from PhotoCompressor import run_batch_compression
+
+
+def _write_photos(folder, count=2):
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        img = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+        cv2.imwrite(os.path.join(folder, f"photo_{i}.jpg"), img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+
+def test_cli_compress_has_no_filename_warning(tmp_path, capsys):
+    _write_photos(tmp_path)
+    exit_code = PhotoCLI.main(["compress", str(tmp_path), "-o", str(tmp_path / "out"),
+                               "--target-kb", "10", "--workers", "1"])
+    out = capsys.readouterr().out
+    assert exit_code == 0
+    assert "⚠️ 警告" not in out
+    assert sorted(os.listdir(tmp_path / "out")) == ["photo_0.jpg", "photo_1.jpg"]
+
+
+def test_file_object_without_orig_name_still_warns(tmp_path):
+    # 舊版 Gradio 的暫存檔物件沒有原始檔名時才需要提醒
+    _write_photos(tmp_path, count=1)
+    temp_file = types.SimpleNamespace(name=str(tmp_path / "photo_0.jpg"))
+    log = run_batch_compression([temp_file], str(tmp_path / "out"), "10", False)
+    assert "⚠️ 警告：無法獲取文件" in log
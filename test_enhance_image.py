@@ -0,0 +1,131 @@
+"""
+enhance_image（單次 HSV 來回、查表）與原本逐步處理流程的比對。
+
+    python -m pytest -q test_enhance_image.py
+
+原流程在亮部壓縮與自然飽和度之間會先轉回 BGR 再轉一次 HSV，中間的 uint8 量化
+在融合版中不存在，因此 curve / limited 無法做到逐像素 ±1：
+以下的合成照片最多相差 3，相差超過 1 的數值約 2.5%。blend 的結果與原流程相同。
+
+另外以 tracemalloc 檢查 inplace=True 的配置峰值不超過 bench_suite.MEMORY_BUDGET。
+"""
+import tracemalloc
+
+import cv2
+import numpy as np
+import pytest
+
+from PhotoEnhancer import (DEFAULT_PARAMS, ResultCache, enhance_image, process_single_image,
+                           release_scratch_buffers)
+from bench_suite import MEMORY_BUDGET, _photo_image, reference_highlights, reference_tone
+
+# curve / limited 容許的差異（見模組說明）
+HSV_MAX_DIFF = 3
+HSV_MAX_FRACTION_OVER_1 = 0.04
+# 記憶體預算測試的圖片大小：blend 帶狀混合的浮點暫存與圖片大小無關（約 9 MB），
+# 圖片需夠大，每像素的數字才有意義（6 MP 時約 10.3 B/px）
+BUDGET_SIZE = (3000, 2000)
+
+
+# ---------- 原本的逐步處理流程（浮點運算，每步各自轉換 HSV）----------
+def _reference_blend(img, threshold, blend_strength, blur_radius):
+    v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))[2]
+    mask_blur = cv2.GaussianBlur((v > threshold).astype(np.float32), (blur_radius, blur_radius), 0)
+    soft = cv2.GaussianBlur(img, (blur_radius, blur_radius), 0)
+    blended = img.astype(np.float32) * (1 - mask_blur[..., None] * blend_strength) + \
+              soft.astype(np.float32) * (mask_blur[..., None] * blend_strength)
+    return np.clip(blended, 0, 255).astype(np.uint8)
+
+def _reference_saturation(img, strength):
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
+    h, s, v = cv2.split(hsv)
+    s = np.clip(s + (np.mean(s) - s) * (-strength), 0, 255)
+    return cv2.cvtColor(cv2.merge([h, s, v]).astype(np.uint8), cv2.COLOR_HSV2BGR)
+
+def reference_enhance(img, exposure, dehaze_ratio, highlight_method,
+                      curve_threshold, curve_softness,
+                      limited_threshold, limited_softness,
+                      blend_threshold, blend_strength, blend_radius,
+                      sat_strength):
+    img = reference_tone(img, exposure, dehaze_ratio)
+    if highlight_method == "curve":
+        img = reference_highlights(img, curve_threshold, curve_softness, False)
+    elif highlight_method == "limited":
+        img = reference_highlights(img, limited_threshold, limited_softness, True)
+    elif highlight_method == "blend":
+        img = _reference_blend(img, blend_threshold, blend_strength, blend_radius)
+    return _reference_saturation(img, sat_strength)
+
+
+def _photo(seed, height=480, width=640):
+    # 平滑的色塊加上雜訊，並放大對比讓亮部超過門檻
+    rng = np.random.default_rng(seed)
+    base = cv2.resize(rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8),
+                      (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.normal(0, 12, (height, width, 3))
+    return np.clip(base * 1.3 + noise, 0, 255).astype(np.uint8)
+
+def _params(method):
+    params = dict(DEFAULT_PARAMS, highlight_method=method)
+    return tuple(params.values())
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("method", ["curve", "limited"])
+def test_hsv_methods_match_reference(method, seed):
+    img = _photo(seed)
+    diff = np.abs(enhance_image(img.copy(), *_params(method)).astype(np.int16)
+                  - reference_enhance(img, *_params(method)).astype(np.int16))
+    assert diff.max() <= HSV_MAX_DIFF
+    assert np.mean(diff > 1) <= HSV_MAX_FRACTION_OVER_1
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_blend_matches_reference(seed):
+    img = _photo(seed)
+    diff = np.abs(enhance_image(img.copy(), *_params("blend")).astype(np.int16)
+                  - reference_enhance(img, *_params("blend")).astype(np.int16))
+    assert diff.max() <= 1
+
+
+@pytest.mark.parametrize("tile_size", [None, 128])
+def test_single_image_keeps_input(tile_size):
+    img = _photo(0)
+    original = img.copy()
+    result = process_single_image(img, *_params("blend"), tile_size=tile_size)
+    assert result is not img
+    assert np.array_equal(img, original)
+    assert img.flags.writeable
+
+
+def test_uncached_result_stays_writeable():
+    # 結果大於 max_bytes 時不存入快取，回傳的陣列不應被設為唯讀
+    img = _photo(0)
+    cache = ResultCache(max_bytes=img.nbytes - 1)
+    result = process_single_image(img, *_params("blend"), cache=cache)
+    assert result.flags.writeable
+    assert cache.bytes == 0
+
+    cache = ResultCache(max_bytes=img.nbytes)
+    stored = process_single_image(img, *_params("blend"), cache=cache)
+    assert not stored.flags.writeable
+    assert process_single_image(img, *_params("blend"), cache=cache) is stored
+
+
+@pytest.mark.parametrize("method", ["curve", "limited", "blend", "blend_fast"])
+def test_inplace_peak_memory_within_budget(method):
+    # 與 bench_suite 相同的預算（每個輸入像素的位元組數），但以 tracemalloc 計算 numpy / OpenCV 陣列的配置峰值，
+    # 不另加常駐記憶體的容許量；先釋放暫存緩衝區，第一次配置也計入
+    width, height = BUDGET_SIZE
+    img = _photo_image(width, height)
+    params = dict(DEFAULT_PARAMS, highlight_method=method,
+                  curve_threshold=210, limited_threshold=210, blend_threshold=210)
+    release_scratch_buffers()
+    tracemalloc.start()
+    try:
+        enhance_image(img, *params.values(), inplace=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        release_scratch_buffers()
+    assert peak <= MEMORY_BUDGET[f"enhance_{method}"] * width * height